@@ -2,24 +2,40 @@ import logging
 logger = logging.getLogger(__name__)
 
 from fastapi import Depends, HTTPException, status, Request
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
+from app.cache import MISSING, MemoryCache
 from app.models import User
-from app.database import get_db
+from app.database import SessionLocal
+from app.utils.hashing_utils import BoundedExecutor, PoolSaturated
 
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
+from itertools import chain
 import os
-from typing import Optional
+from typing import NamedTuple, Optional
 
 # Config (keep simple)
 SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret')
 ALGORITHM = os.getenv('ALGORITHM', 'HS256')
 ACCESS_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '30'))
+# Authenticated users are cached per worker. Changes made by other workers/processes
+# are picked up within USER_CACHE_TTL_SECONDS
+USER_CACHE_TTL_SECONDS = int(os.getenv('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_SIZE = int(os.getenv('USER_CACHE_MAX_SIZE', '10000'))
+
+# bcrypt cost factor for new hashes. Existing hashes keep verifying at their own cost
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+# Dedicated hashing pool. 0 workers hashes on the shared FastAPI threadpool, without backpressure
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', str(PASSWORD_HASH_WORKERS * 8)))
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'thread')  # thread or process
 
 # Minimal password hashing wrapper
-pwd = CryptContext(schemes=['bcrypt'], deprecated='auto')
+pwd = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=BCRYPT_ROUNDS)
+hash_pool = BoundedExecutor(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE, kind=PASSWORD_HASH_EXECUTOR, name='password-hash')
 
 
 def hash_password(password: str) -> str:
@@ -30,13 +46,60 @@ def verify_password(plain: str, hashed: str) -> bool:
     return pwd.verify(plain, hashed)
 
 
-def create_token(user_id: int, expires_minutes: Optional[int] = ACCESS_EXPIRE_MINUTES) -> str:
+async def hash_password_async(password: str) -> str:
+    '''`hash_password` on the bounded hashing pool. Raises 429 if the pool is saturated'''
+    try:
+        return await hash_pool.run(hash_password, password)
+    except PoolSaturated:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail='too many requests, retry shortly',
+                            headers={'Retry-After': '1'})
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    '''`verify_password` on the bounded hashing pool. Raises 429 if the pool is saturated'''
+    try:
+        return await hash_pool.run(verify_password, plain, hashed)
+    except PoolSaturated:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail='too many requests, retry shortly',
+                            headers={'Retry-After': '1'})
+
+
+class Principal(NamedTuple):
+    '''The authenticated user, as needed by request handlers (no ORM session attached)'''
+    id: int
+    email: str
+    is_admin: bool
+    token_version: int
+
+
+# Principals by user id. A missing user is cached as None so bad tokens don't hit the DB either
+user_cache = MemoryCache(max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+USER_NAMESPACE = 'user'
+
+
+def create_token(user_id: int, expires_minutes: Optional[int] = ACCESS_EXPIRE_MINUTES,
+                 is_admin: bool = False, token_version: int = 0) -> str:
+    '''Token claims: `sub` user id, `adm` admin flag and `ver` the user's token version when issued'''
     expiry = datetime.utcnow() + timedelta(minutes=expires_minutes)
-    to_encode = {'sub': str(user_id), 'exp': expiry}
+    to_encode = {'sub': str(user_id), 'exp': expiry, 'adm': bool(is_admin), 'ver': token_version}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
+def load_principal(user_id: int) -> Optional[Principal]:
+    '''Return the user's principal from the cache, querying the users table only on a miss'''
+    principal = user_cache.get(USER_NAMESPACE, user_id)
+    if principal is MISSING:
+        db = SessionLocal()
+        try:
+            user = db.get(User, user_id)
+            principal = Principal(user.id, user.email, user.is_admin, user.token_version) if user else None
+        finally:
+            db.close()
+        user_cache.set(USER_NAMESPACE, user_id, principal)
+    return principal
+
+
+def get_current_user(request: Request) -> Principal:
     '''
     Retrieve the current user based on the JWT token in the Authorization header.
     Returns logged-in user or raises 401 if invalid or missing.
@@ -52,19 +115,65 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = int(payload.get('sub'))
-    except (JWTError, ValueError):
+        token_version = int(payload.get('ver', 0))
+        request.state.token_admin = bool(payload.get('adm', False))
+    except (JWTError, ValueError, TypeError):
         logger.warning('Invalid token')
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='invalid token')
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = load_principal(user_id)
     if not user:
         logger.warning('User not found for token')
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='user not found')
+    if token_version != user.token_version:
+        logger.warning(f'Revoked token for user {user_id}')
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='token revoked')
     return user
 
 
-def require_admin(current_user: User = Depends(get_current_user)) -> User:
-    if not getattr(current_user, 'is_admin', False):
+def require_admin(request: Request, current_user: Principal = Depends(get_current_user)) -> Principal:
+    '''
+    The current user if the token's `adm` claim is set, else 403. No DB lookup: `get_current_user`
+    has checked the token's `ver` against the user's token_version, and changing `is_admin` bumps
+    token_version, so the claim is the role the user still has
+    '''
+    if not request.state.token_admin:
         logger.warning('Admin privileges required')
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail='admin privileges required')
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+## Keep user_cache in step with writes to users made through this process
+_USER_CHANGES = 'user_changes'
+
+@event.listens_for(Session, 'after_flush')
+def _collect_user_changes(session, flush_context):
+    # After the flush, so new users have their ids: SQLite can reuse a deleted user's id,
+    # whose principal may be cached as missing
+    ids = {obj.id for obj in chain(session.new, session.dirty, session.deleted) if isinstance(obj, User)}
+    if ids:
+        session.info.setdefault(_USER_CHANGES, set()).update(ids)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_user_changes(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is User:
+            orm_execute_state.session.info[_USER_CHANGES] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_changed_users(session):
+    if _USER_CHANGES not in session.info:
+        return
+    user_ids = session.info.pop(_USER_CHANGES)
+    if user_ids is None:
+        user_cache.invalidate(USER_NAMESPACE)
+    else:
+        user_cache.invalidate(USER_NAMESPACE, *user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_changes(session):
+    session.info.pop(_USER_CHANGES, None)
@@ -0,0 +1,185 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Pluggable cache for computed aggregates (e.g. per-country average risk score).
+
+Entries live under a namespace and a key. String keys are normalised with `normalise_key`, so
+`South Africa` and `south africa` share an entry. Two backends:
+- `MemoryCache`: per-process, LRU-bounded, with TTL
+- `DatabaseCache`: stored in the `aggregate_cache` table, so shared by all workers
+Select with AGGREGATE_CACHE_BACKEND=memory|database.
+'''
+from sqlalchemy import delete, func, select
+
+from app.database import SessionLocal
+from app.models import AggregateCacheEntry, normalise_key
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import json
+import os
+import threading
+import time
+from typing import Any, Optional
+
+CACHE_BACKEND = os.getenv('AGGREGATE_CACHE_BACKEND', 'memory')
+CACHE_MAX_SIZE = int(os.getenv('AGGREGATE_CACHE_MAX_SIZE', '1024'))
+CACHE_TTL_SECONDS = int(os.getenv('AGGREGATE_CACHE_TTL_SECONDS', '3600'))
+
+# Returned by `get` on a miss, as None can be a valid cached value
+MISSING = object()
+
+
+def _key(key: Any) -> str:
+    return normalise_key(key) if isinstance(key, str) else str(key)
+
+
+class AggregateCache:
+    '''Cache interface. Implementations must be safe to call from multiple threads'''
+
+    def get(self, namespace: str, key: Any) -> Any:
+        '''Return the cached value, or `MISSING` if absent or expired'''
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: Any, value: Any, ttl: Optional[int] = None) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, namespace: str, *keys: Any) -> None:
+        '''Drop the given keys from a namespace, or the whole namespace if no keys are given'''
+        raise NotImplementedError
+
+    def evict_keys(self, *keys: Any) -> None:
+        '''Drop the given keys from every namespace'''
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryCache(AggregateCache):
+    '''Process-local LRU cache with per-entry expiry'''
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, ttl: int = CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (namespace, key) -> (expires monotonic time, value)
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        entry_key = (namespace, _key(key))
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                return MISSING
+            if entry[0] <= time.monotonic():
+                del self._entries[entry_key]
+                return MISSING
+            self._entries.move_to_end(entry_key)
+            return entry[1]
+
+    def set(self, namespace, key, value, ttl=None):
+        entry_key = (namespace, _key(key))
+        with self._lock:
+            self._entries[entry_key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, namespace, *keys):
+        with self._lock:
+            if keys:
+                for key in keys:
+                    self._entries.pop((namespace, _key(key)), None)
+            else:
+                for entry_key in [k for k in self._entries if k[0] == namespace]:
+                    del self._entries[entry_key]
+
+    def evict_keys(self, *keys):
+        keys = {_key(k) for k in keys}
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[1] in keys]:
+                del self._entries[entry_key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DatabaseCache(AggregateCache):
+    '''Cache stored in the `aggregate_cache` table. Values must be JSON-serialisable'''
+
+    def __init__(self, max_size: int = CACHE_MAX_SIZE, ttl: int = CACHE_TTL_SECONDS, session_factory=SessionLocal):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.session_factory = session_factory
+
+    def get(self, namespace, key):
+        db = self.session_factory()
+        try:
+            entry = db.get(AggregateCacheEntry, (namespace, _key(key)))
+            if entry is None or entry.expires_at <= datetime.utcnow():
+                return MISSING
+            return json.loads(entry.value)
+        finally:
+            db.close()
+
+    def set(self, namespace, key, value, ttl=None):
+        db = self.session_factory()
+        try:
+            db.merge(AggregateCacheEntry(
+                namespace=namespace,
+                key=_key(key),
+                value=json.dumps(value),
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl or self.ttl)
+            ))
+            db.flush()
+            # Size bound: evict the entries closest to expiry
+            excess = db.scalar(select(func.count()).select_from(AggregateCacheEntry)) - self.max_size
+            if excess > 0:
+                oldest = select(AggregateCacheEntry.namespace, AggregateCacheEntry.key)\
+                    .order_by(AggregateCacheEntry.expires_at).limit(excess)
+                for namespace_, key_ in db.execute(oldest).all():
+                    db.execute(delete(AggregateCacheEntry).where(
+                        AggregateCacheEntry.namespace == namespace_, AggregateCacheEntry.key == key_))
+            db.commit()
+        finally:
+            db.close()
+
+    def invalidate(self, namespace, *keys):
+        db = self.session_factory()
+        try:
+            stmt = delete(AggregateCacheEntry).where(AggregateCacheEntry.namespace == namespace)
+            if keys:
+                stmt = stmt.where(AggregateCacheEntry.key.in_([_key(k) for k in keys]))
+            db.execute(stmt)
+            db.commit()
+        finally:
+            db.close()
+
+    def evict_keys(self, *keys):
+        db = self.session_factory()
+        try:
+            db.execute(delete(AggregateCacheEntry).where(AggregateCacheEntry.key.in_([_key(k) for k in keys])))
+            db.commit()
+        finally:
+            db.close()
+
+    def clear(self):
+        db = self.session_factory()
+        try:
+            db.execute(delete(AggregateCacheEntry))
+            db.commit()
+        finally:
+            db.close()
+
+
+def build_cache(backend: str = CACHE_BACKEND) -> AggregateCache:
+    if backend == 'database':
+        return DatabaseCache()
+    if backend != 'memory':
+        logger.warning(f'Unknown AGGREGATE_CACHE_BACKEND {backend}, using memory')
+    return MemoryCache()
+
+
+aggregate_cache = build_cache()
@@ -0,0 +1,114 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Request coalescing for the read endpoints.
+
+`CoalescingMiddleware` lets identical GET/HEAD requests that arrive while one is already being
+served wait for that one (the leader) and get a copy of its response, instead of each running the
+same queries and serialising the same body. Requests are identical when they have the same method,
+path, query string and the headers a response can depend on (COALESCE_HEADERS: e.g. two clients
+with different tokens or If-None-Match values never share a response).
+
+Only paths under COALESCE_PATHS are coalesced, and only responses up to COALESCE_MAX_BODY_BYTES
+are kept for sharing. If the leader's response can't be shared (too large, a 429 or 5xx, or the
+leader failed), each waiting request runs on its own. Waiting requests skip the route's
+dependencies, but not rate limiting: if the leader was charged a token, each of them takes one
+from its own client's bucket for the same route before getting the copy, or gets a 429, as it
+would have without coalescing.
+
+Coalescing is per process, and only ever joins requests that overlap in time; nothing is cached
+after the leader's response completes.
+'''
+from app.instrumentation import Counter, route_label
+from app.rate_limit import LIMITED_ROUTE, charge_copy
+
+import asyncio
+import os
+
+REQUEST_COALESCING = os.getenv('REQUEST_COALESCING', 'True') == 'True'
+COALESCE_PATHS = tuple(
+    path.strip() for path in
+    os.getenv('COALESCE_PATHS', '/v1/conflictdata,/v1/countries,/v1/regions,/v1/history').split(',') if path.strip()
+)
+COALESCE_MAX_BODY_BYTES = int(os.getenv('COALESCE_MAX_BODY_BYTES', str(1024 * 1024)))
+COALESCE_HEADERS = (b'accept', b'accept-encoding', b'authorization', b'if-none-match')
+
+coalesced_total = Counter('coalesced_requests_total', 'Requests served a copy of a concurrent identical request\'s response')
+
+
+class CoalescingMiddleware:
+    '''ASGI middleware sharing one response between identical concurrent GET requests'''
+
+    def __init__(self, app, paths: tuple = COALESCE_PATHS, max_body_bytes: int = COALESCE_MAX_BODY_BYTES,
+                 enabled: bool = REQUEST_COALESCING):
+        self.app = app
+        self.paths = paths
+        self.max_body_bytes = max_body_bytes
+        self.enabled = enabled
+        # Request key -> future of the leader's (scope, response messages), or None if not shareable.
+        # Only touched from the event loop
+        self._in_flight = {}
+
+    def _key(self, scope: dict) -> tuple:
+        headers = tuple(sorted((name, value) for name, value in scope['headers'] if name in COALESCE_HEADERS))
+        return scope['method'], scope['path'], scope['query_string'], headers
+
+    async def __call__(self, scope, receive, send):
+        if (not self.enabled or scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD')
+                or not scope['path'].startswith(self.paths)):
+            await self.app(scope, receive, send)
+            return
+        key = self._key(scope)
+        leader = self._in_flight.get(key)
+        if leader is not None:
+            # Shielded, so a waiting request that disconnects doesn't cancel the leader's result for the others
+            shared = await asyncio.shield(leader)
+            if shared is not None:
+                leader_scope, messages = shared
+                # Label the copy with the leader's route for the access log and metrics
+                for name in ('route', 'endpoint', 'path_params'):
+                    if name in leader_scope:
+                        scope[name] = leader_scope[name]
+                if LIMITED_ROUTE in leader_scope:
+                    rejected = await charge_copy(scope, leader_scope[LIMITED_ROUTE])
+                    if rejected is not None:
+                        await rejected(scope, receive, send)
+                        return
+                await self._replay(scope, send, messages)
+                return
+            await self.app(scope, receive, send)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        messages = []
+        size = 0
+        shareable = True
+        complete = False
+
+        async def capture(message):
+            nonlocal size, shareable, complete
+            if shareable:
+                if message['type'] == 'http.response.start':
+                    shareable = message['status'] != 429 and message['status'] < 500
+                elif message['type'] == 'http.response.body':
+                    size += len(message.get('body', b''))
+                    shareable = size <= self.max_body_bytes
+                    complete = not message.get('more_body', False)
+                if shareable:
+                    messages.append(message)
+                else:
+                    messages.clear()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            del self._in_flight[key]
+            future.set_result((scope, messages) if shareable and complete else None)
+
+    async def _replay(self, scope: dict, send, messages: list) -> None:
+        coalesced_total.inc((scope['method'], route_label(scope)))
+        for message in messages:
+            await send(message)
@@ -0,0 +1,145 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Change notifications for conflict_data.
+
+Session events collect the country keys touched by each transaction. Two kinds of hook get them:
+- write hooks, called with (session, country keys) just before the transaction commits, for
+  derived tables that must stay consistent with conflict_data
+- change hooks, called with the country keys once the transaction commits (never on rollback)
+ORM writes are picked up automatically; Core statements (e.g. bulk upserts) must call
+`mark_conflict_data_changed`. Country keys are a set of `country_key`s, or None if the whole table may have changed.
+'''
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import ConflictData
+
+from itertools import chain
+from typing import Callable, Iterable, Optional
+
+_CHANGES = 'conflict_data_changes'
+# Stored in session.info when a bulk statement may have touched any country
+_ALL = 'all'
+
+_hooks = []
+_write_hooks = []
+
+
+def on_conflict_data_change(hook: Callable[[Optional[set]], None]) -> Callable:
+    '''Register a hook to be called with changed country keys after each commit. Usable as a decorator'''
+    _hooks.append(hook)
+    return hook
+
+
+def on_conflict_data_write(hook: Callable[[Session, Optional[set]], None]) -> Callable:
+    '''
+    Register a hook to be called with (session, changed country keys) inside the transaction, before commit.
+    Exceptions abort the commit. Usable as a decorator
+    '''
+    _write_hooks.append(hook)
+    return hook
+
+
+def mark_conflict_data_changed(session: Session, country_keys: Optional[Iterable[str]] = None) -> None:
+    '''Record that the session's transaction changed these countries (None: any country)'''
+    if country_keys is None:
+        session.info[_CHANGES] = _ALL
+        return
+    changes = session.info.setdefault(_CHANGES, set())
+    if changes is not _ALL:
+        changes.update(country_keys)
+
+
+@on_conflict_data_change
+def _invalidate_aggregates(country_keys):
+    # Aggregates are cached per country key, so drop any computed from the changed countries.
+    # Imported here as app.cache depends on app.models, which imports this module
+    from app.cache import aggregate_cache
+    if country_keys is None:
+        aggregate_cache.clear()
+    else:
+        aggregate_cache.evict_keys(*country_keys)
+
+
+@on_conflict_data_change
+def _invalidate_snapshot(country_keys):
+    # The snapshot is rebuilt whole, so any change makes it stale. Imported here for the same reason
+    from app.snapshot import snapshot_store
+    snapshot_store.invalidate()
+
+
+@on_conflict_data_change
+def _invalidate_region_index(country_keys):
+    # The index reloads changed countries from their data versions. Imported here for the same reason
+    from app.search import region_index
+    region_index.invalidate()
+
+
+@on_conflict_data_write
+def _refresh_summaries(session, country_keys):
+    # Imported here as statistical_utils depends on app.models, which imports this module
+    from app.utils.statistical_utils import refresh_country_summaries
+    refresh_country_summaries(session, country_keys)
+
+
+@on_conflict_data_write
+def _bump_versions(session, country_keys):
+    # Imported here for the same reason
+    from app.utils.version_utils import bump_data_versions
+    bump_data_versions(session, country_keys)
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_orm_changes(session, flush_context, instances):
+    keys = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(obj, ConflictData):
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        history = inspect(obj).attrs.country_key.history
+        keys.update(k for k in chain(history.added, history.unchanged, history.deleted) if k)
+    if keys:
+        mark_conflict_data_changed(session, keys)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_changes(orm_execute_state):
+    # Bulk ORM update/delete (e.g. `query.delete()`) bypass the flush
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is ConflictData:
+            mark_conflict_data_changed(orm_execute_state.session)
+
+
+@event.listens_for(Session, 'before_commit')
+def _apply_write_hooks(session):
+    # Flush first so pending ORM changes are collected by `_collect_orm_changes`
+    session.flush()
+    changes = session.info.get(_CHANGES)
+    if not changes:
+        return
+    country_keys = None if changes is _ALL else set(changes)
+    for hook in _write_hooks:
+        hook(session, country_keys)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify(session):
+    changes = session.info.pop(_CHANGES, None)
+    if not changes:
+        return
+    country_keys = None if changes is _ALL else changes
+    logger.debug(f'conflict_data changed for {country_keys or "all countries"}')
+    for hook in _hooks:
+        try:
+            hook(country_keys)
+        except Exception as e:
+            logger.error(f'conflict_data change hook {hook.__name__} failed: {e}')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard(session):
+    session.info.pop(_CHANGES, None)
@@ -1,22 +1,119 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, sessionmaker
 
+from app.instrumentation import instrument_engine
+from app.slow_queries import watch_slow_queries
+
 import os
+from typing import Optional
 
 # Database URL from env or default to local SQLite file
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./data.db')
+DEBUG = os.getenv('DEBUG', 'False') == 'True'
+
+# An async driver in DATABASE_URL (e.g. sqlite+aiosqlite, postgresql+asyncpg) enables async mode.
+# The sync engine is still needed for scripts, migrations and the routes without async versions,
+# so it uses the equivalent sync driver
+ASYNC_DRIVERS = {'sqlite+aiosqlite': 'sqlite', 'postgresql+asyncpg': 'postgresql+psycopg2'}
+_url = make_url(DATABASE_URL)
+ASYNC_DB = _url.drivername in ASYNC_DRIVERS
+SYNC_DATABASE_URL = _url.set(drivername=ASYNC_DRIVERS[_url.drivername]) if ASYNC_DB else _url
+
+IS_SQLITE = DATABASE_URL.startswith('sqlite')
+# In-memory SQLite uses a single-connection pool that takes no sizing options
+IS_MEMORY_SQLITE = IS_SQLITE and _url.database in (None, '', ':memory:')
+
+# Engine profile. `production` tunes pool and SQLite settings for concurrent readers/writers;
+# `minimal` keeps the SQLAlchemy/SQLite defaults. Each setting can be overridden from env
+DB_PROFILE = os.getenv('DB_PROFILE', 'production')
+PROFILES = {
+    'minimal': {},
+    'production': {
+        # Pool sized to FastAPI's 40-thread pool, so a request thread never waits on a connection
+        # that another request cannot release
+        'DB_POOL_SIZE': '20',
+        'DB_MAX_OVERFLOW': '20',
+        'DB_POOL_TIMEOUT': '30',
+        'DB_POOL_RECYCLE': '1800',
+        'DB_POOL_PRE_PING': 'True',
+        # WAL lets readers run alongside a writer; NORMAL sync is durable across app crashes in WAL mode
+        'SQLITE_JOURNAL_MODE': 'WAL',
+        'SQLITE_SYNCHRONOUS': 'NORMAL',
+        'SQLITE_BUSY_TIMEOUT_MS': '5000',
+        'SQLITE_MMAP_SIZE': str(256 * 1024 * 1024),
+        'SQLITE_CACHE_SIZE': str(-64 * 1024),  # negative: KiB, i.e. 64 MiB
+    },
+}
+if DB_PROFILE not in PROFILES:
+    logger.warning(f'Unknown DB_PROFILE {DB_PROFILE}, using production')
+    DB_PROFILE = 'production'
+
+
+def _setting(name: str) -> Optional[str]:
+    return os.getenv(name, PROFILES[DB_PROFILE].get(name))
+
+
+def engine_options() -> dict:
+    '''Pool keyword arguments for create_engine/create_async_engine, from the profile and env'''
+    options = {}
+    if _setting('DB_POOL_PRE_PING') is not None:
+        options['pool_pre_ping'] = _setting('DB_POOL_PRE_PING') == 'True'
+    if not IS_MEMORY_SQLITE:
+        for name, option in (('DB_POOL_SIZE', 'pool_size'), ('DB_MAX_OVERFLOW', 'max_overflow'),
+                             ('DB_POOL_TIMEOUT', 'pool_timeout'), ('DB_POOL_RECYCLE', 'pool_recycle')):
+            if _setting(name) is not None:
+                options[option] = int(_setting(name))
+    return options
+
+
+def sqlite_pragmas() -> list:
+    '''PRAGMA statements to run on each new SQLite connection'''
+    pragmas = []
+    for name, pragma in (('SQLITE_JOURNAL_MODE', 'journal_mode'), ('SQLITE_SYNCHRONOUS', 'synchronous'),
+                         ('SQLITE_BUSY_TIMEOUT_MS', 'busy_timeout'), ('SQLITE_MMAP_SIZE', 'mmap_size'),
+                         ('SQLITE_CACHE_SIZE', 'cache_size')):
+        value = _setting(name)
+        if value is not None and not (pragma == 'journal_mode' and IS_MEMORY_SQLITE):
+            pragmas.append(f'PRAGMA {pragma}={value}')
+    return pragmas
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
 
 # Use SQLite-specific connection args when appropriate
-connect_args = {'check_same_thread': False} if DATABASE_URL.startswith('sqlite') else {}
+connect_args = {'check_same_thread': False} if IS_SQLITE else {}
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args, echo=os.getenv('DEBUG', 'False') == 'True')
+engine = create_engine(SYNC_DATABASE_URL, connect_args=connect_args, echo=DEBUG, **engine_options())
+if IS_SQLITE:
+    event.listen(engine, 'connect', _apply_sqlite_pragmas)
+instrument_engine(engine)
+watch_slow_queries(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+async_engine = None
+AsyncSessionLocal = None
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    async_engine = create_async_engine(DATABASE_URL, echo=DEBUG, **engine_options())
+    if IS_SQLITE:
+        event.listen(async_engine.sync_engine, 'connect', _apply_sqlite_pragmas)
+    instrument_engine(async_engine.sync_engine)
+    watch_slow_queries(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
 
 def get_db():
     '''Yield a database session (dependency for FastAPI).'''
@@ -26,3 +123,15 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Set in the `info` of the sync session behind each async route's session. Code given that session
+# through `run_sync` runs on the event loop thread, so must hand CPU-heavy work to another thread
+EVENT_LOOP_SESSION = 'event_loop'
+
+
+async def get_async_db():
+    '''Yield an async database session (dependency for the async routes).'''
+    async with AsyncSessionLocal() as db:
+        db.sync_session.info[EVENT_LOOP_SESSION] = True
+        yield db
@@ -2,10 +2,13 @@ import logging
 logger = logging.getLogger(__name__)
 
 from app.database import engine
+from app.migrations import run_migrations
 from app.models import Base
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # Bring existing databases up to date; create_all does not alter existing tables
+    run_migrations()
 
 if __name__ == '__main__':
     init_db()
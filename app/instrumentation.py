@@ -0,0 +1,330 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Per-request timing and SQL instrumentation.
+
+`InstrumentationMiddleware` times each request and, through the engine hooks registered by
+`instrument_engine`, counts the SQL statements it runs, the time spent in them and the rows fetched.
+Each request then gets:
+- a `Server-Timing` header (time up to the response headers, so a streamed body's queries are
+  counted in the log and metrics but not the header)
+- an `app.access` log line carrying the numbers as structured fields (see LOG_FORMAT=json in
+  `app.logging_config`), at warning level when it ran more than SQL_STATEMENT_WARN_THRESHOLD
+  statements, which usually means a per-row query (N+1)
+- samples in the per-route histograms served by `/metrics` in Prometheus text format
+
+Statements are attributed to the request through a context variable, which FastAPI copies into the
+threadpool (sync routes, streamed bodies) and SQLAlchemy into its greenlets (async routes).
+Statements run outside a request (startup, scripts) are not counted.
+'''
+import sqlalchemy
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+from contextvars import ContextVar
+import os
+import threading
+import time
+from typing import Optional
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+ACCESS_LOG = os.getenv('ACCESS_LOG', 'True') == 'True'
+SQL_STATEMENT_WARN_THRESHOLD = int(os.getenv('SQL_STATEMENT_WARN_THRESHOLD', '50'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+access_logger = logging.getLogger('app.access')
+_QUERY_STARTS = 'instrumentation_query_starts'
+
+
+class RequestMetrics:
+    '''Counters for one request'''
+    __slots__ = ('request', 'started', 'statements', 'db_seconds', 'rows')
+
+    def __init__(self, request: Optional[str] = None):
+        self.request = request  # e.g. `GET /v1/conflictdata/Kenya`
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+    def server_timing(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000
+        return (f'app;dur={total:.1f}, '
+                f'db;dur={self.db_seconds * 1000:.1f};desc="{self.statements} statements, {self.rows} rows"')
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+
+def current_request_metrics() -> Optional[RequestMetrics]:
+    '''Counters of the request being served, or None outside a request'''
+    return _current.get()
+
+
+class _CountingFetchStrategy:
+    '''
+    Wraps a result's fetch strategy to count the rows fetched from the cursor.
+    `CursorResult.cursor_strategy` is internal to SQLAlchemy, so `check_row_counting` tests this
+    against the installed version when an engine is instrumented
+    '''
+
+    def __init__(self, strategy, metrics: RequestMetrics):
+        self._strategy = strategy
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._strategy, name)
+
+    def fetchone(self, result, dbapi_cursor, hard_close=False):
+        row = self._strategy.fetchone(result, dbapi_cursor, hard_close)
+        if row is not None:
+            self._metrics.rows += 1
+        return row
+
+    def fetchmany(self, result, dbapi_cursor, size=None):
+        rows = self._strategy.fetchmany(result, dbapi_cursor, size)
+        self._metrics.rows += len(rows)
+        return rows
+
+    def fetchall(self, result, dbapi_cursor):
+        rows = self._strategy.fetchall(result, dbapi_cursor)
+        self._metrics.rows += len(rows)
+        return rows
+
+    def yield_per(self, result, dbapi_cursor, num):
+        # Swaps in a buffered strategy, which needs wrapping in turn
+        self._strategy.yield_per(result, dbapi_cursor, num)
+        result.cursor_strategy = _CountingFetchStrategy(result.cursor_strategy, self._metrics)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault(_QUERY_STARTS, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current.get()
+    starts = conn.info.get(_QUERY_STARTS)
+    if metrics is not None and starts:
+        metrics.statements += 1
+        metrics.db_seconds += time.perf_counter() - starts.pop()
+
+
+def _after_execute(conn, clauseelement, multiparams, params, execution_options, result):
+    metrics = _current.get()
+    if metrics is not None and result.returns_rows:
+        result.cursor_strategy = _CountingFetchStrategy(result.cursor_strategy, metrics)
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get(_QUERY_STARTS) if exception_context.connection else None
+    metrics = _current.get()
+    if metrics is not None and starts:
+        metrics.statements += 1
+        metrics.db_seconds += time.perf_counter() - starts.pop()
+
+
+def check_row_counting() -> None:
+    '''
+    Count the rows of a two-row query fetched each way (fetchone, fetchall and yield_per) on an
+    in-memory SQLite engine. Raises RuntimeError if the count is wrong, as it would be after a
+    SQLAlchemy upgrade that changes its fetch strategies, rather than reporting zero rows
+    '''
+    check_engine = create_engine('sqlite://')
+    event.listen(check_engine, 'after_execute', _after_execute)
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        with check_engine.connect() as conn:
+            result = conn.execute(text('SELECT 1 UNION ALL SELECT 2'))
+            result.fetchone()
+            result.fetchall()
+            for _ in conn.execution_options(yield_per=1).execute(text('SELECT 1 UNION ALL SELECT 2')):
+                pass
+    except AttributeError as e:
+        raise RuntimeError(f'Row counting does not support SQLAlchemy {sqlalchemy.__version__}: {e}') from e
+    finally:
+        _current.reset(token)
+        check_engine.dispose()
+    if metrics.rows != 4:
+        raise RuntimeError(f'Row counting does not support SQLAlchemy {sqlalchemy.__version__}: '
+                           f'counted {metrics.rows} of 4 rows')
+
+
+def instrument_engine(engine: Engine) -> None:
+    '''Count statements, DB time and rows of requests on this (sync) engine. See `check_row_counting`'''
+    check_row_counting()
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'after_execute', _after_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+class Histogram:
+    '''Cumulative Prometheus-style histogram, per label set'''
+
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        with self._lock:
+            counts, total = self._series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._series[labels] = (counts, total + value)
+
+    def render(self, label_names: tuple) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted(self._series.items())
+        for labels, (counts, total) in series:
+            label_text = _labels(label_names, labels)
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {counts[-1]}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {counts[-1]}')
+        return lines
+
+
+class Counter:
+    '''Prometheus-style counter, per label set'''
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, label_names: tuple) -> list:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{{{_labels(label_names, labels)}}} {value}' for labels, value in values)
+        return lines
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+ROUTE_LABELS = ('method', 'route')
+request_duration = Histogram('http_request_duration_seconds', 'Request wall time, to the end of the body', LATENCY_BUCKETS)
+request_statements = Histogram('http_request_db_statements', 'SQL statements run per request', STATEMENT_BUCKETS)
+requests_total = Counter('http_requests_total', 'Requests served')
+db_seconds_total = Counter('http_request_db_seconds_total', 'Time spent in SQL statements')
+db_rows_total = Counter('http_request_db_rows_total', 'Rows fetched by SQL statements')
+
+
+def route_label(scope: dict) -> str:
+    '''Path template of the matched route, with any router prefix, e.g. `/v1/conflictdata/{country}`'''
+    route = scope.get('route')
+    path = getattr(route, 'path', None)
+    if path is None:
+        return 'unmatched'
+    try:
+        # Routes of included routers may hold their path without the prefix, so recover it
+        filled = path.format(**scope.get('path_params', {}))
+    except (KeyError, IndexError, ValueError):
+        return path
+    full_path = scope.get('path', '')
+    return full_path[:-len(filled)] + path if filled and full_path.endswith(filled) else path
+
+
+def record_request(scope: dict, status: int, metrics: RequestMetrics) -> None:
+    route = route_label(scope)
+    elapsed = time.perf_counter() - metrics.started
+    labels = (scope['method'], route)
+    request_duration.observe(labels, elapsed)
+    request_statements.observe(labels, metrics.statements)
+    requests_total.inc((scope['method'], route, str(status)))
+    db_seconds_total.inc(labels, metrics.db_seconds)
+    db_rows_total.inc(labels, metrics.rows)
+    if not ACCESS_LOG:
+        return
+    level = logging.WARNING if metrics.statements > SQL_STATEMENT_WARN_THRESHOLD else logging.INFO
+    access_logger.log(
+        level,
+        f'{scope["method"]} {scope["path"]} {status} {elapsed * 1000:.1f}ms '
+        f'sql={metrics.statements} db={metrics.db_seconds * 1000:.1f}ms rows={metrics.rows}',
+        extra={'method': scope['method'], 'path': scope['path'], 'route': route, 'status': status,
+               'duration_ms': round(elapsed * 1000, 2), 'sql_statements': metrics.statements,
+               'db_ms': round(metrics.db_seconds * 1000, 2), 'db_rows': metrics.rows}
+    )
+
+
+def render_metrics() -> str:
+    '''All metrics in Prometheus text exposition format'''
+    # Imported here as app.auth imports the database module, which imports this one (as do the others)
+    from app.auth import hash_pool
+    from app.coalescing import coalesced_total
+    from app.rate_limit import rate_limited_total
+
+    lines = [
+        *request_duration.render(ROUTE_LABELS),
+        *request_statements.render(ROUTE_LABELS),
+        *requests_total.render(('method', 'route', 'status')),
+        *db_seconds_total.render(ROUTE_LABELS),
+        *db_rows_total.render(ROUTE_LABELS),
+        *rate_limited_total.render(ROUTE_LABELS),
+        *coalesced_total.render(ROUTE_LABELS),
+    ]
+    pool = hash_pool.metrics()
+    lines += ['# HELP password_hash_pool_workers Dedicated password hashing workers (0: shared threadpool)',
+              '# TYPE password_hash_pool_workers gauge', f'password_hash_pool_workers {pool["workers"]}',
+              '# HELP password_hash_pool_rejected_total Hashing calls rejected because the pool was saturated',
+              '# TYPE password_hash_pool_rejected_total counter', f'password_hash_pool_rejected_total {pool["rejected"]}']
+    for stage in ('run', 'queue_wait'):
+        name = f'password_hash_{stage}_seconds'
+        stats = pool[stage]
+        lines += [f'# HELP {name} Password hashing {stage.replace("_", " ")} time over recent calls',
+                  f'# TYPE {name} summary',
+                  f'{name}{{quantile="0.5"}} {stats["p50_seconds"]}',
+                  f'{name}{{quantile="0.99"}} {stats["p99_seconds"]}',
+                  f'{name}_sum {stats["mean_seconds"] * stats["count"]}',
+                  f'{name}_count {stats["count"]}']
+    return '\n'.join(lines) + '\n'
+
+
+class InstrumentationMiddleware:
+    '''ASGI middleware timing each HTTP request and attributing its SQL statements to it'''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        metrics = RequestMetrics(f'{scope["method"]} {scope["path"]}')
+        token = _current.set(metrics)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if SERVER_TIMING:
+                    message = {**message, 'headers': [*message.get('headers', []),
+                                                      (b'server-timing', metrics.server_timing().encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            record_request(scope, status, metrics)
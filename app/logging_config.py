@@ -1,9 +1,35 @@
 import logging
+import json
 import os
 
+# Attributes every LogRecord has. Anything else on a record was passed in `extra` and is a structured field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    '''One JSON object per line, with any `extra` fields alongside the message'''
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
 def configure_logging():
     level = os.getenv('LOG_LEVEL', 'INFO').upper()
+    if os.getenv('LOG_FORMAT', 'text') == 'json':
+        handler = logging.StreamHandler()
+        handler.setFormatter(JSONFormatter())
+        logging.basicConfig(level=level, handlers=[handler])
+        return
     logging.basicConfig(
         level=level,
         format='%(asctime)s %(levelname)s %(name)s: %(message)s',
-    )
\ No newline at end of file
+    )
@@ -1,18 +1,65 @@
 from app.logging_config import configure_logging
 configure_logging()
 
+import logging
+logger = logging.getLogger(__name__)
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer
+from sqlalchemy.exc import SQLAlchemyError
+
+from contextlib import asynccontextmanager
+
+from app.coalescing import CoalescingMiddleware
+from app.database import ASYNC_DB, SessionLocal
+from app.instrumentation import InstrumentationMiddleware
+from app.routes import admin, auth, conflict_data, countries, export, feedback, history, metrics, regions
+from app.search import region_index
+from app.snapshot import snapshot_store
+from app.warmup import WARMUP, warm_up
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build in-memory indexes before taking traffic, so the first reads don't pay for them
+    startup_builds = [region_index.refresh]
+    if snapshot_store.enabled:
+        startup_builds.append(snapshot_store.refresh)
+    for build in startup_builds:
+        with SessionLocal() as db:
+            try:
+                await run_in_threadpool(build, db)
+            except SQLAlchemyError:
+                logger.exception(f'Could not run {build.__qualname__} at startup, requests will retry')
+    # Pay this worker's first-use costs (connections, compiled statements, route setup, ...) before taking traffic
+    if WARMUP:
+        await warm_up(app)
+    yield
 
-from app.routes import auth, conflict_data
 
-app = FastAPI(title='ACLED Conflict API', version='1.0.0')
+app = FastAPI(title='ACLED Conflict API', version='1.0.0', lifespan=lifespan)
+# Added first, so runs inside the instrumentation: requests served a shared response are still timed and logged
+app.add_middleware(CoalescingMiddleware)
+app.add_middleware(InstrumentationMiddleware)
 
 security = HTTPBearer()
 # Include necessary routers and version number
 router_prefix = '/v1'
 app.include_router(auth.router, prefix=router_prefix)
+if ASYNC_DB:
+    # Registered first so its routes take precedence over the sync versions of the same paths
+    from app.routes import conflict_data_async
+    app.include_router(conflict_data_async.router, prefix=router_prefix)
 app.include_router(conflict_data.router, prefix=router_prefix)
+app.include_router(countries.router, prefix=router_prefix)
+app.include_router(export.router, prefix=router_prefix)
+app.include_router(regions.router, prefix=router_prefix)
+app.include_router(history.router, prefix=router_prefix)
+app.include_router(feedback.router, prefix=router_prefix)
+app.include_router(admin.router, prefix=router_prefix)
+# Unversioned, where scrapers expect it
+app.include_router(metrics.router)
 
 if __name__ == '__main__':
     import uvicorn
@@ -0,0 +1,196 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Lightweight, idempotent schema migrations for databases created by an earlier version of `app.models`.
+`Base.metadata.create_all` only creates missing tables, so new columns/indexes on existing tables are added here.
+
+Run with: python -m app.migrations
+'''
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from app.database import engine
+from app.models import AggregateCacheEntry, ConflictData, ConflictDataHistory, CountrySummary, DataVersion, RateLimitBucket, User, UserFeedback, normalise_key
+from app.utils.statistical_utils import refresh_country_summaries
+from app.utils.version_utils import TABLE_SCOPE
+
+from datetime import datetime
+
+
+def _column_names(conn: Connection, table: str) -> set:
+    return {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+def _index_names(conn: Connection, table: str) -> set:
+    return {i['name'] for i in inspect(conn).get_indexes(table)}
+
+
+def add_conflict_data_lookup_keys(conn: Connection) -> None:
+    '''
+    Add and backfill `country_key`/`admin1_key` on conflict_data, then index them. Raises
+    RuntimeError before changing anything if regions differ only by case or Unicode form: they
+    would share a key and break the unique (country_key, admin1_key) index
+    '''
+    table = ConflictData.__tablename__
+    indexes = _index_names(conn, table)
+    if 'idx_country_key_admin1_key' not in indexes:
+        _check_duplicate_lookup_keys(conn)
+
+    columns = _column_names(conn, table)
+    for column in ('country_key', 'admin1_key'):
+        if column not in columns:
+            logger.info(f'Adding column {table}.{column}')
+            # SQLite can only add a NOT NULL column with a default. Every row is backfilled below
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} VARCHAR(100) NOT NULL DEFAULT ''"))
+
+    # Backfill in Python: SQL lower() does not fold non-ASCII characters
+    rows = conn.execute(text(
+        f"SELECT id, country, admin1 FROM {table} WHERE country_key IS NULL OR admin1_key IS NULL "
+        f"OR country_key = '' OR admin1_key = ''"
+    )).all()
+    if rows:
+        logger.info(f'Backfilling lookup keys for {len(rows)} rows of {table}')
+        conn.execute(
+            text(f'UPDATE {table} SET country_key = :country_key, admin1_key = :admin1_key WHERE id = :id'),
+            [
+                {'id': r.id, 'country_key': normalise_key(r.country), 'admin1_key': normalise_key(r.admin1)}
+                for r in rows
+            ]
+        )
+    if conn.dialect.name == 'postgresql':
+        for column in ('country_key', 'admin1_key'):
+            conn.execute(text(f'ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL'))
+
+    for index in ConflictData.__table__.indexes:
+        if index.name not in indexes:
+            logger.info(f'Creating index {index.name}')
+            index.create(bind=conn)
+
+
+def _check_duplicate_lookup_keys(conn: Connection, shown: int = 20) -> None:
+    '''Raise RuntimeError listing the regions whose names normalise to the same keys, if any'''
+    table = ConflictData.__tablename__
+    regions = {}
+    for row in conn.execute(text(f'SELECT id, country, admin1 FROM {table} ORDER BY id')):
+        regions.setdefault((normalise_key(row.country), normalise_key(row.admin1)), []).append(row)
+    duplicates = [row for rows in regions.values() if len(rows) > 1 for row in rows]
+    if duplicates:
+        listed = '; '.join(f'id {r.id}: {r.country} / {r.admin1}' for r in duplicates[:shown])
+        raise RuntimeError(
+            f'{len(duplicates)} {table} rows differ from another only by case or Unicode form, so the unique '
+            f'(country_key, admin1_key) index cannot be created: {listed}'
+            + (f' (first {shown} shown)' if len(duplicates) > shown else '')
+            + '. Merge or rename them, moving their user_feedback to the row kept, then run the migrations again'
+        )
+
+
+def backfill_country_summary(conn: Connection) -> None:
+    '''Create and fill country_summary for databases loaded before it existed'''
+    CountrySummary.__table__.create(bind=conn, checkfirst=True)
+    summarised = conn.execute(text(f'SELECT count(*) FROM {CountrySummary.__tablename__}')).scalar()
+    if summarised == 0:
+        count = refresh_country_summaries(conn)
+        logger.info(f'Backfilled {count} country summaries')
+
+
+def add_aggregate_cache(conn: Connection) -> None:
+    '''Create aggregate_cache, for AGGREGATE_CACHE_BACKEND=database'''
+    AggregateCacheEntry.__table__.create(bind=conn, checkfirst=True)
+
+
+def add_user_token_version(conn: Connection) -> None:
+    '''Add users.token_version, starting every existing user at 0'''
+    table = User.__tablename__
+    if 'token_version' not in _column_names(conn, table):
+        logger.info(f'Adding column {table}.token_version')
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0'))
+
+
+def add_data_versions(conn: Connection) -> None:
+    '''Create data_versions and start the table and every existing country at version 1'''
+    DataVersion.__table__.create(bind=conn, checkfirst=True)
+    if conn.execute(text(f'SELECT count(*) FROM {DataVersion.__tablename__}')).scalar() == 0:
+        country_keys = conn.execute(text(f'SELECT DISTINCT country_key FROM {ConflictData.__tablename__}')).scalars()
+        now = datetime.utcnow()
+        conn.execute(
+            DataVersion.__table__.insert(),
+            [{'scope': scope, 'version': 1, 'updated_at': now} for scope in (TABLE_SCOPE, *country_keys)]
+        )
+        logger.info('Initialised data versions')
+
+
+def add_conflict_data_history(conn: Connection) -> None:
+    '''Create conflict_data_history and its index. It starts empty: past periods were never kept'''
+    if not inspect(conn).has_table(ConflictDataHistory.__tablename__):
+        logger.info(f'Creating table {ConflictDataHistory.__tablename__}')
+        ConflictDataHistory.__table__.create(bind=conn)
+
+
+def add_feedback_keyset_indexes(conn: Connection) -> None:
+    '''
+    Index user_feedback on (conflict_data_id, created_at, id) and (user_id, created_at, id) for
+    keyset pagination, replacing the single column indexes they start with. Rows without a
+    `created_at` get their `updated_at` (or now), so every row has a position in the order
+    '''
+    table = UserFeedback.__tablename__
+    backfilled = conn.execute(
+        text(f'UPDATE {table} SET created_at = coalesce(updated_at, :now) WHERE created_at IS NULL'),
+        {'now': datetime.utcnow()}
+    ).rowcount
+    if backfilled:
+        logger.info(f'Backfilled created_at for {backfilled} rows of {table}')
+    indexes = _index_names(conn, table)
+    for index in UserFeedback.__table__.indexes:
+        if index.name not in indexes:
+            logger.info(f'Creating index {index.name}')
+            index.create(bind=conn)
+    for name in ('ix_user_feedback_conflict_data_id', 'ix_user_feedback_user_id'):
+        if name in indexes:
+            logger.info(f'Dropping index {name}')
+            conn.execute(text(f'DROP INDEX {name}'))
+
+
+def add_user_feedback_insert_sentinel(conn: Connection) -> None:
+    '''Add user_feedback.insert_sentinel, which batch feedback inserts fill. Existing rows stay NULL'''
+    table = UserFeedback.__tablename__
+    if 'insert_sentinel' not in _column_names(conn, table):
+        logger.info(f'Adding column {table}.insert_sentinel')
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN insert_sentinel INTEGER'))
+
+
+def add_rate_limit_buckets(conn: Connection) -> None:
+    '''Create rate_limit_buckets, for RATE_LIMIT_BACKEND=database'''
+    if not inspect(conn).has_table(RateLimitBucket.__tablename__):
+        logger.info(f'Creating table {RateLimitBucket.__tablename__}')
+        RateLimitBucket.__table__.create(bind=conn)
+
+
+MIGRATIONS = [
+    add_conflict_data_lookup_keys,
+    backfill_country_summary,
+    add_aggregate_cache,
+    add_user_token_version,
+    add_data_versions,
+    add_conflict_data_history,
+    add_feedback_keyset_indexes,
+    add_rate_limit_buckets,
+    add_user_feedback_insert_sentinel,
+]
+
+
+def run_migrations() -> None:
+    '''Apply every migration in order. Each one is a no-op if already applied'''
+    with engine.begin() as conn:
+        if not inspect(conn).has_table(ConflictData.__tablename__):
+            logger.info('No existing tables, nothing to migrate')
+            return
+        for migration in MIGRATIONS:
+            logger.debug(f'Running migration {migration.__name__}')
+            migration(conn)
+
+
+if __name__ == '__main__':
+    from app.logging_config import configure_logging
+    configure_logging()
+    run_migrations()
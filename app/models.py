@@ -2,12 +2,21 @@ import logging
 logger = logging.getLogger(__name__)
 
 '''SQLAlchemy ORM models'''
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, Float, String, ForeignKey, Date, DateTime, Index, Boolean, Text, insert_sentinel
+from sqlalchemy.orm import relationship, validates
 
 from app.database import Base
 
 from datetime import datetime
+import unicodedata
+
+
+def normalise_key(value: str) -> str:
+    '''
+    Case-insensitive lookup key for country/admin1 names.
+    Unicode-aware (unlike SQLite's `lower()`, which only folds ASCII), so e.g. `Ö` matches `ö`.
+    '''
+    return unicodedata.normalize('NFC', value).casefold()
 
 
 class ConflictData(Base):
@@ -17,20 +26,30 @@ class ConflictData(Base):
     id = Column(Integer, primary_key=True, index=True)
     country = Column(String(100), index=True, nullable=False)
     admin1 = Column(String(100), index=True, nullable=False)
+    # Normalised copies of country/admin1 for indexed case-insensitive lookups. Kept in sync by `_sync_keys`
+    country_key = Column(String(100), nullable=False)
+    admin1_key = Column(String(100), index=True, nullable=False)
     population = Column(Integer, nullable=True)
     events = Column(Integer, nullable=False)
     risk_score = Column(Integer, nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    # relationships
-    feedback = relationship('UserFeedback', back_populates='conflict_data', cascade='all, delete-orphan')
+    # relationships. Never lazy loaded: read feedback through `app.utils.feedback_utils`, which pages
+    # it and counts it per page in one query, rather than one query per row serialised
+    feedback = relationship('UserFeedback', back_populates='conflict_data', cascade='all, delete-orphan', lazy='raise')
 
     # Indexes for efficient queries and enforce uniqueness
     __table_args__ = (
         Index('idx_country_admin1', 'country', 'admin1', unique=True),
+        Index('idx_country_key_admin1_key', 'country_key', 'admin1_key', unique=True),
     )
 
+    @validates('country', 'admin1')
+    def _sync_keys(self, column, value):
+        setattr(self, f'{column}_key', normalise_key(value) if value is not None else None)
+        return value
+
 
 
 class User(Base):
@@ -41,11 +60,20 @@ class User(Base):
     email = Column(String(255), unique=True, index=True, nullable=False)
     hashed_password = Column(String(500), nullable=False)
     is_admin = Column(Boolean, default=False, nullable=False)
+    # Embedded in issued tokens. Bumping it revokes every token issued before
+    token_version = Column(Integer, default=0, nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # relationships
-    feedback = relationship('UserFeedback', back_populates='user', cascade='all, delete-orphan')
+    feedback = relationship('UserFeedback', back_populates='user', cascade='all, delete-orphan', lazy='raise')
+
+    @validates('is_admin')
+    def _revoke_tokens_on_role_change(self, key, value):
+        # Tokens carry the admin claim, so a promotion/demotion must invalidate them
+        if self.is_admin is not None and bool(self.is_admin) != bool(value):
+            self.token_version = (self.token_version or 0) + 1
+        return value
 
 
 class UserFeedback(Base):
@@ -53,12 +81,107 @@ class UserFeedback(Base):
     __tablename__ = 'user_feedback'
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
-    conflict_data_id = Column(Integer, ForeignKey('conflict_data.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    conflict_data_id = Column(Integer, ForeignKey('conflict_data.id', ondelete='CASCADE'), nullable=False)
     feedback_text = Column(String(500), nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Filled by SQLAlchemy on multi-row inserts so RETURNING ids can be put back in parameter order
+    # (batch feedback). Without it SQLite inserts with RETURNING order go one row per statement
+    _insert_sentinel = insert_sentinel('insert_sentinel')
 
     # relationships
     user = relationship('User', back_populates='feedback')
-    conflict_data = relationship('ConflictData', back_populates='feedback')
\ No newline at end of file
+    conflict_data = relationship('ConflictData', back_populates='feedback')
+
+    # Keyset pagination order of a region's / a user's feedback. Replace the single column indexes
+    # on conflict_data_id and user_id, which are prefixes of these
+    __table_args__ = (
+        Index('idx_feedback_region_created', 'conflict_data_id', 'created_at', 'id'),
+        Index('idx_feedback_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+
+class CountrySummary(Base):
+    '''
+    Per-country aggregates of conflict_data, refreshed in the same transaction as any write to it
+    (see `app.utils.statistical_utils.refresh_country_summaries`)
+    '''
+    __tablename__ = 'country_summary'
+
+    country_key = Column(String(100), primary_key=True)
+    country = Column(String(100), nullable=False)
+    region_count = Column(Integer, nullable=False)
+    risk_score_sum = Column(BigInteger, nullable=False)
+    risk_score_avg = Column(Float, nullable=False)
+    events_sum = Column(BigInteger, nullable=False)
+    # Population is optional per region, so track how many regions contributed to it
+    population_sum = Column(BigInteger, nullable=True)
+    population_region_count = Column(Integer, nullable=False)
+    # Sums of risk_score * population/events, for population- and event-weighted average risk
+    risk_weighted_population_sum = Column(BigInteger, nullable=True)
+    risk_weighted_events_sum = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DataVersion(Base):
+    '''
+    Version counters for conflict_data, bumped in the same transaction as every write to it
+    (see `app.utils.version_utils`). One row for the whole table (scope '') and one per country key
+    '''
+    __tablename__ = 'data_versions'
+
+    scope = Column(String(100), primary_key=True)
+    version = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+
+class ConflictDataHistory(Base):
+    '''
+    Append-only periodic snapshots of conflict_data (one row per region per period, e.g. weekly),
+    loaded by `app.utils.history_utils`. Keyed on (country_key, admin1_key, period), stored without
+    a rowid on SQLite, so a region's series is one contiguous range of the primary key b-tree
+    '''
+    __tablename__ = 'conflict_data_history'
+
+    country_key = Column(String(100), primary_key=True)
+    admin1_key = Column(String(100), primary_key=True)
+    period = Column(Date, primary_key=True)  # start of the period
+    country = Column(String(100), nullable=False)
+    admin1 = Column(String(100), nullable=False)
+    population = Column(Integer, nullable=True)
+    events = Column(Integer, nullable=False)
+    risk_score = Column(Integer, nullable=False)
+    recorded_at = Column(DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Country series: a period range of one country, grouped by period in index order. Covers
+        # the aggregated columns, so the table itself is never read
+        Index('idx_history_country_period', 'country_key', 'period', 'events', 'risk_score', 'population'),
+        {'sqlite_with_rowid': False},
+    )
+
+
+class AggregateCacheEntry(Base):
+    '''Shared backend for `app.cache.DatabaseCache`, so all workers see the same cached aggregates'''
+    __tablename__ = 'aggregate_cache'
+
+    namespace = Column(String(100), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=False)  # JSON-encoded
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class RateLimitBucket(Base):
+    '''Shared token buckets for `app.rate_limit.DatabaseRateLimitBackend`, so all workers draw on the same limits'''
+    __tablename__ = 'rate_limit_buckets'
+
+    key = Column(String(255), primary_key=True)  # `<route name>:<client>`
+    tokens = Column(Float, nullable=False)
+    # Whether the last request was let through, written by the same statement that takes the token
+    allowed = Column(Boolean, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)  # Unix time, comparable across hosts
+
+
+# Attach the conflict_data change tracking to every Session that uses these models
+import app.data_events  # noqa: E402,F401
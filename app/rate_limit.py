@@ -0,0 +1,252 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Token-bucket rate limiting for the public read routes.
+
+Routes opt in with `dependencies=[Depends(rate_limit)]`. Each client gets a bucket per route: it
+holds up to `burst` tokens, refills at `rate` tokens per second, and each request takes one. A
+request finding the bucket empty gets a 429 with a Retry-After header. Clients are identified by
+the user id of a valid bearer token if sent, otherwise by IP address (behind a proxy, run uvicorn
+with `--proxy-headers` so this is the client's address from X-Forwarded-For).
+
+Requests served a copy of a concurrent identical request's response (see `app.coalescing`) never
+reach the route's dependencies, so `charge_copy` takes their token, under the route the original
+was charged for.
+
+Limits are `<rate>/<burst>`, or `off`: RATE_LIMIT_DEFAULT for every limited route, overridden per
+route name (the endpoint function) by RATE_LIMIT_ROUTES, e.g.
+`get_conflict_data=2/10,get_risk_score_average=off`.
+
+Buckets live in a pluggable backend, selected with RATE_LIMIT_BACKEND:
+- `memory` (default): per process, LRU-bounded to RATE_LIMIT_MAX_KEYS buckets. With N workers a
+  client gets up to N times the limit
+- `database`: the `rate_limit_buckets` table, shared by all workers. One upsert per request, so
+  best on PostgreSQL; on SQLite every limited request takes the write lock
+'''
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, delete, func, literal
+
+from app.auth import ALGORITHM, SECRET_KEY
+from app.database import SessionLocal
+from app.instrumentation import Counter, route_label
+from app.models import RateLimitBucket
+
+from collections import OrderedDict
+from jose import JWTError, jwt
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+RATE_LIMIT = os.getenv('RATE_LIMIT', 'True') == 'True'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_DEFAULT = os.getenv('RATE_LIMIT_DEFAULT', '10/50')
+RATE_LIMIT_ROUTES = os.getenv('RATE_LIMIT_ROUTES', '')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+# Database backend: rows idle this long are deleted, every RATE_LIMIT_CLEANUP_EVERY requests per worker
+RATE_LIMIT_IDLE_SECONDS = int(os.getenv('RATE_LIMIT_IDLE_SECONDS', '3600'))
+RATE_LIMIT_CLEANUP_EVERY = int(os.getenv('RATE_LIMIT_CLEANUP_EVERY', '1000'))
+
+# Scope key set by `rate_limit` to the route name the request was charged under
+LIMITED_ROUTE = 'rate_limited_route'
+
+rate_limited_total = Counter('rate_limited_requests_total', 'Requests rejected with 429 by the rate limiter')
+
+
+def parse_limit(value: str) -> Optional[Tuple[float, float]]:
+    '''(rate per second, burst) from `<rate>/<burst>`, or None for `off`. Raises ValueError if invalid'''
+    value = value.strip()
+    if value == 'off':
+        return None
+    rate, _, burst = value.partition('/')
+    rate, burst = float(rate), float(burst or rate)
+    if rate <= 0 or burst < 1:
+        raise ValueError(f'invalid rate limit {value!r}: rate must be positive and burst at least 1')
+    return rate, burst
+
+
+def parse_route_limits(value: str) -> Dict[str, Optional[Tuple[float, float]]]:
+    '''{route name: limit} from `name=<rate>/<burst>,name=off,...`'''
+    limits = {}
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        name, _, limit = item.partition('=')
+        limits[name.strip()] = parse_limit(limit)
+    return limits
+
+
+class RateLimitBackend:
+    '''Token bucket storage. Implementations must be safe to call from multiple threads'''
+    # Whether `take` does blocking IO, so must run off the event loop
+    blocking = False
+
+    def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        '''Take a token from `key`'s bucket. Returns (allowed, seconds until a token is available)'''
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    '''Per-process buckets. The least recently used are dropped past `max_keys`, which only refills them early'''
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class DatabaseRateLimitBackend(RateLimitBackend):
+    '''Buckets in the `rate_limit_buckets` table. Refill and take are one atomic upsert per request'''
+    blocking = True
+
+    def __init__(self, session_factory=SessionLocal, idle_seconds: int = RATE_LIMIT_IDLE_SECONDS,
+                 cleanup_every: int = RATE_LIMIT_CLEANUP_EVERY):
+        self.session_factory = session_factory
+        self.idle_seconds = idle_seconds
+        self.cleanup_every = cleanup_every
+        self._calls = 0
+
+    def _take_statement(self, dialect_name: str, key: str, rate: float, burst: float, now: float):
+        if dialect_name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            least = func.least
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+            least = func.min  # SQLite's scalar min() with several arguments
+        table = RateLimitBucket.__table__
+        refilled = least(literal(burst), table.c.tokens + (literal(now) - table.c.updated_at) * rate)
+        return insert(table).values(key=key, tokens=burst - 1, allowed=True, updated_at=now).on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={
+                'tokens': case((refilled >= 1, refilled - 1), else_=refilled),
+                'allowed': refilled >= 1,
+                'updated_at': now,
+            }
+        ).returning(table.c.tokens, table.c.allowed)
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        db = self.session_factory()
+        try:
+            tokens, allowed = db.execute(self._take_statement(db.get_bind().dialect.name, key, rate, burst, now)).one()
+            self._calls += 1
+            if self.cleanup_every and self._calls % self.cleanup_every == 0:
+                db.execute(delete(RateLimitBucket).where(RateLimitBucket.updated_at < now - self.idle_seconds))
+            db.commit()
+        finally:
+            db.close()
+        return bool(allowed), 0.0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        db = self.session_factory()
+        try:
+            db.execute(delete(RateLimitBucket))
+            db.commit()
+        finally:
+            db.close()
+
+
+def build_backend(backend: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    if backend == 'database':
+        return DatabaseRateLimitBackend()
+    if backend != 'memory':
+        logger.warning(f'Unknown RATE_LIMIT_BACKEND {backend}, using memory')
+    return MemoryRateLimitBackend()
+
+
+class RateLimiter:
+    '''Per-route limits over a bucket backend'''
+
+    def __init__(self, backend: RateLimitBackend, default: Optional[Tuple[float, float]],
+                 routes: Optional[dict] = None, enabled: bool = RATE_LIMIT):
+        self.backend = backend
+        self.default = default
+        self.routes = routes or {}
+        self.enabled = enabled
+
+    def limit(self, route_name: str) -> Optional[Tuple[float, float]]:
+        '''(rate, burst) of a route, None if unlimited'''
+        return self.routes.get(route_name, self.default)
+
+    async def check(self, route_name: str, client: str) -> None:
+        '''Take a token for this client and route. Raises 429 if there is none'''
+        limit = self.limit(route_name) if self.enabled else None
+        if limit is None:
+            return
+        key = f'{route_name}:{client}'
+        if self.backend.blocking:
+            allowed, retry_after = await run_in_threadpool(self.backend.take, key, *limit)
+        else:
+            allowed, retry_after = self.backend.take(key, *limit)
+        if not allowed:
+            logger.debug(f'Rate limited {client} on {route_name}')
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail='rate limit exceeded',
+                                headers={'Retry-After': str(max(1, math.ceil(retry_after)))})
+
+
+def client_key(request: Request) -> str:
+    '''`user:<id>` for a request with a valid bearer token, else `ip:<address>`'''
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        try:
+            # Only a valid token counts, else a client could get a fresh bucket per made-up token
+            return f"user:{jwt.decode(auth_header[7:], SECRET_KEY, algorithms=[ALGORITHM])['sub']}"
+        except (JWTError, KeyError):
+            pass
+    return f'ip:{request.client.host if request.client else "unknown"}'
+
+
+rate_limiter = RateLimiter(build_backend(), parse_limit(RATE_LIMIT_DEFAULT), parse_route_limits(RATE_LIMIT_ROUTES))
+
+
+async def _charge(request: Request, route_name: str) -> None:
+    try:
+        await rate_limiter.check(route_name, client_key(request))
+    except HTTPException:
+        rate_limited_total.inc((request.method, route_label(request.scope)))
+        raise
+
+
+async def rate_limit(request: Request) -> None:
+    '''Dependency: take a token from the client's bucket for the matched route, or raise 429'''
+    if not rate_limiter.enabled:
+        return
+    route = request.scope.get('route')
+    route_name = getattr(route, 'name', None) or request.url.path
+    request.scope[LIMITED_ROUTE] = route_name
+    await _charge(request, route_name)
+
+
+async def charge_copy(scope: dict, route_name: str) -> Optional[Response]:
+    '''
+    Take a token for a request served a copy of another's response, from its own client's bucket
+    for `route_name`. Returns the 429 response to send instead if the bucket is empty, else None
+    '''
+    try:
+        await _charge(Request(scope), route_name)
+    except HTTPException as e:
+        return JSONResponse({'detail': e.detail}, status_code=e.status_code, headers=e.headers)
+    return None
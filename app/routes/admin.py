@@ -0,0 +1,66 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.security import HTTPBearer
+
+from app.auth import require_admin
+from app.database import get_db
+from app.slow_queries import SLOW_QUERY_BUFFER_SIZE, SLOW_QUERY_LOG, SLOW_QUERY_THRESHOLD_MS, slow_query_log
+from app.utils.history_utils import period_start, snapshot_current
+
+from datetime import date, datetime
+from typing import Optional
+
+router = APIRouter(prefix='/admin')
+security = HTTPBearer()
+
+
+@router.get('/slow-queries')
+def get_slow_queries(
+    limit: int = Query(None, ge=1, description='Most recent captures only'),
+    full_scans: bool = Query(False, description='Only captures whose plan scans a table without an index'),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(require_admin)
+):
+    '''Recent statements slower than SLOW_QUERY_THRESHOLD_MS in this process, newest first,
+    with their parameters, duration and query plan'''
+    items = slow_query_log.entries()
+    if full_scans:
+        items = [item for item in items if item['full_scan']]
+    items = items[:limit] if limit else items
+    return {
+        'enabled': SLOW_QUERY_LOG,
+        'threshold_ms': SLOW_QUERY_THRESHOLD_MS,
+        'buffer_size': SLOW_QUERY_BUFFER_SIZE,
+        'captured_total': slow_query_log.total,
+        'rows_returned': len(items),
+        'items': items,
+    }
+
+
+@router.delete('/slow-queries')
+def clear_slow_queries(
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(require_admin)
+):
+    '''Empty the slow query buffer, e.g. after fixing the queries in it'''
+    cleared = slow_query_log.clear()
+    logger.info(f'Admin user {user.email} cleared {cleared} slow query captures')
+    return {'cleared': cleared}
+
+
+@router.post('/history/snapshot')
+def snapshot_history(
+    period: Optional[date] = Query(None, description='Any day of the period to record. Defaults to the current week'),
+    db: dict = Depends(get_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(require_admin)
+):
+    '''Record the current conflict data as a period of conflict_data_history, in one statement.
+    Regions already recorded for the period are left as they are'''
+    period = period_start(period or datetime.utcnow().date())
+    added = snapshot_current(db, period)
+    db.commit()
+    logger.info(f'Admin user {user.email} recorded {added} regions in history for period {period}')
+    return {'period': period, 'regions_added': added}
@@ -2,12 +2,13 @@ import logging
 logger = logging.getLogger(__name__)
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.models import User
-from app.auth import hash_password, verify_password, create_token, get_current_user
+from app.auth import Principal, hash_password_async, verify_password_async, create_token, get_current_user
 from pydantic import BaseModel, Field, EmailStr
 
 router = APIRouter(prefix='/auth')
@@ -24,26 +25,31 @@ class LoginRequest(BaseModel):
     
 
 @router.post('/register')
-def register(payload: RegisterRequest, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.email == payload.email).first():
+async def register(payload: RegisterRequest, db: Session = Depends(get_db)):
+    # Async so the bcrypt hash waits on the hashing pool without holding a threadpool slot.
+    # DB calls are blocking, so they still go through the threadpool
+    existing = await run_in_threadpool(lambda: db.query(User).filter(User.email == payload.email).first())
+    if existing:
         raise HTTPException(status_code=400, detail='user already registered to email address')
-    user = User(email=payload.email, hashed_password=hash_password(payload.password))
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return {'id': user.id, 'email': user.email, 'is_admin': user.is_admin}
+    user = User(email=payload.email, hashed_password=await hash_password_async(payload.password))
+    def save():
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return {'id': user.id, 'email': user.email, 'is_admin': user.is_admin}
+    return await run_in_threadpool(save)
 
 
 @router.post('/login')
-def login(payload: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not verify_password(payload.password, user.hashed_password):
+async def login(payload: LoginRequest, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.email == payload.email).first())
+    if not user or not await verify_password_async(payload.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='invalid credentials')
-    token = create_token(user.id)
+    token = create_token(user.id, is_admin=user.is_admin, token_version=user.token_version)
     return {'access_token': token, 'token_type': 'bearer'}
 
 @router.get('/me')
-def me(current_user: User = Depends(get_current_user), credentials: HTTPBearer = Depends(security)):
+def me(current_user: Principal = Depends(get_current_user), credentials: HTTPBearer = Depends(security)):
     '''Created for testing purposes of token validity.
     If token is valid, returns information of the current user.
     '''
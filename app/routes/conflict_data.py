@@ -1,17 +1,28 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks, Response
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer
 
-from sqlalchemy import func
+from sqlalchemy import func, insert, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
 import math
-from typing import List
+import os
+import time
+from typing import List, Optional
 
-from app.database import get_db
-from app.models import ConflictData, UserFeedback
+from app.database import SessionLocal, get_db
+from app.models import ConflictData, CountrySummary, UserFeedback, normalise_key
 from app.auth import get_current_user, require_admin
-from app.utils.statistical_utils import compute_cache_risk_score_avg
+from app.rate_limit import rate_limit
+from app.snapshot import snapshot_store
+from app.utils.feedback_utils import feedback_counts
+from app.utils.ingest_utils import DEFAULT_BATCH_SIZE, MAX_REJECTS_REPORTED, aiter_lines, aiter_records, ingest_batch, summarise
+from app.utils.pagination_utils import encode_cursor, decode_cursor
+from app.utils.response_utils import ConflictDataList, FastJSONResponse, render
+from app.utils.version_utils import NO_FEEDBACK_VERSION, TABLE_SCOPE, bump_feedback_versions, cache_headers, etag_matches, feedback_scopes, load_data_versions
 
 from pydantic import BaseModel, Field
 
@@ -23,123 +34,193 @@ class FeedbackRequest(BaseModel):
         example='This conflict report seems accurate based on local news sources I\'ve reviewed.'
     )
 
+
+class FeedbackBatchItem(FeedbackRequest):
+    admin1: str = Field(..., min_length=1, max_length=100)
+    country: Optional[str] = Field(None, max_length=100, description='Needed if `admin1` exists in more than one country')
+
+
+MAX_FEEDBACK_BATCH = int(os.getenv('MAX_FEEDBACK_BATCH', '1000'))
+
 router = APIRouter(prefix='/conflictdata')
 security = HTTPBearer()
 
-@router.get('')
+# Columns for list responses: the item fields, then the keys for cursors. Selected as plain rows
+# rather than loading ConflictData entities
+LIST_COLUMNS = (
+    ConflictData.id, ConflictData.country, ConflictData.admin1, ConflictData.population,
+    ConflictData.events, ConflictData.risk_score, ConflictData.country_key, ConflictData.admin1_key,
+)
+IF_NONE_MATCH_DESCRIPTION = 'ETag of a cached copy. Returns 304 if the data has not changed since'
+
+
+def _cache_headers(db, snapshot, scopes: list) -> dict:
+    '''
+    Caching headers for a list response built from these data version scopes, read from the snapshot
+    if serving from it. The items carry feedback counts, so the scopes' feedback versions count too
+    '''
+    feedback = feedback_scopes(scopes)
+    if snapshot is not None:
+        versions = {**snapshot.versions, **load_data_versions(db, feedback)}
+    else:
+        versions = load_data_versions(db, [*scopes, *feedback])
+    for scope in feedback:
+        versions.setdefault(scope, NO_FEEDBACK_VERSION)
+    return cache_headers(versions, [*scopes, *feedback])
+
+@router.get('', response_class=FastJSONResponse, dependencies=[Depends(rate_limit)])
 def get_conflict_data(
         offset: int = Query(0, ge=0),
         country: List[str] = Query(None),
         page_size: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description='`next_cursor` from a previous page (keyset pagination)'),
+        include_total: Optional[bool] = Query(None, description='Count matching rows. Defaults to true for offset paging, false for cursor paging'),
+        if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION),
         db: dict = Depends(get_db)
-    ):
+    ) -> FastJSONResponse:
     '''
     Get data from conflict_data
     Use an optional country list to filter by country or just get all data
-    All pulls are paginated with offset and page_size parameters
+    All pulls are paginated, either with offset and page_size parameters or by passing back
+    the `next_cursor` of the previous page as `cursor`. Cursor paging seeks straight to the next page,
+    so is preferred for walking the whole dataset
+    Responses carry an ETag that changes when any of the data they cover does
     '''
-    logger.debug(f'Getting conflict data with offset {offset}, page_size {page_size}, countries {country}')
-    query_ = db.query(ConflictData)
-    ## Get count of rows in db. If countries list passed, update queries to match
-    row_count = db.query(func.count(ConflictData.id)).scalar()
-    if country:
-        query_ = query_.filter(func.lower(ConflictData.country).in_([c.lower() for c in country]))
-        row_count = db.query(func.count(ConflictData.id))\
-            .filter(func.lower(ConflictData.country).in_([c.lower() for c in country]))\
-            .scalar()
+    return render(query_conflict_data(offset, country, page_size, cursor, include_total, if_none_match, db))
+
+
+def query_conflict_data(offset: int, country: Optional[List[str]], page_size: int, cursor: Optional[str],
+                        include_total: Optional[bool], if_none_match: Optional[str], db: Session):
+    '''The database part of `get_conflict_data`: a 304 `Response`, or the page as a `ConflictDataList` to render'''
+    logger.debug(f'Getting conflict data with offset {offset}, cursor {cursor}, page_size {page_size}, countries {country}')
+    if cursor is not None and offset:
+        raise HTTPException(status_code=400, detail='Pass either offset or cursor, not both')
+    if include_total is None:
+        include_total = cursor is None
+
+    country_keys = [normalise_key(c) for c in country] if country else None
+    after = None
+    if cursor is not None:
+        after = decode_cursor(cursor, 3)
+        if not (isinstance(after[0], str) and isinstance(after[1], str) and isinstance(after[2], int)):
+            raise HTTPException(status_code=400, detail='invalid cursor')
+    # Served from the in-memory snapshot in snapshot mode (None when off or being rebuilt)
+    snapshot = snapshot_store.current(db)
+    headers = _cache_headers(db, snapshot, sorted(set(country_keys)) if country_keys else [TABLE_SCOPE])
+    if etag_matches(if_none_match, headers):
+        return Response(status_code=304, headers=headers)
+
+    query_ = db.query(*LIST_COLUMNS)
+    if country_keys:
+        query_ = query_.filter(ConflictData.country_key.in_(country_keys))
+
+    ## Get count of rows in db (matching the countries list if passed). Skipped if not requested
+    row_count = None
+    if include_total:
+        if snapshot is not None:
+            row_count = snapshot.count(country_keys)
+        else:
+            row_count = query_.with_entities(func.count(ConflictData.id)).scalar()
+        if offset >= row_count:
+            raise HTTPException(status_code=404, detail=f'Rows returned: {row_count}. Offset parameter exceeds dataset length')
+
+    ## Get list of country/admin1 data for the requested page. `id` breaks ties so the keyset order is total
+    # Fetch one extra row to tell whether there is a next page
+    if snapshot is not None:
+        query_result = snapshot.page(country_keys, after, offset, page_size + 1)
+    else:
+        if after is not None:
+            query_ = query_.filter(
+                tuple_(ConflictData.country_key, ConflictData.admin1_key, ConflictData.id) > tuple(after)
+            )
+        query_result = query_\
+            .order_by(ConflictData.country_key, ConflictData.admin1_key, ConflictData.id)\
+            .offset(offset)\
+            .limit(page_size + 1).all()
+    if not query_result and offset:
+        raise HTTPException(status_code=404, detail='Offset parameter exceeds dataset length')
+    next_cursor = None
+    if len(query_result) > page_size:
+        query_result = query_result[:page_size]
+        last = query_result[-1]
+        next_cursor = encode_cursor(last.country_key, last.admin1_key, last.id)
 
-    if offset >= row_count:
-        raise HTTPException(status_code=404, detail=f'Rows returned: {row_count}. Offset parameter exceeds dataset length')
-        
-    
-    ## Get list of country/admin1 data for the requested page. If country list was passed then
-    ## dataset is filtered to that list
-    query_result = query_\
-        .order_by(func.lower(ConflictData.country), func.lower(ConflictData.admin1))\
-        .offset(offset)\
-        .limit(page_size).all()
     ## Total number of pages in dataset
-    total_pages = math.ceil(row_count / page_size)
-    return {
+    total_pages = math.ceil(row_count / page_size) if row_count is not None else None
+    return ConflictDataList({
         'rows_returned': row_count, 'offset': offset, 'page_size': page_size, 'total_pages': total_pages,
-        'items': [
-            {
-                'id': i.id,
-                'country': i.country,
-                'admin1': i.admin1,
-                'population': i.population,
-                'events': i.events,
-                'risk_score': i.risk_score
-            } for i in query_result
-        ]
-    }
-
-
-@router.get('/{country}')
-def get_conflict_data_per_country(country: str, db: dict = Depends(get_db)) -> dict:
+        'next_cursor': next_cursor,
+    }, query_result, feedback_counts(db, (row[0] for row in query_result)), headers)
+
+
+@router.get('/{country}', response_class=FastJSONResponse, dependencies=[Depends(rate_limit)])
+def get_conflict_data_per_country(
+        country: str,
+        if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION),
+        db: dict = Depends(get_db)
+    ) -> FastJSONResponse:
     '''
     Get all conflict data for all `admin1` values for a single country
     '''
+    return render(query_conflict_data_per_country(country, if_none_match, db))
+
+
+def query_conflict_data_per_country(country: str, if_none_match: Optional[str], db: Session):
+    '''The database part of `get_conflict_data_per_country`: a 304 `Response`, or a `ConflictDataList` to render'''
     # Set arbitrary result set limit for now
     max_rows = 1000
+    snapshot = snapshot_store.current(db)
+    headers = _cache_headers(db, snapshot, [normalise_key(country)])
+    if etag_matches(if_none_match, headers):
+        return Response(status_code=304, headers=headers)
     # Get count of rows to return
-    row_count = db.query(func.count(ConflictData.id))\
-        .filter(func.lower(ConflictData.country)==country.lower())\
-        .scalar()
+    if snapshot is not None:
+        row_count = snapshot.count([normalise_key(country)])
+    else:
+        row_count = db.query(func.count(ConflictData.id))\
+            .filter(ConflictData.country_key == normalise_key(country))\
+            .scalar()
     if row_count == 0:
         raise HTTPException(status_code=404, detail=f'No data found for "{country}"')
     logger.debug(f'Row count for country {country}: {row_count}')
     
     ## Get list of country/admin1 data for the requested page
-    countries = db.query(ConflictData)\
-        .filter(func.lower(ConflictData.country)==country.lower())\
-        .limit(max_rows).all()
+    if snapshot is not None:
+        countries = snapshot.page([normalise_key(country)], limit=max_rows)
+    else:
+        countries = db.query(*LIST_COLUMNS)\
+            .filter(ConflictData.country_key == normalise_key(country))\
+            .limit(max_rows).all()
     
-    response_items = [
-            {
-                'id': i.id,
-                'country': i.country,
-                'admin1': i.admin1,
-                'population': i.population,
-                'events': i.events,
-                'risk_score': i.risk_score
-            } for i in countries
-        ]
+    counts = feedback_counts(db, (row[0] for row in countries))
     if row_count > max_rows:
-        return {
+        return ConflictDataList({
             'warning': f'Result set restricted to {max_rows} rows. Please use paginated endpoint /conflictdata.',
-            'items': response_items
-        }
+        }, countries, counts, headers)
     else:
-        return {'rows_returned': row_count, 'items': response_items}
+        return ConflictDataList({'rows_returned': row_count}, countries, counts, headers)
 
 
-risk_score_averages_cache = {}
-@router.get('/{country}/riskscore')
+@router.get('/{country}/riskscore', response_class=FastJSONResponse, dependencies=[Depends(rate_limit)])
 def get_risk_score_average(
-    country: str,
-    background_tasks: BackgroundTasks,
-    db: dict = Depends(get_db),
-    response: Response = None
-):
-    '''Get average risk score for a country, averaging over `admin1`s
-    If not already computed, compute it and cache it for future calls'''
-    logger.debug(f'Locally cached data: {risk_score_averages_cache}')
-    # First quickly check whether country is in dataset. If not we should not add to cache
-    row_count = db.query(func.count(ConflictData.id))\
-            .filter(func.lower(ConflictData.country)==country.lower())\
-            .scalar()
-    if row_count == 0:
+        country: str,
+        if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION),
+        db: dict = Depends(get_db)
+    ) -> FastJSONResponse:
+    '''Get average risk score for a country, averaging over `admin1`s.
+    Served from the snapshot in snapshot mode, otherwise from the precomputed country_summary table'''
+    snapshot = snapshot_store.current(db)
+    headers = _cache_headers(db, snapshot, [normalise_key(country)])
+    if etag_matches(if_none_match, headers):
+        return Response(status_code=304, headers=headers)
+    if snapshot is not None:
+        average = snapshot.risk_score_avg(normalise_key(country))
+    else:
+        summary = db.get(CountrySummary, normalise_key(country))
+        average = summary.risk_score_avg if summary is not None else None
+    if average is None:
         raise HTTPException(status_code=404, detail=f'No data found for "{country}"')
-    
-    # If already cached, simply return value
-    if country in risk_score_averages_cache:
-        return {'country': country, 'average_risk_score': risk_score_averages_cache[country]}
-    
-    # If not cached kick off background task and return 202
-    background_tasks.add_task(compute_cache_risk_score_avg, country, risk_score_averages_cache, db)
-    response.status_code = 202
-    return {'detail': f'Computing risk score average for {country}'}
+    return FastJSONResponse({'country': country, 'average_risk_score': average}, headers=headers)
 
 
 @router.post('/{admin1}/userfeedback')
@@ -158,10 +239,10 @@ def write_feedback(
     If multiple found, respond with each id and country to allow user choice'''
      # Build query
 
-    query = db.query(ConflictData).filter(func.lower(ConflictData.admin1) == admin1.lower())
+    query = db.query(ConflictData).filter(ConflictData.admin1_key == normalise_key(admin1))
     # Add country filter if provided
     if country:
-        query = query.filter(func.lower(ConflictData.country) == country.lower())
+        query = query.filter(ConflictData.country_key == normalise_key(country))
     matches = query.all()
     
     if len(matches) == 0:
@@ -187,12 +268,76 @@ def write_feedback(
         feedback_text=payload.feedback_text
     )
     db.add(feedback)
+    # Changes the feedback counts, so the ETags, of the lists holding this region
+    bump_feedback_versions(db, {matches[0].country_key})
     db.commit()
     db.refresh(feedback)
     response.status_code = 201
     return {'message': 'Feedback submitted', 'feedback_id': feedback.id}
 
 
+@router.post('/userfeedback')
+def write_feedback_batch(
+    payload: List[FeedbackBatchItem] = Body(..., min_length=1, max_length=MAX_FEEDBACK_BATCH),
+    db: dict = Depends(get_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(get_current_user),
+    response: Response = None
+):
+    '''Take a list of feedback notes, each for an `admin1` region (and optional `country`).
+    All regions are resolved in one query and all feedback written in one transaction.
+    Items that match no region, or several, are reported and skipped; the rest are still written.
+    Returns a result per item, in request order, and counts per status: 201 if any feedback was
+    written, as for a single note, else 200'''
+    candidates = {}
+    admin1_keys = {normalise_key(item.admin1) for item in payload}
+    for row in db.query(ConflictData.id, ConflictData.country, ConflictData.admin1, ConflictData.country_key,
+                        ConflictData.admin1_key).filter(ConflictData.admin1_key.in_(admin1_keys)):
+        candidates.setdefault(row.admin1_key, []).append(row)
+
+    results = []
+    new_feedback = []
+    feedback_country_keys = set()
+    for index, item in enumerate(payload):
+        matches = candidates.get(normalise_key(item.admin1), [])
+        if item.country:
+            matches = [m for m in matches if m.country_key == normalise_key(item.country)]
+        # Same match shape as the single item endpoint's 422
+        if len(matches) == 0:
+            message = f"No region found matching '{item.admin1}'" + (f" and country='{item.country}'" if item.country else '')
+            results.append({'index': index, 'status': 'not_found', 'message': message})
+        elif len(matches) > 1:
+            results.append({
+                'index': index,
+                'status': 'ambiguous',
+                'message': f"Multiple regions found for '{item.admin1}'. Specify country to disambiguate.",
+                'matches': [{'id': m.id, 'country': m.country, 'admin1': m.admin1} for m in matches]
+            })
+        else:
+            results.append({'index': index, 'status': 'created'})
+            new_feedback.append({'user_id': user.id, 'conflict_data_id': matches[0].id, 'feedback_text': item.feedback_text})
+            feedback_country_keys.add(matches[0].country_key)
+
+    if new_feedback:
+        # One multi-row insert (per SQLAlchemy insertmanyvalues batch), with the new ids returned in
+        # parameter order through UserFeedback.insert_sentinel
+        feedback_ids = db.scalars(
+            insert(UserFeedback).returning(UserFeedback.id, sort_by_parameter_order=True), new_feedback
+        ).all()
+        bump_feedback_versions(db, feedback_country_keys)
+        db.commit()
+        created = (result for result in results if result['status'] == 'created')
+        for result, feedback_id in zip(created, feedback_ids):
+            result['feedback_id'] = feedback_id
+        response.status_code = 201
+    logger.info(f'User {user.email} submitted {len(new_feedback)} of {len(payload)} feedback items')
+
+    summary = {status: 0 for status in ('created', 'not_found', 'ambiguous')}
+    for result in results:
+        summary[result['status']] += 1
+    return {'summary': summary, 'results': results}
+
+
 @router.delete('')
 def delete_conflict_data_row(
     admin1: str = Query(...),
@@ -204,8 +349,8 @@ def delete_conflict_data_row(
     '''Delete a single row of data from conflict_data based on admin1 and country'''
     logger.info(f'Admin user {user.email} requested deletion of {admin1}, {country}')
     match_count = db.query(func.count(ConflictData.id))\
-        .filter(func.lower(ConflictData.admin1) == admin1.lower())\
-        .filter(func.lower(ConflictData.country) == country.lower())\
+        .filter(ConflictData.admin1_key == normalise_key(admin1))\
+        .filter(ConflictData.country_key == normalise_key(country))\
         .scalar()
         # .filter(ConflictData.admin1 == admin1)\
         # .filter(ConflictData.country == country)\
@@ -215,8 +360,8 @@ def delete_conflict_data_row(
     else:
         # Single match - proceed with deletion
         row = db.query(ConflictData)\
-            .filter(func.lower(ConflictData.admin1) == admin1.lower())\
-            .filter(func.lower(ConflictData.country) == country.lower())\
+            .filter(ConflictData.admin1_key == normalise_key(admin1))\
+            .filter(ConflictData.country_key == normalise_key(country))\
             .first()
             # .filter(ConflictData.admin1 == admin1)\
             # .filter(ConflictData.country == country)\
@@ -224,7 +369,54 @@ def delete_conflict_data_row(
         db.commit()
         logger.info(f'Deleted row id {row.id} for {admin1}, {country}')
         return {'message': f"Deleted conflict data for admin1='{admin1}' in country='{country}'"}
-        
-    
-    
-    
+
+
+@router.post('/bulk')
+async def bulk_upload_conflict_data(
+    request: Request,
+    fmt: Optional[str] = Query(None, alias='format', pattern='^(csv|ndjson)$', description='Defaults from the Content-Type header'),
+    batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=50000),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(require_admin)
+):
+    '''Bulk upsert conflict data from a CSV (with header row) or NDJSON request body.
+    The body is parsed as it streams in and written in transactional batches of `batch_size` rows.
+    Rows are matched on (country, admin1) case-insensitively, so existing ids and feedback are kept.
+    Returns per-batch progress and a summary of inserted, updated, unchanged and rejected rows'''
+    if fmt is None:
+        content_type = request.headers.get('content-type', '')
+        fmt = 'ndjson' if 'ndjson' in content_type or 'jsonl' in content_type else 'csv'
+    logger.info(f'Admin user {user.email} started {fmt} bulk upload, batch size {batch_size}')
+    started = time.perf_counter()
+
+    db = SessionLocal()
+    batches = []
+    chunk = []
+    async def write_chunk():
+        # DB writes are blocking, so run them off the event loop
+        batch = await run_in_threadpool(ingest_batch, db, chunk, len(batches) + 1)
+        batch['rejects'] = batch['rejects'][:MAX_REJECTS_REPORTED]
+        batches.append(batch)
+        chunk.clear()
+
+    try:
+        async for record in aiter_records(aiter_lines(request.stream()), fmt):
+            chunk.append(record)
+            if len(chunk) >= batch_size:
+                await write_chunk()
+        if chunk:
+            await write_chunk()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail={'message': 'request body is not valid UTF-8', 'batches': batches})
+    except SQLAlchemyError as e:
+        logger.error(f'Bulk upload failed after {len(batches)} committed batches: {e}')
+        raise HTTPException(status_code=500, detail={'message': 'database error, later batches not written', 'batches': batches})
+    finally:
+        db.close()
+
+    summary = summarise(batches)
+    elapsed = time.perf_counter() - started
+    summary['seconds'] = round(elapsed, 4)
+    summary['rows_per_sec'] = round(summary['rows'] / elapsed, 1) if elapsed else None
+    logger.info(f'Bulk upload complete: {summary}')
+    return {'summary': summary, 'batches': batches}
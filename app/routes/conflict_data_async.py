@@ -0,0 +1,110 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Async versions of the conflict data routes, served when DATABASE_URL uses an async driver.
+
+Each handler awaits the sync implementation in `app.routes.conflict_data` through
+`AsyncSession.run_sync`. The ORM code runs unchanged, but its database IO goes through the async
+driver on the event loop rather than blocking a threadpool slot for the whole query. `run_sync`
+runs that code on the event loop thread, so the lists only run their queries there: building the
+items and encoding the JSON (`render`) go to the threadpool, as does a snapshot rebuild (see
+`SnapshotStore.current`).
+Routes not overridden here (e.g. bulk upload) fall through to the sync router, and
+authentication (`get_current_user`, `require_admin`) is sync, run on the threadpool.
+'''
+from fastapi import APIRouter, Body, Depends, Header, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import HTTPBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from typing import List, Optional
+
+from app.auth import get_current_user, require_admin
+from app.database import get_async_db
+from app.rate_limit import rate_limit
+from app.routes import conflict_data as sync_routes
+from app.routes.conflict_data import IF_NONE_MATCH_DESCRIPTION, MAX_FEEDBACK_BATCH, FeedbackBatchItem, FeedbackRequest
+from app.utils.response_utils import FastJSONResponse, render
+
+router = APIRouter(prefix='/conflictdata')
+security = HTTPBearer()
+
+
+@router.get('', response_class=FastJSONResponse, dependencies=[Depends(rate_limit)])
+async def get_conflict_data(
+        offset: int = Query(0, ge=0),
+        country: List[str] = Query(None),
+        page_size: int = Query(20, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description='`next_cursor` from a previous page (keyset pagination)'),
+        include_total: Optional[bool] = Query(None, description='Count matching rows. Defaults to true for offset paging, false for cursor paging'),
+        if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION),
+        db: AsyncSession = Depends(get_async_db)
+    ) -> FastJSONResponse:
+    '''Async version of `conflict_data.get_conflict_data`'''
+    result = await db.run_sync(lambda s: sync_routes.query_conflict_data(
+        offset, country, page_size, cursor, include_total, if_none_match, s))
+    return await run_in_threadpool(render, result)
+
+
+@router.get('/{country}', response_class=FastJSONResponse, dependencies=[Depends(rate_limit)])
+async def get_conflict_data_per_country(
+        country: str,
+        if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION),
+        db: AsyncSession = Depends(get_async_db)
+    ) -> FastJSONResponse:
+    '''Async version of `conflict_data.get_conflict_data_per_country`'''
+    result = await db.run_sync(lambda s: sync_routes.query_conflict_data_per_country(country, if_none_match, s))
+    return await run_in_threadpool(render, result)
+
+
+@router.get('/{country}/riskscore', response_class=FastJSONResponse, dependencies=[Depends(rate_limit)])
+async def get_risk_score_average(
+        country: str,
+        if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION),
+        db: AsyncSession = Depends(get_async_db)
+    ) -> FastJSONResponse:
+    '''Async version of `conflict_data.get_risk_score_average`'''
+    return await db.run_sync(lambda s: sync_routes.get_risk_score_average(
+        country=country, if_none_match=if_none_match, db=s))
+
+
+@router.post('/{admin1}/userfeedback')
+async def write_feedback(
+    payload: FeedbackRequest,
+    admin1: str,
+    country: str = Query(None),
+    db: AsyncSession = Depends(get_async_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(get_current_user),
+    response: Response = None
+):
+    '''Async version of `conflict_data.write_feedback`'''
+    return await db.run_sync(lambda s: sync_routes.write_feedback(
+        payload=payload, admin1=admin1, country=country, db=s, credentials=credentials, user=user, response=response))
+
+
+@router.post('/userfeedback')
+async def write_feedback_batch(
+    payload: List[FeedbackBatchItem] = Body(..., min_length=1, max_length=MAX_FEEDBACK_BATCH),
+    db: AsyncSession = Depends(get_async_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(get_current_user),
+    response: Response = None
+):
+    '''Async version of `conflict_data.write_feedback_batch`'''
+    return await db.run_sync(lambda s: sync_routes.write_feedback_batch(
+        payload=payload, db=s, credentials=credentials, user=user, response=response))
+
+
+@router.delete('')
+async def delete_conflict_data_row(
+    admin1: str = Query(...),
+    country: str = Query(...),
+    db: AsyncSession = Depends(get_async_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(require_admin)
+):
+    '''Async version of `conflict_data.delete_conflict_data_row`'''
+    return await db.run_sync(lambda s: sync_routes.delete_conflict_data_row(
+        admin1=admin1, country=country, db=s, credentials=credentials, user=user))
@@ -0,0 +1,98 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+
+from app.cache import MISSING, aggregate_cache
+from app.database import get_db
+from app.models import CountrySummary, normalise_key
+from app.rate_limit import rate_limit
+from app.utils.response_utils import FastJSONResponse
+from app.utils.statistical_utils import DEFAULT_PERCENTILES, country_statistics, summary_to_dict
+from app.utils.version_utils import TABLE_SCOPE, cache_headers, etag_matches, load_data_versions
+
+import hashlib
+from typing import List, Optional
+
+router = APIRouter(prefix='/countries', dependencies=[Depends(rate_limit)])
+
+STATISTICS_CACHE_NAMESPACE = 'country_statistics'
+MAX_PERCENTILES = 10
+
+# Sortable fields of the listing, mapped to summary columns
+SORT_COLUMNS = {
+    'country': CountrySummary.country_key,
+    'regions': CountrySummary.region_count,
+    'average_risk_score': CountrySummary.risk_score_avg,
+    'total_events': CountrySummary.events_sum,
+    'total_population': CountrySummary.population_sum,
+}
+
+
+@router.get('')
+def list_countries(
+    sort_by: str = Query('country', pattern=f'^({"|".join(SORT_COLUMNS)})$'),
+    descending: bool = Query(False),
+    db: dict = Depends(get_db)
+):
+    '''
+    List every country in the dataset with its precomputed aggregates
+    (region count, average/weighted risk score, total events and population)
+    '''
+    column = SORT_COLUMNS[sort_by]
+    summaries = db.query(CountrySummary)\
+        .order_by(column.desc() if descending else column, CountrySummary.country_key)\
+        .all()
+    return {'rows_returned': len(summaries), 'items': [summary_to_dict(s) for s in summaries]}
+
+
+@router.get('/statistics', response_class=FastJSONResponse)
+def get_country_statistics(
+    country: List[str] = Query(None, description='Countries to compare. All countries if omitted'),
+    percentile: List[float] = Query(list(DEFAULT_PERCENTILES), description='Risk score percentiles to report, 0-100'),
+    if_none_match: Optional[str] = Header(None, description='ETag of a cached copy. Returns 304 if the data has not changed since'),
+    db: dict = Depends(get_db)
+):
+    '''
+    Compare countries in one call: risk score mean, standard deviation, median and percentiles over
+    each country's regions, population-weighted risk score, events per 100k people and ranks among
+    the returned countries. Computed from one query over all requested countries and cached under
+    their data versions, so repeated calls don't query conflict_data until the data changes
+    '''
+    if len(percentile) > MAX_PERCENTILES or any(not 0 <= q <= 100 for q in percentile):
+        raise HTTPException(status_code=400, detail=f'Pass up to {MAX_PERCENTILES} percentiles between 0 and 100')
+    percentiles = sorted(set(percentile))
+    country_keys = sorted({normalise_key(c) for c in country}) if country else None
+    scopes = country_keys if country_keys is not None else [TABLE_SCOPE]
+    versions = load_data_versions(db, scopes)
+    headers = cache_headers(versions, scopes)
+    if etag_matches(if_none_match, headers):
+        return Response(status_code=304, headers=headers)
+
+    # Keyed by the versions of what was read, so changed data is never served from the cache
+    tag = ';'.join(f'{scope}:{versions[scope][0]}' for scope in scopes if scope in versions)
+    cache_key = hashlib.blake2b(f'{tag}|{percentiles}'.encode(), digest_size=16).hexdigest()
+    items = aggregate_cache.get(STATISTICS_CACHE_NAMESPACE, cache_key)
+    if items is MISSING:
+        # Countries without a data version have never had any rows
+        known_keys = [key for key in country_keys if key in versions] if country_keys is not None else None
+        items = country_statistics(db, known_keys, percentiles) if known_keys != [] else []
+        aggregate_cache.set(STATISTICS_CACHE_NAMESPACE, cache_key, items)
+    if not items:
+        raise HTTPException(status_code=404, detail='No data found for the requested countries')
+    found = {normalise_key(item['country']) for item in items}
+    return FastJSONResponse({
+        'rows_returned': len(items),
+        'percentiles': percentiles,
+        'not_found': [c for c in country if normalise_key(c) not in found] if country else [],
+        'items': items,
+    }, headers=headers)
+
+
+@router.get('/{country}')
+def get_country(country: str, db: dict = Depends(get_db)):
+    '''Precomputed aggregates for a single country'''
+    summary = db.get(CountrySummary, normalise_key(country))
+    if summary is None:
+        raise HTTPException(status_code=404, detail=f'No data found for "{country}"')
+    return summary_to_dict(summary)
@@ -0,0 +1,53 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import APIRouter, Depends, Header, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import SQLAlchemyError
+
+from typing import List, Optional
+
+from app.database import SessionLocal
+from app.models import normalise_key
+from app.rate_limit import rate_limit
+from app.routes.conflict_data import IF_NONE_MATCH_DESCRIPTION
+from app.utils.export_utils import EXPORT_FORMATS, iter_export_partitions
+from app.utils.version_utils import TABLE_SCOPE, cache_headers, etag_matches, load_data_versions
+
+router = APIRouter(prefix='/export', dependencies=[Depends(rate_limit)])
+
+
+@router.get('/conflictdata', response_class=StreamingResponse)
+def export_conflict_data(
+    fmt: str = Query('ndjson', alias='format', pattern='^(ndjson|csv)$'),
+    country: List[str] = Query(None),
+    if_none_match: Optional[str] = Header(None, description=IF_NONE_MATCH_DESCRIPTION)
+):
+    '''
+    Stream all conflict data, or that of the given countries, as NDJSON or CSV (with header row),
+    in the same order as `/conflictdata`. Rows are read and sent in chunks, so memory use does not
+    grow with the size of the export
+    '''
+    country_keys = [normalise_key(c) for c in country] if country else None
+    media_type, encode = EXPORT_FORMATS[fmt]
+    scopes = sorted(set(country_keys)) if country_keys else [TABLE_SCOPE]
+    with SessionLocal() as db:
+        headers = cache_headers(load_data_versions(db, scopes), scopes)
+    if etag_matches(if_none_match, headers):
+        return Response(status_code=304, headers=headers)
+    logger.info(f'Starting {fmt} export for countries {country or "all"}')
+
+    def stream():
+        # Own session, as the response body is sent after the request's dependencies have closed
+        with SessionLocal() as db:
+            try:
+                yield from encode(iter_export_partitions(db, country_keys))
+            except SQLAlchemyError:
+                # Headers are already sent, so the client sees a truncated body
+                logger.exception('Conflict data export failed part way through')
+                raise
+
+    return StreamingResponse(
+        stream(), media_type=media_type,
+        headers={**headers, 'Content-Disposition': f'attachment; filename="conflict_data.{fmt}"'}
+    )
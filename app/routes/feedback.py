@@ -0,0 +1,87 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.security import HTTPBearer
+
+from app.auth import get_current_user
+from app.database import get_db
+from app.models import ConflictData, CountrySummary, User, normalise_key
+from app.utils.feedback_utils import country_feedback, decode_feedback_cursor, region_feedback, user_feedback
+from app.utils.response_utils import FastJSONResponse
+
+from typing import Optional
+
+router = APIRouter(prefix='/feedback')
+security = HTTPBearer()
+
+CURSOR_DESCRIPTION = '`next_cursor` from a previous page'
+
+
+@router.get('/users/{user_id}', response_class=FastJSONResponse)
+def get_user_feedback(
+    user_id: int,
+    page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    db: dict = Depends(get_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(get_current_user)
+):
+    '''Feedback written by a user, oldest first, keyset paginated. Users can read their own; admins anyone's'''
+    if user.id != user_id and not user.is_admin:
+        logger.warning(f'User {user.email} requested feedback of user {user_id}')
+        raise HTTPException(status_code=403, detail='can only read your own feedback')
+    if user.id != user_id and db.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail='user not found')
+    items, next_cursor = user_feedback(db, user_id, decode_feedback_cursor(cursor), page_size)
+    return FastJSONResponse({
+        'user_id': user_id, 'rows_returned': len(items), 'page_size': page_size, 'next_cursor': next_cursor,
+        'items': items,
+    })
+
+
+@router.get('/{country}', response_class=FastJSONResponse)
+def get_country_feedback(
+    country: str,
+    page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    db: dict = Depends(get_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(get_current_user)
+):
+    '''Feedback on all of a country's regions, region by region (by admin1) and oldest first within each,
+    keyset paginated'''
+    country_key = normalise_key(country)
+    after = decode_feedback_cursor(cursor, keys=1)
+    if db.get(CountrySummary, country_key) is None:
+        raise HTTPException(status_code=404, detail=f'No data found for "{country}"')
+    items, next_cursor = country_feedback(db, country_key, after, page_size)
+    return FastJSONResponse({
+        'country': country, 'rows_returned': len(items), 'page_size': page_size, 'next_cursor': next_cursor,
+        'items': items,
+    })
+
+
+@router.get('/{country}/{admin1}', response_class=FastJSONResponse)
+def get_region_feedback(
+    country: str,
+    admin1: str,
+    page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description=CURSOR_DESCRIPTION),
+    db: dict = Depends(get_db),
+    credentials: HTTPBearer = Depends(security),
+    user: dict = Depends(get_current_user)
+):
+    '''Feedback on one region, oldest first, keyset paginated'''
+    after = decode_feedback_cursor(cursor)
+    region = db.query(ConflictData.id, ConflictData.country, ConflictData.admin1)\
+        .filter(ConflictData.country_key == normalise_key(country))\
+        .filter(ConflictData.admin1_key == normalise_key(admin1))\
+        .first()
+    if region is None:
+        raise HTTPException(status_code=404, detail=f"No region found matching '{admin1}' and country='{country}'")
+    items, next_cursor = region_feedback(db, region.id, after, page_size)
+    return FastJSONResponse({
+        'id': region.id, 'country': region.country, 'admin1': region.admin1, 'rows_returned': len(items),
+        'page_size': page_size, 'next_cursor': next_cursor, 'items': items,
+    })
@@ -0,0 +1,65 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.database import get_db
+from app.models import normalise_key
+from app.rate_limit import rate_limit
+from app.utils.history_utils import country_series, region_series
+from app.utils.response_utils import FastJSONResponse
+
+from datetime import date
+from typing import Optional
+
+router = APIRouter(prefix='/history', dependencies=[Depends(rate_limit)])
+
+MAX_HISTORY_PERIODS = 5000
+
+
+def _check_range(start: Optional[date], end: Optional[date]) -> None:
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail='start is after end')
+
+
+@router.get('/{country}', response_class=FastJSONResponse)
+def get_country_history(
+    country: str,
+    start: Optional[date] = Query(None, description='First period (inclusive)'),
+    end: Optional[date] = Query(None, description='Last period (inclusive)'),
+    limit: int = Query(520, ge=1, le=MAX_HISTORY_PERIODS, description='Most recent periods in the range'),
+    db: dict = Depends(get_db)
+):
+    '''
+    Time series of a country from conflict_data_history: per period, the number of regions recorded,
+    total events, average risk score and total population, each with its change from the previous
+    recorded period (absolute and %). Periods are in ascending order
+    '''
+    _check_range(start, end)
+    items = country_series(db, normalise_key(country), start, end, limit)
+    if not items:
+        raise HTTPException(status_code=404, detail=f'No history found for "{country}"')
+    return FastJSONResponse({'country': country, 'rows_returned': len(items), 'items': items})
+
+
+@router.get('/{country}/{admin1}', response_class=FastJSONResponse)
+def get_region_history(
+    country: str,
+    admin1: str,
+    start: Optional[date] = Query(None, description='First period (inclusive)'),
+    end: Optional[date] = Query(None, description='Last period (inclusive)'),
+    limit: int = Query(520, ge=1, le=MAX_HISTORY_PERIODS, description='Most recent periods in the range'),
+    db: dict = Depends(get_db)
+):
+    '''
+    Time series of one region from conflict_data_history: events, risk score and population per
+    period, each with its change from the previous recorded period (absolute and %)
+    '''
+    _check_range(start, end)
+    items = region_series(db, normalise_key(country), normalise_key(admin1), start, end, limit)
+    if not items:
+        raise HTTPException(status_code=404, detail=f'No history found for "{admin1}" in "{country}"')
+    names = {'country': items[-1]['country'], 'admin1': items[-1]['admin1']}
+    for item in items:
+        del item['country'], item['admin1']
+    return FastJSONResponse({**names, 'rows_returned': len(items), 'items': items})
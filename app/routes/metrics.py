@@ -0,0 +1,15 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.instrumentation import render_metrics
+
+router = APIRouter()
+
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    '''Request, SQL and password hashing metrics in Prometheus text format'''
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4')
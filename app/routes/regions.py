@@ -0,0 +1,26 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import APIRouter, Depends, Query
+
+from app.database import get_db
+from app.rate_limit import rate_limit
+from app.search import region_index
+
+router = APIRouter(prefix='/regions', dependencies=[Depends(rate_limit)])
+
+
+@router.get('/search')
+def search_regions(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    fuzzy: bool = Query(True, description='Fall back to trigram matching (typos) when prefixes give fewer than `limit` results'),
+    db: dict = Depends(get_db)
+):
+    '''
+    Autocomplete regions by admin1 or country name, ignoring case and accents.
+    Ranked admin1 prefix matches first, then admin1 word prefixes, country prefixes and fuzzy matches.
+    Served from an in-memory index, so no query runs unless the data has changed
+    '''
+    items = region_index.current(db).search(q, limit, fuzzy)
+    return {'query': q, 'rows_returned': len(items), 'items': items}
@@ -0,0 +1,254 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+In-memory region search index for `/regions/search`.
+
+Names are matched accent- and case-insensitively (`search_key`), in tiers:
+1. admin1 names starting with the query
+2. admin1 names with a later word starting with the query (`cape` finds Eastern Cape)
+3. regions of countries whose name (or a word of it) starts with the query
+4. fuzzy: admin1 and country names sharing enough trigrams with the query, for typos
+
+Tiers 1-3 are binary searches over sorted term arrays. Trigram postings serve tier 4.
+
+The index is rebuilt incrementally from the per-country data versions (see
+`app.utils.version_utils`). When they change, only the changed countries are reloaded and
+re-tokenised, and a new index is swapped in. A conflict_data change in this process triggers
+the version check on the next search. Changes from other processes are noticed within
+REGION_INDEX_MAX_AGE_SECONDS.
+'''
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import ConflictData
+from app.utils.version_utils import TABLE_SCOPE, load_data_versions
+
+from bisect import bisect_left
+from collections import defaultdict
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+REGION_INDEX_MAX_AGE_SECONDS = float(os.getenv('REGION_INDEX_MAX_AGE_SECONDS', '60'))
+# Minimum trigram similarity (Jaccard) for a fuzzy match
+FUZZY_THRESHOLD = float(os.getenv('REGION_SEARCH_FUZZY_THRESHOLD', '0.3'))
+_WORD = re.compile(r'\w+')
+
+
+def search_key(value: str) -> str:
+    '''Accent- and case-insensitive form of a name, e.g. `São Tomé` -> `sao tome`'''
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def word_starts(key: str) -> List[str]:
+    '''Suffixes of `key` starting at its second and later words'''
+    return [key[match.start():] for match in _WORD.finditer(key) if match.start() > 0]
+
+
+def trigrams(key: str) -> set:
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Region(NamedTuple):
+    id: int
+    country: str
+    admin1: str
+    admin1_key: str  # search_key of admin1
+    trigrams: frozenset
+
+
+class CountryEntry(NamedTuple):
+    '''One country's tokenised regions, reused across rebuilds until the country changes'''
+    country: str
+    key: str  # search_key of country
+    trigrams: frozenset
+    regions: tuple
+
+
+def load_countries(db: Session, country_keys: Optional[Iterable[str]] = None) -> Dict[str, CountryEntry]:
+    '''Load and tokenise the regions of the given country keys (all if None), keyed by country key'''
+    statement = select(ConflictData.country_key, ConflictData.id, ConflictData.country, ConflictData.admin1)\
+        .order_by(ConflictData.country_key, ConflictData.admin1_key, ConflictData.id)
+    if country_keys is not None:
+        statement = statement.where(ConflictData.country_key.in_(set(country_keys)))
+    grouped = defaultdict(list)
+    for country_key, id_, country, admin1 in db.execute(statement):
+        key = search_key(admin1)
+        grouped[country_key].append(Region(id_, country, admin1, key, frozenset(trigrams(key))))
+    entries = {}
+    for country_key, regions in grouped.items():
+        key = search_key(regions[0].country)
+        entries[country_key] = CountryEntry(regions[0].country, key, frozenset(trigrams(key)), tuple(regions))
+    return entries
+
+
+class RegionIndex:
+    '''Immutable search structures over a set of `CountryEntry`s'''
+
+    def __init__(self, countries: Dict[str, CountryEntry], versions: dict):
+        self.countries = countries
+        self.versions = versions
+        self.checked_at = time.monotonic()
+        # Regions of all countries in one list, with each country's first position
+        self.regions = []
+        self.country_offsets = {}
+        for country_key, entry in countries.items():
+            self.country_offsets[country_key] = len(self.regions)
+            self.regions.extend(entry.regions)
+
+        # Each tier: sorted terms with the region (or country) each term came from
+        def tier(pairs):
+            pairs.sort(key=lambda pair: pair[0])
+            return [term for term, _ in pairs], [ref for _, ref in pairs]
+
+        self.admin1_terms, self.admin1_refs = tier([(r.admin1_key, i) for i, r in enumerate(self.regions)])
+        self.word_terms, self.word_refs = tier(
+            [(term, i) for i, r in enumerate(self.regions) for term in word_starts(r.admin1_key)])
+        self.country_terms, self.country_refs = tier(
+            [(term, country_key) for country_key, entry in countries.items()
+             for term in (entry.key, *word_starts(entry.key))])
+
+        self.region_postings = defaultdict(list)
+        for i, region in enumerate(self.regions):
+            for gram in region.trigrams:
+                self.region_postings[gram].append(i)
+        self.country_postings = defaultdict(list)
+        for country_key, entry in countries.items():
+            for gram in entry.trigrams:
+                self.country_postings[gram].append(country_key)
+
+    @classmethod
+    def build(cls, db: Session, versions: dict, previous: Optional['RegionIndex'] = None,
+              changed: Optional[set] = None) -> 'RegionIndex':
+        '''Build from the database, reusing `previous` for countries not in `changed` (all reloaded if None)'''
+        started = time.perf_counter()
+        if previous is None or changed is None:
+            countries = load_countries(db)
+        else:
+            countries = {k: v for k, v in previous.countries.items() if k not in changed}
+            countries.update(load_countries(db, changed))
+            # Keep country order stable, so results don't reorder between rebuilds
+            countries = dict(sorted(countries.items()))
+        index = cls(countries, versions)
+        logger.info(f'Built region index of {len(index.regions)} regions '
+                    f'({"all" if changed is None else len(changed)} countries reloaded) in {time.perf_counter() - started:.3f}s')
+        return index
+
+    def _prefix(self, terms: list, refs: list, prefix: str):
+        position = bisect_left(terms, prefix)
+        while position < len(terms) and terms[position].startswith(prefix):
+            yield refs[position]
+            position += 1
+
+    def _fuzzy(self, key: str, limit: int) -> List[tuple]:
+        '''(similarity, region position) of the closest admin1 or country names'''
+        query_grams = trigrams(key)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for position in self.region_postings.get(gram, ()):
+                shared[position] += 1
+        scored = [
+            (count / (len(query_grams) + len(self.regions[position].trigrams) - count), position)
+            for position, count in shared.items()
+        ]
+        country_shared = defaultdict(int)
+        for gram in query_grams:
+            for country_key in self.country_postings.get(gram, ()):
+                country_shared[country_key] += 1
+        for country_key, count in country_shared.items():
+            entry = self.countries[country_key]
+            similarity = count / (len(query_grams) + len(entry.trigrams) - count)
+            if similarity >= FUZZY_THRESHOLD:
+                start = self.country_offsets[country_key]
+                scored.extend((similarity, position) for position in range(start, start + len(entry.regions)))
+        scored = [pair for pair in scored if pair[0] >= FUZZY_THRESHOLD]
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored[:limit]
+
+    def search(self, query: str, limit: int = 10, fuzzy: bool = True) -> List[dict]:
+        '''Up to `limit` regions matching `query`, best tier first'''
+        key = search_key(query).strip()
+        if not key:
+            return []
+        results = []
+        seen = set()
+
+        def add(position: int, match: str, score: float = 1.0) -> bool:
+            if position not in seen:
+                seen.add(position)
+                region = self.regions[position]
+                results.append({'id': region.id, 'country': region.country, 'admin1': region.admin1,
+                                'match': match, 'score': round(score, 3)})
+            return len(results) >= limit
+
+        for match, positions in (('admin1_prefix', self._prefix(self.admin1_terms, self.admin1_refs, key)),
+                                 ('admin1_word_prefix', self._prefix(self.word_terms, self.word_refs, key))):
+            for position in positions:
+                if add(position, match):
+                    return results
+        for country_key in self._prefix(self.country_terms, self.country_refs, key):
+            start = self.country_offsets[country_key]
+            for position in range(start, start + len(self.countries[country_key].regions)):
+                if add(position, 'country_prefix'):
+                    return results
+        if fuzzy and len(key) >= 3:
+            for similarity, position in self._fuzzy(key, limit):
+                if add(position, 'fuzzy', similarity):
+                    return results
+        return results
+
+
+class RegionIndexStore:
+    '''Holds the current index and brings it up to date with the data versions'''
+
+    def __init__(self, max_age: float = REGION_INDEX_MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self._index = None
+        self._check_due = True
+        self._updating = threading.Lock()
+
+    def invalidate(self) -> None:
+        '''Check the data versions on the next search, e.g. after conflict_data changed'''
+        self._check_due = True
+
+    def refresh(self, db: Session) -> RegionIndex:
+        '''Reload the countries whose data version changed since the current index, and swap in the result'''
+        self._check_due = False
+        index = self._index
+        versions = load_data_versions(db)
+        if index is not None and versions == index.versions:
+            index.checked_at = time.monotonic()
+            return index
+        changed = None
+        if index is not None:
+            changed = {k for k in versions.keys() | index.versions.keys()
+                       if versions.get(k) != index.versions.get(k)} - {TABLE_SCOPE}
+        self._index = RegionIndex.build(db, versions, index, changed)
+        return self._index
+
+    def current(self, db: Session) -> RegionIndex:
+        '''
+        The current index, updated first if due. While another request is updating it, the
+        previous index is served rather than waiting
+        '''
+        index = self._index
+        if index is not None and not self._check_due and time.monotonic() - index.checked_at < self.max_age:
+            return index
+        if not self._updating.acquire(blocking=index is None):
+            return index
+        try:
+            if self._index is not index and not self._check_due:
+                # Updated by another request while this one waited for the first build
+                return self._index
+            return self.refresh(db)
+        finally:
+            self._updating.release()
+
+
+region_index = RegionIndexStore()
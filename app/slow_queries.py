@@ -0,0 +1,168 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Slow-query log.
+
+Engine hooks (registered by `watch_slow_queries` in `app.database`) time every statement. One that
+takes longer than SLOW_QUERY_THRESHOLD_MS is logged and captured, with its parameters and query
+plan (`EXPLAIN QUERY PLAN` on SQLite, `EXPLAIN` on PostgreSQL), into a ring buffer of the last
+SLOW_QUERY_BUFFER_SIZE captures, served by `GET /admin/slow-queries`. Captures whose plan reads a
+whole table or index rather than seeking into one (e.g. a filter on `lower(country)`, which no
+index covers) are flagged `full_scan`.
+
+Parameter values are redacted to their type (e.g. `<str>`), as they include password hashes
+(register/login) and feedback text. SLOW_QUERY_PARAMETERS=True captures the values, e.g. while
+reproducing a slow query on a development database.
+
+Durations are those of the driver's execute call. SQLite runs a SELECT up to its first row there,
+so a query that sorts or aggregates is timed in full, but rows streamed after the first are not.
+'''
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.instrumentation import current_request_metrics
+
+from collections import deque
+from datetime import datetime, timezone
+import os
+import re
+import threading
+import time
+
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG', 'True') == 'True'
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv('SLOW_QUERY_BUFFER_SIZE', '100'))
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'True') == 'True'
+# Capture parameter values rather than their types. Off by default: values can be secrets or personal data
+SLOW_QUERY_PARAMETERS = os.getenv('SLOW_QUERY_PARAMETERS', 'False') == 'True'
+
+# SQLite `SCAN <table>` (with or without `USING INDEX`, which walks the whole index), or a PostgreSQL sequential scan
+FULL_SCAN = re.compile(r'^SCAN |Seq Scan on')
+_STARTS = 'slow_query_starts'
+_MAX_PARAMETER_LENGTH = 200
+
+
+class SlowQueryLog:
+    '''Thread-safe ring buffer of the most recent slow query captures'''
+
+    def __init__(self, size: int = SLOW_QUERY_BUFFER_SIZE):
+        self._captures = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.total = 0
+
+    def record(self, capture: dict) -> None:
+        with self._lock:
+            self.total += 1
+            self._captures.append(capture)
+
+    def entries(self) -> list:
+        '''Captures, newest first'''
+        with self._lock:
+            captures = list(self._captures)
+        captures.reverse()
+        return captures
+
+    def clear(self) -> int:
+        with self._lock:
+            cleared = len(self._captures)
+            self._captures.clear()
+        return cleared
+
+
+slow_query_log = SlowQueryLog()
+
+
+def _redacted(value):
+    return None if value is None else f'<{type(value).__name__}>'
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value.decode(errors='replace') if isinstance(value, bytes) else str(value)
+    return text if len(text) <= _MAX_PARAMETER_LENGTH else text[:_MAX_PARAMETER_LENGTH] + '...'
+
+
+def _parameter_sets(parameters, executemany: bool) -> tuple:
+    '''
+    (first parameter set, number of sets or None). An executemany passes a list of sets, except
+    batched "insertmanyvalues" INSERTs, which pass the flat parameters of one multi-row statement
+    '''
+    if executemany and parameters and isinstance(parameters[0], (dict, list, tuple)):
+        return parameters[0], len(parameters)
+    return parameters, None
+
+
+def _parameters(parameters, values: bool = SLOW_QUERY_PARAMETERS):
+    '''Parameters as JSON types with long values truncated if `values`, else redacted to their type names'''
+    convert = _jsonable if values else _redacted
+    if isinstance(parameters, dict):
+        return {key: convert(value) for key, value in parameters.items()}
+    return [convert(value) for value in parameters or ()]
+
+
+def explain(dbapi_connection, dialect_name: str, statement: str, parameters) -> list:
+    '''The statement's plan, one line per step, run on a separate cursor of the same connection'''
+    if dialect_name == 'sqlite':
+        prefix, column = 'EXPLAIN QUERY PLAN ', 3
+    elif dialect_name == 'postgresql':
+        prefix, column = 'EXPLAIN ', 0
+    else:
+        return []
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [row[column] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_STARTS, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get(_STARTS)
+    if not starts:
+        return
+    duration_ms = (time.perf_counter() - starts.pop()) * 1000
+    if duration_ms < SLOW_QUERY_THRESHOLD_MS or statement.startswith('EXPLAIN'):
+        return
+    first_parameters, sets = _parameter_sets(parameters, executemany)
+    plan = []
+    if SLOW_QUERY_EXPLAIN:
+        try:
+            plan = explain(conn.connection.dbapi_connection, conn.dialect.name, statement, first_parameters)
+        except Exception as e:
+            # Capture the query anyway; e.g. a statement the database can't explain
+            plan = [f'EXPLAIN failed: {e}']
+    request = current_request_metrics()
+    capture = {
+        'captured_at': datetime.now(timezone.utc).isoformat(),
+        'duration_ms': round(duration_ms, 2),
+        'statement': statement,
+        'parameters': _parameters(first_parameters),
+        'executemany': sets,
+        'plan': plan,
+        'full_scan': any(FULL_SCAN.search(line) for line in plan),
+        'request': request.request if request is not None else None,
+    }
+    slow_query_log.record(capture)
+    logger.warning(f'Slow query ({duration_ms:.1f}ms{", full scan" if capture["full_scan"] else ""}'
+                   f'{" in " + capture["request"] if capture["request"] else ""}): {" ".join(statement.split())}')
+
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get(_STARTS) if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+
+def watch_slow_queries(engine: Engine) -> None:
+    '''Capture statements on this (sync) engine that exceed SLOW_QUERY_THRESHOLD_MS'''
+    if not SLOW_QUERY_LOG:
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
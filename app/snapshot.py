@@ -0,0 +1,235 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Read-only in-memory snapshot of conflict_data for the GET endpoints.
+
+With SNAPSHOT_MODE=True, the table is loaded into a columnar `ConflictSnapshot` (one array or
+list per column, rows sorted by (country_key, admin1_key, id), plus a country key -> row range
+index). Pages, per-country lists and average risk scores are then answered without a query or
+ORM objects.
+
+A committed write to conflict_data bumps the store's generation (see `app.data_events`), and
+the next read builds a new snapshot and swaps it in. Readers hold a reference to the snapshot
+they started with, so a swap never changes a response half way through. Writes made by other
+processes don't reach this process's hooks, so every SNAPSHOT_MAX_AGE_SECONDS the stored table
+version is compared with the one the snapshot was built from.
+'''
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.database import EVENT_LOOP_SESSION, SessionLocal
+from app.models import ConflictData
+from app.utils.version_utils import TABLE_SCOPE, load_data_versions
+
+from array import array
+from bisect import bisect_right
+import os
+import sys
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+SNAPSHOT_MODE = os.getenv('SNAPSHOT_MODE', 'False') == 'True'
+SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv('SNAPSHOT_MAX_AGE_SECONDS', '60'))
+
+
+class SnapshotRow(NamedTuple):
+    '''One conflict_data row. Same attribute names as `ConflictData`, same column order as `LIST_COLUMNS`'''
+    id: int
+    country: str
+    admin1: str
+    population: Optional[int]
+    events: int
+    risk_score: int
+    country_key: str
+    admin1_key: str
+
+
+class ConflictSnapshot:
+    '''Immutable columnar copy of conflict_data, sorted by (country_key, admin1_key, id)'''
+
+    def __init__(self, rows: Iterable[Sequence], generation: int = 0, versions: Optional[dict] = None):
+        self.generation = generation
+        # Data versions the rows were read at, for ETags (see `app.utils.version_utils`)
+        self.versions = versions or {}
+        # When the data was last known to match the database
+        self.checked_at = time.monotonic()
+        self.ids = array('q')
+        self.events = array('q')
+        self.risk_scores = array('q')
+        # population is nullable, so nulls are flagged separately and stored as 0
+        self.populations = array('q')
+        self.population_null = bytearray()
+        self.countries = []
+        self.admin1s = []
+        self.country_keys = []
+        self.admin1_keys = []
+        # country_key -> (first row, last row + 1)
+        self.country_ranges = {}
+        self.risk_score_avgs = {}
+
+        risk_score_sum = 0
+        for position, (id_, country, admin1, country_key, admin1_key, population, events, risk_score) in enumerate(rows):
+            if country_key not in self.country_ranges:
+                self._close_country(position, risk_score_sum)
+                self.country_ranges[country_key] = (position, position)
+                risk_score_sum = 0
+            self.ids.append(id_)
+            # Country names repeat for every region, so share one string per name
+            self.countries.append(sys.intern(country))
+            self.country_keys.append(sys.intern(country_key))
+            self.admin1s.append(admin1)
+            self.admin1_keys.append(admin1_key)
+            self.populations.append(population or 0)
+            self.population_null.append(population is None)
+            self.events.append(events)
+            self.risk_scores.append(risk_score)
+            risk_score_sum += risk_score
+        self._close_country(len(self.ids), risk_score_sum)
+
+    def _close_country(self, end: int, risk_score_sum: int) -> None:
+        if not self.country_ranges:
+            return
+        country_key = self.country_keys[-1]
+        start = self.country_ranges[country_key][0]
+        self.country_ranges[country_key] = (start, end)
+        self.risk_score_avgs[country_key] = risk_score_sum / (end - start)
+
+    @classmethod
+    def load(cls, db: Session, generation: int = 0) -> 'ConflictSnapshot':
+        '''Build a snapshot from the table in one ordered query (walks the (country_key, admin1_key) index)'''
+        started = time.perf_counter()
+        # Same transaction as the rows, so the versions describe exactly this data
+        versions = load_data_versions(db)
+        rows = db.execute(
+            select(ConflictData.id, ConflictData.country, ConflictData.admin1, ConflictData.country_key,
+                   ConflictData.admin1_key, ConflictData.population, ConflictData.events, ConflictData.risk_score)
+            .order_by(ConflictData.country_key, ConflictData.admin1_key, ConflictData.id)
+        )
+        snapshot = cls(rows, generation, versions)
+        logger.info(f'Built conflict data snapshot of {len(snapshot)} rows in {time.perf_counter() - started:.3f}s')
+        return snapshot
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row(self, position: int) -> SnapshotRow:
+        return SnapshotRow(
+            self.ids[position], self.countries[position], self.admin1s[position],
+            None if self.population_null[position] else self.populations[position],
+            self.events[position], self.risk_scores[position], self.country_keys[position], self.admin1_keys[position],
+        )
+
+    def _sort_key(self, position: int) -> tuple:
+        return self.country_keys[position], self.admin1_keys[position], self.ids[position]
+
+    def ranges(self, country_keys: Optional[Iterable[str]] = None) -> List[tuple]:
+        '''Row ranges for the given country keys (whole table if None), in sort order'''
+        if country_keys is None:
+            return [(0, len(self))]
+        return [self.country_ranges[k] for k in sorted(set(country_keys)) if k in self.country_ranges]
+
+    def count(self, country_keys: Optional[Iterable[str]] = None) -> int:
+        return sum(end - start for start, end in self.ranges(country_keys))
+
+    def page(self, country_keys: Optional[Iterable[str]] = None, after: Optional[Sequence] = None,
+             offset: int = 0, limit: Optional[int] = None) -> List[SnapshotRow]:
+        '''
+        Rows for the given country keys (all if None) in (country_key, admin1_key, id) order,
+        starting after the sort key `after` if given, then skipping `offset` rows
+        '''
+        ranges = self.ranges(country_keys)
+        if after is not None:
+            first = bisect_right(range(len(self)), tuple(after), key=self._sort_key)
+            ranges = [(max(start, first), end) for start, end in ranges if end > first]
+        rows = []
+        for start, end in ranges:
+            if offset >= end - start:
+                offset -= end - start
+                continue
+            start += offset
+            offset = 0
+            if limit is not None:
+                end = min(end, start + limit - len(rows))
+            rows.extend(self.row(position) for position in range(start, end))
+            if limit is not None and len(rows) >= limit:
+                break
+        return rows
+
+    def risk_score_avg(self, country_key: str) -> Optional[float]:
+        '''Average risk score over a country's regions, None if the country has no rows'''
+        return self.risk_score_avgs.get(country_key)
+
+
+class SnapshotStore:
+    '''Holds the current snapshot and rebuilds it when stale'''
+
+    def __init__(self, enabled: bool = SNAPSHOT_MODE, max_age: float = SNAPSHOT_MAX_AGE_SECONDS):
+        self.enabled = enabled
+        self.max_age = max_age
+        self._snapshot = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._rebuilding = threading.Lock()
+
+    def invalidate(self) -> None:
+        '''Mark the current snapshot stale, e.g. after conflict_data changed'''
+        with self._lock:
+            self._generation += 1
+
+    def _is_fresh(self, snapshot: Optional[ConflictSnapshot], db: Session) -> bool:
+        if snapshot is None or snapshot.generation != self._generation:
+            return False
+        if time.monotonic() - snapshot.checked_at < self.max_age:
+            return True
+        # Only another process can have changed the data, and it would have bumped the table version
+        if load_data_versions(db, [TABLE_SCOPE]).get(TABLE_SCOPE) != snapshot.versions.get(TABLE_SCOPE):
+            return False
+        snapshot.checked_at = time.monotonic()
+        return True
+
+    def refresh(self, db: Session) -> ConflictSnapshot:
+        '''Build a snapshot now and swap it in'''
+        generation = self._generation
+        snapshot = ConflictSnapshot.load(db, generation)
+        # A write committed during the build bumped the generation, so this one is stale on arrival
+        self._snapshot = snapshot
+        return snapshot
+
+    def _refresh_in_background(self) -> None:
+        '''`refresh` with a new sync session, then release the rebuild lock taken by `current`'''
+        try:
+            with SessionLocal() as db:
+                self.refresh(db)
+        except SQLAlchemyError:
+            logger.exception('Snapshot rebuild failed, a later request will retry')
+        finally:
+            self._rebuilding.release()
+
+    def current(self, db: Session) -> Optional[ConflictSnapshot]:
+        '''
+        The current snapshot, rebuilt first if stale. Returns None if snapshot mode is off, or if
+        the snapshot is being rebuilt by another request, in which case the caller queries the table
+        instead. The rebuild is CPU-bound, so from an async route (`db` is an `EVENT_LOOP_SESSION`,
+        used through `run_sync` on the event loop thread) it is started on a background thread with
+        its own sync session, and this request also gets None
+        '''
+        if not self.enabled:
+            return None
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot, db):
+            return snapshot
+        if not self._rebuilding.acquire(blocking=False):
+            return None
+        if db.info.get(EVENT_LOOP_SESSION):
+            threading.Thread(target=self._refresh_in_background, name='snapshot-rebuild', daemon=True).start()
+            return None
+        try:
+            return self.refresh(db)
+        finally:
+            self._rebuilding.release()
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,62 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Chunked conflict data export, for streaming responses.
+
+Rows are read in (country_key, admin1_key, id) order with `yield_per`, so the driver streams them
+(a server-side cursor on PostgreSQL) and at most one chunk of rows is held in memory at a time.
+Each chunk is encoded to one block of bytes. Exported files can be loaded back with the bulk
+upload endpoint, which matches rows on (country, admin1) and ignores `id`.
+'''
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import ConflictData
+from app.utils.response_utils import ITEM_FIELDS
+
+import csv
+import io
+import os
+from typing import Iterable, Iterator, Optional, Sequence
+
+import orjson
+
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '2000'))
+
+
+def iter_export_partitions(db: Session, country_keys: Optional[Iterable[str]] = None,
+                           chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[Sequence]:
+    '''Yield lists of up to `chunk_rows` rows of `ITEM_FIELDS`, for the given country keys (all if None)'''
+    statement = select(*(getattr(ConflictData, field) for field in ITEM_FIELDS))\
+        .order_by(ConflictData.country_key, ConflictData.admin1_key, ConflictData.id)\
+        .execution_options(yield_per=chunk_rows)
+    if country_keys:
+        statement = statement.where(ConflictData.country_key.in_(set(country_keys)))
+    yield from db.execute(statement).partitions()
+
+
+def ndjson_chunks(partitions: Iterable[Sequence]) -> Iterator[bytes]:
+    for rows in partitions:
+        yield b''.join(orjson.dumps(dict(zip(ITEM_FIELDS, row))) + b'\n' for row in rows)
+
+
+def csv_chunks(partitions: Iterable[Sequence]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(ITEM_FIELDS)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only, for an empty export
+        yield buffer.getvalue().encode()
+
+
+# Format -> (media type, chunk encoder)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', ndjson_chunks),
+    'csv': ('text/csv; charset=utf-8', csv_chunks),
+}
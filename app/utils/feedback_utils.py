@@ -0,0 +1,117 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+user_feedback reads: keyset pages per region, country and user, and feedback counts per region.
+
+Pages seek to the row after the cursor's sort key and read only the page from an index, so the
+cost of a page does not grow with its position:
+- a region's feedback, in (created_at, id) order, is one range of idx_feedback_region_created
+- a country's feedback goes region by region in admin1_key order (the (country_key, admin1_key)
+  index), each region in (created_at, id) order, so needs no sort either
+- a user's feedback, in (created_at, id) order, is one range of idx_feedback_user_created
+'''
+from fastapi import HTTPException
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.models import ConflictData, UserFeedback
+from app.utils.pagination_utils import decode_cursor, encode_cursor
+
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+# Item fields of a region's feedback, and of country/user listings, which also name the region
+REGION_FEEDBACK_COLUMNS = (
+    UserFeedback.id, UserFeedback.user_id, UserFeedback.feedback_text, UserFeedback.created_at, UserFeedback.updated_at,
+)
+FEEDBACK_COLUMNS = (
+    UserFeedback.id, UserFeedback.user_id, UserFeedback.conflict_data_id, ConflictData.country,
+    ConflictData.admin1, UserFeedback.feedback_text, UserFeedback.created_at, UserFeedback.updated_at,
+)
+
+
+def feedback_counts(db: Session, conflict_data_ids: Iterable[int]) -> dict:
+    '''
+    {conflict_data_id: number of feedback notes} for the given regions, in one grouped query over
+    idx_feedback_region_created (index only). Regions without feedback are absent
+    '''
+    conflict_data_ids = set(conflict_data_ids)
+    if not conflict_data_ids:
+        return {}
+    return dict(db.execute(
+        select(UserFeedback.conflict_data_id, func.count())
+        .where(UserFeedback.conflict_data_id.in_(conflict_data_ids))
+        .group_by(UserFeedback.conflict_data_id)
+    ).all())
+
+
+def decode_feedback_cursor(cursor: Optional[str], keys: int = 0) -> Optional[list]:
+    '''
+    Decode a feedback page cursor: `keys` string sort keys (e.g. admin1_key), then created_at and id.
+    Raises 400 if malformed
+    '''
+    if cursor is None:
+        return None
+    after = decode_cursor(cursor, keys + 2)
+    try:
+        if not (all(isinstance(key, str) for key in after[:keys]) and isinstance(after[-1], int)):
+            raise ValueError
+        after[-2] = datetime.fromisoformat(after[-2])
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='invalid cursor')
+    return after
+
+
+def _page(db: Session, statement, sort_columns: tuple, after: Optional[list], page_size: int) -> Tuple[list, Optional[str]]:
+    '''Up to `page_size` rows after the sort key `after`, and the cursor of the next page (None if last)'''
+    if after is not None:
+        statement = statement.where(tuple_(*sort_columns) > tuple(after))
+    # Fetch one extra row to tell whether there is a next page
+    rows = db.execute(statement.order_by(*sort_columns).limit(page_size + 1)).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]._mapping
+        keys = [last[column.key] for column in sort_columns]
+        next_cursor = encode_cursor(*keys[:-2], keys[-2].isoformat(), keys[-1])
+    return rows, next_cursor
+
+
+def _items(rows: list) -> List[dict]:
+    return [row._asdict() for row in rows]
+
+
+def region_feedback(db: Session, conflict_data_id: int, after: Optional[list] = None,
+                    page_size: int = 20) -> Tuple[List[dict], Optional[str]]:
+    '''A page of a region's feedback, oldest first, and the next page's cursor'''
+    statement = select(*REGION_FEEDBACK_COLUMNS).where(UserFeedback.conflict_data_id == conflict_data_id)
+    rows, next_cursor = _page(db, statement, (UserFeedback.created_at, UserFeedback.id), after, page_size)
+    return _items(rows), next_cursor
+
+
+def country_feedback(db: Session, country_key: str, after: Optional[list] = None,
+                     page_size: int = 20) -> Tuple[List[dict], Optional[str]]:
+    '''A page of a country's feedback, by region (admin1_key) then oldest first, and the next page's cursor'''
+    statement = select(*FEEDBACK_COLUMNS, ConflictData.admin1_key)\
+        .join(UserFeedback, UserFeedback.conflict_data_id == ConflictData.id)\
+        .where(ConflictData.country_key == country_key)
+    if after is not None:
+        # Redundant with the cursor condition, but lets the region loop seek to the cursor's region
+        statement = statement.where(ConflictData.admin1_key >= after[0])
+    rows, next_cursor = _page(db, statement, (ConflictData.admin1_key, UserFeedback.created_at, UserFeedback.id),
+                              after, page_size)
+    items = _items(rows)
+    for item in items:
+        del item['admin1_key']
+    return items, next_cursor
+
+
+def user_feedback(db: Session, user_id: int, after: Optional[list] = None,
+                  page_size: int = 20) -> Tuple[List[dict], Optional[str]]:
+    '''A page of a user's feedback, oldest first, and the next page's cursor'''
+    statement = select(*FEEDBACK_COLUMNS)\
+        .join(ConflictData, ConflictData.id == UserFeedback.conflict_data_id)\
+        .where(UserFeedback.user_id == user_id)
+    rows, next_cursor = _page(db, statement, (UserFeedback.created_at, UserFeedback.id), after, page_size)
+    return _items(rows), next_cursor
@@ -0,0 +1,112 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Bounded executor for CPU-heavy password hashing, so a login spike cannot starve
+the threadpool that serves the read endpoints.
+'''
+from fastapi.concurrency import run_in_threadpool
+
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+import time
+from typing import Callable
+
+
+class PoolSaturated(Exception):
+    '''Raised when the executor already has its maximum number of running and queued jobs'''
+
+
+class LatencyStats:
+    '''Thread-safe latency counters with percentiles over the most recent samples'''
+
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self._recent.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent:
+            return 0.0
+        return recent[min(len(recent) - 1, int(q * len(recent)))]
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean_seconds': self.total / self.count if self.count else 0.0,
+            'p50_seconds': self.percentile(0.5),
+            'p99_seconds': self.percentile(0.99),
+            'max_seconds': self.max,
+        }
+
+
+def _timed(fn: Callable, *args):
+    # Runs in the worker, so measures the hash itself rather than time spent queueing
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class BoundedExecutor:
+    '''
+    Runs blocking calls on a dedicated thread or process pool, with at most `max_queue` calls
+    waiting behind the `workers` running ones. Further calls raise `PoolSaturated` immediately.
+    With `workers=0`, calls run on the shared FastAPI threadpool without limits.
+    '''
+
+    def __init__(self, workers: int, max_queue: int, kind: str = 'thread', name: str = 'pool'):
+        self.workers = workers
+        self.name = name
+        self.run_latency = LatencyStats()
+        self.wait_latency = LatencyStats()
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(workers + max_queue) if workers else None
+        self._executor = None
+        if workers:
+            if kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    async def run(self, fn: Callable, *args):
+        submitted = time.perf_counter()
+        if self._executor is None:
+            result, elapsed = await run_in_threadpool(_timed, fn, *args)
+        else:
+            if not self._slots.acquire(blocking=False):
+                self.rejected += 1
+                logger.warning(f'{self.name} saturated, rejecting call')
+                raise PoolSaturated(self.name)
+            try:
+                loop = asyncio.get_running_loop()
+                result, elapsed = await loop.run_in_executor(self._executor, _timed, fn, *args)
+            finally:
+                self._slots.release()
+        self.run_latency.observe(elapsed)
+        self.wait_latency.observe(time.perf_counter() - submitted - elapsed)
+        return result
+
+    def metrics(self) -> dict:
+        return {
+            'workers': self.workers,
+            'rejected': self.rejected,
+            'run': self.run_latency.snapshot(),
+            'queue_wait': self.wait_latency.snapshot(),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,198 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+conflict_data_history: loading and time-series queries.
+
+History is append-only. A (region, period) row is never rewritten: loading a period again skips
+the regions it already has. Two batched load paths:
+- `snapshot_current`: copy the whole of conflict_data into a period with one INSERT ... SELECT,
+  e.g. weekly from cron (`python -m scripts.load_history --snapshot`)
+- `ingest_history_file`: stream a CSV/NDJSON file of past periods (conflict_data columns plus
+  `period`), one multi-row insert per batch
+
+Series queries read one contiguous primary key range per region, or one range of the covering
+(country_key, period) index per country, so their cost depends on the periods returned, not on
+the size of the table.
+'''
+from sqlalchemy import Date, DateTime, func, literal, select, true
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import ConflictData, ConflictDataHistory
+from app.utils.ingest_utils import parse_record, read_records, summarise
+
+from datetime import date, datetime, timedelta
+from itertools import islice
+import os
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '10000'))
+HISTORY_COLUMNS = ('country_key', 'admin1_key', 'period', 'country', 'admin1', 'population', 'events', 'risk_score')
+
+
+def period_start(day: date) -> date:
+    '''The period (week, starting Monday) a day falls in'''
+    return day - timedelta(days=day.weekday())
+
+
+def _insert_statement(dialect_name: str):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(ConflictDataHistory.__table__).on_conflict_do_nothing(
+        index_elements=[ConflictDataHistory.country_key, ConflictDataHistory.admin1_key, ConflictDataHistory.period]
+    )
+
+
+def snapshot_current(db: Session, period: Optional[date] = None) -> int:
+    '''
+    Append every conflict_data row to history as `period` (the current week if None), in the
+    session's transaction (caller commits). Regions already recorded for the period are skipped.
+    Returns the number of rows added
+    '''
+    period = period or period_start(datetime.utcnow().date())
+    rows = select(
+        ConflictData.country_key, ConflictData.admin1_key, literal(period, Date), ConflictData.country,
+        ConflictData.admin1, ConflictData.population, ConflictData.events, ConflictData.risk_score,
+        literal(datetime.utcnow(), DateTime),
+    # SQLite needs a WHERE clause to tell the upsert clause apart from a join constraint
+    ).where(true())
+    result = db.execute(
+        _insert_statement(db.get_bind().dialect.name).from_select([*HISTORY_COLUMNS, 'recorded_at'], rows)
+    )
+    logger.info(f'Recorded {result.rowcount} regions in history for period {period}')
+    return result.rowcount
+
+
+def parse_history_record(raw: object) -> dict:
+    '''
+    Validate a raw record into history column values. Raises ValueError if invalid.
+    `period` may be any day of the period: it is stored as the period's start, as by `snapshot_current`
+    '''
+    values = parse_record(raw)
+    period = raw.get('period')
+    try:
+        values['period'] = period_start(date.fromisoformat(str(period).strip()[:10]))
+    except ValueError:
+        raise ValueError(f'invalid period: {period!r}')
+    return values
+
+
+def ingest_history_batch(db: Session, chunk: list, batch_number: int = 1) -> dict:
+    '''Parse and append one chunk of (line number, raw record) pairs in a single transaction'''
+    started = time.perf_counter()
+    parsed, rejects = [], []
+    for line_num, raw in chunk:
+        try:
+            parsed.append(parse_history_record(raw))
+        except ValueError as e:
+            rejects.append({'line': line_num, 'error': str(e)})
+    inserted = 0
+    try:
+        if parsed:
+            now = datetime.utcnow()
+            result = db.execute(_insert_statement(db.get_bind().dialect.name),
+                                [{**{c: r[c] for c in HISTORY_COLUMNS}, 'recorded_at': now} for r in parsed])
+            inserted = result.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    elapsed = time.perf_counter() - started
+    # Shaped like the conflict_data ingestion progress, so `summarise` applies. Nothing is updated
+    return {
+        'batch': batch_number,
+        'rows': len(chunk),
+        'inserted': inserted,
+        'updated': 0,
+        'unchanged': len(parsed) - inserted,
+        'rejected': len(rejects),
+        'rejects': rejects,
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(len(chunk) / elapsed, 1) if elapsed else None,
+    }
+
+
+def ingest_history_records(records: Iterable[Tuple[int, object]], db: Session,
+                           batch_size: int = HISTORY_BATCH_SIZE) -> Iterator[dict]:
+    '''Append (line number, raw record) pairs to history, one transaction per batch. Yields progress per batch'''
+    records = iter(records)
+    for batch_number, chunk in enumerate(iter(lambda: list(islice(records, batch_size)), []), start=1):
+        yield ingest_history_batch(db, chunk, batch_number)
+
+
+def ingest_history_file(path: str, fmt: Optional[str] = None, batch_size: int = HISTORY_BATCH_SIZE) -> dict:
+    '''Stream a CSV/NDJSON file of past periods into history, logging progress per batch. Returns the summary'''
+    def logged(batches):
+        for batch in batches:
+            logger.info(f"Batch {batch['batch']}: {batch['inserted']} added, {batch['unchanged']} already recorded, "
+                        f"{batch['rejected']} rejected ({batch['rows_per_sec']} rows/sec)")
+            for reject in batch['rejects']:
+                logger.warning(f"Rejected line {reject['line']}: {reject['error']}")
+            yield batch
+
+    with SessionLocal() as db:
+        return summarise(logged(ingest_history_records(read_records(path, fmt), db, batch_size)))
+
+
+def _series(db: Session, columns: list, filters: list, start: Optional[date], end: Optional[date],
+            limit: int, group: bool) -> list:
+    '''
+    Up to `limit` periods within [start, end], latest first, plus the period before them (for deltas)
+    if there is one. The bounds are range conditions on the index, so only the rows returned are read
+    '''
+    history = ConflictDataHistory
+    statement = select(history.period, *columns).where(*filters)
+    if end is not None:
+        statement = statement.where(history.period <= end)
+    if start is not None:
+        # Also read the latest period before `start`, the baseline for the first period's deltas
+        previous = select(func.max(history.period)).where(*filters, history.period < start).scalar_subquery()
+        statement = statement.where(history.period >= func.coalesce(previous, start))
+    if group:
+        statement = statement.group_by(history.period)
+    return db.execute(statement.order_by(history.period.desc()).limit(limit + 1)).all()
+
+
+def _with_deltas(rows: list, fields: Tuple[str, ...], start: Optional[date], limit: int) -> list:
+    '''Items in period order, with each field's change from the previous period (absolute and %)'''
+    rows = list(reversed(rows))
+    items = []
+    for previous, row in zip([None, *rows], rows):
+        item = row._asdict()
+        item['previous_period'] = previous.period if previous is not None else None
+        for field in fields:
+            current, before = item[field], getattr(previous, field, None)
+            change = current - before if current is not None and before is not None else None
+            item[f'{field}_change'] = change
+            item[f'{field}_change_pct'] = change / before * 100 if change is not None and before else None
+        items.append(item)
+    # Drop the baseline period, read only for the deltas
+    if len(items) > limit or (items and start is not None and items[0]['period'] < start):
+        items = items[1:]
+    return items
+
+
+def country_series(db: Session, country_key: str, start: Optional[date] = None, end: Optional[date] = None,
+                   limit: int = 520) -> list:
+    '''Per-period aggregates of a country's regions, with period-over-period changes'''
+    history = ConflictDataHistory
+    rows = _series(db, [
+        func.count().label('regions'),
+        func.sum(history.events).label('events'),
+        func.avg(history.risk_score).label('risk_score_avg'),
+        func.sum(history.population).label('population'),
+    ], [history.country_key == country_key], start, end, limit, group=True)
+    return _with_deltas(rows, ('regions', 'events', 'risk_score_avg', 'population'), start, limit)
+
+
+def region_series(db: Session, country_key: str, admin1_key: str, start: Optional[date] = None,
+                  end: Optional[date] = None, limit: int = 520) -> list:
+    '''A region's history, with period-over-period changes'''
+    history = ConflictDataHistory
+    rows = _series(db, [history.country, history.admin1, history.population, history.events, history.risk_score],
+                   [history.country_key == country_key, history.admin1_key == admin1_key], start, end, limit, group=False)
+    return _with_deltas(rows, ('events', 'risk_score', 'population'), start, limit)
@@ -0,0 +1,270 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Streaming bulk ingestion of conflict data with upsert semantics.
+
+Records are read lazily from CSV or NDJSON, validated, and written in batches with
+`INSERT ... ON CONFLICT (country_key, admin1_key) DO UPDATE`. Existing rows keep their `id`,
+so `user_feedback` rows referencing them survive a reload.
+'''
+from app.data_events import mark_conflict_data_changed
+from app.database import SessionLocal
+from app.models import ConflictData, normalise_key
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import codecs
+import csv
+import json
+import os
+import time
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator, Optional, Tuple
+
+DEFAULT_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '5000'))
+# Only the first few rejected rows are reported back in full
+MAX_REJECTS_REPORTED = 100
+
+# Source column names accepted for each field. `sample_data.csv` uses `score` for the risk score
+FIELD_ALIASES = {
+    'country': ('country',),
+    'admin1': ('admin1',),
+    'population': ('population',),
+    'events': ('events',),
+    'risk_score': ('risk_score', 'score'),
+}
+UPSERT_FIELDS = ('country', 'admin1', 'population', 'events', 'risk_score')
+
+
+def iter_csv_records(lines: Iterable[str]) -> Iterator[Tuple[int, dict]]:
+    '''Yield (line number, row dict) from CSV text lines with a header row'''
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_ndjson_records(lines: Iterable[str]) -> Iterator[Tuple[int, object]]:
+    '''Yield (line number, decoded object) from NDJSON text lines. Undecodable lines yield the raw string'''
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError:
+            yield line_num, line
+
+
+def read_records(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, object]]:
+    '''Stream records from a CSV or NDJSON file. Format is taken from the file extension if not given'''
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        records = iter_ndjson_records(f) if fmt == 'ndjson' else iter_csv_records(f)
+        yield from records
+
+
+def _to_int(value, field: str, required: bool) -> Optional[int]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise ValueError(f'missing {field}')
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid {field}: {value!r}')
+
+
+def parse_record(raw: object) -> dict:
+    '''Validate a raw CSV/NDJSON record into conflict_data column values. Raises ValueError if invalid'''
+    if not isinstance(raw, dict):
+        raise ValueError('record is not an object')
+    values = {}
+    for field, aliases in FIELD_ALIASES.items():
+        values[field] = next((raw[a] for a in aliases if a in raw), None)
+    for field in ('country', 'admin1'):
+        if not isinstance(values[field], str) or not values[field].strip():
+            raise ValueError(f'missing {field}')
+        if len(values[field]) > 100:
+            raise ValueError(f'{field} longer than 100 characters')
+    values['population'] = _to_int(values['population'], 'population', required=False)
+    values['events'] = _to_int(values['events'], 'events', required=True)
+    values['risk_score'] = _to_int(values['risk_score'], 'risk_score', required=True)
+    values['country_key'] = normalise_key(values['country'])
+    values['admin1_key'] = normalise_key(values['admin1'])
+    return values
+
+
+def _upsert_statement(dialect_name: str):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(ConflictData.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=[ConflictData.country_key, ConflictData.admin1_key],
+        set_={
+            **{field: stmt.excluded[field] for field in UPSERT_FIELDS},
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+
+
+def upsert_batch(db: Session, records: list) -> dict:
+    '''
+    Upsert a batch of parsed records in the session's current transaction (caller commits).
+    Existing rows are looked up in one query first so unchanged rows are skipped
+    and inserts can be told apart from updates.
+    '''
+    # Last occurrence of a key within the batch wins
+    by_key = {(r['country_key'], r['admin1_key']): r for r in records}
+    # Separate IN lists rather than a row-value IN, which SQLite cannot serve from the index.
+    # May over-fetch a few rows; they are dropped by the key lookup below
+    existing = {
+        (row.country_key, row.admin1_key): row
+        for row in db.execute(
+            select(ConflictData.country_key, ConflictData.admin1_key, *[getattr(ConflictData, f) for f in UPSERT_FIELDS])
+            .where(ConflictData.country_key.in_({k[0] for k in by_key}))
+            .where(ConflictData.admin1_key.in_({k[1] for k in by_key}))
+        )
+    }
+    inserted = updated = unchanged = 0
+    to_write = []
+    for key, record in by_key.items():
+        current = existing.get(key)
+        if current is None:
+            inserted += 1
+        elif any(getattr(current, f) != record[f] for f in UPSERT_FIELDS):
+            updated += 1
+        else:
+            unchanged += 1
+            continue
+        to_write.append(record)
+
+    if to_write:
+        db.execute(_upsert_statement(db.get_bind().dialect.name), to_write)
+        mark_conflict_data_changed(db, {r['country_key'] for r in to_write})
+    # Earlier duplicates of a key within the batch are superseded, so count as unchanged
+    return {'inserted': inserted, 'updated': updated, 'unchanged': unchanged + len(records) - len(by_key)}
+
+
+def ingest_batch(db: Session, chunk: list, batch_number: int = 1) -> dict:
+    '''Parse and upsert one chunk of (line number, raw record) pairs in a single transaction. Returns its progress dict'''
+    started = time.perf_counter()
+    parsed, rejects = [], []
+    for line_num, raw in chunk:
+        try:
+            parsed.append(parse_record(raw))
+        except ValueError as e:
+            rejects.append({'line': line_num, 'error': str(e)})
+    try:
+        counts = upsert_batch(db, parsed) if parsed else {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    elapsed = time.perf_counter() - started
+    return {
+        'batch': batch_number,
+        'rows': len(chunk),
+        **counts,
+        'rejected': len(rejects),
+        'rejects': rejects,
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(len(chunk) / elapsed, 1) if elapsed else None,
+    }
+
+
+def ingest_records(records: Iterable[Tuple[int, object]], db: Session, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[dict]:
+    '''
+    Parse and upsert (line number, raw record) pairs, committing one transaction per batch.
+    Yields a progress dict per batch, so callers can report or stream it.
+    '''
+    records = iter(records)
+    for batch_number, chunk in enumerate(iter(lambda: list(islice(records, batch_size)), []), start=1):
+        yield ingest_batch(db, chunk, batch_number)
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    '''
+    Incrementally decode a UTF-8 byte stream into text lines (line endings kept).
+    Raises UnicodeDecodeError on invalid input.
+    '''
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+async def aiter_records(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, object]]:
+    '''Async equivalent of `iter_csv_records`/`iter_ndjson_records` over a stream of text lines'''
+    line_num = 0
+    if fmt == 'ndjson':
+        async for line in lines:
+            line_num += 1
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError:
+                yield line_num, line
+        return
+
+    header, record, start = None, '', 0
+    async for line in lines:
+        line_num += 1
+        if not record:
+            start = line_num
+        record += line
+        # An odd number of quotes means a quoted field continues onto the next line
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ''
+        if not values:
+            continue
+        if header is None:
+            header = values
+        else:
+            yield start, dict(zip(header, values))
+    if record:
+        yield start, record
+
+
+def summarise(batches: Iterable[dict]) -> dict:
+    '''Consume per-batch progress into a totals summary'''
+    summary = {'batches': 0, 'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0, 'rejects': []}
+    started = time.perf_counter()
+    for batch in batches:
+        summary['batches'] += 1
+        for key in ('rows', 'inserted', 'updated', 'unchanged', 'rejected'):
+            summary[key] += batch[key]
+        summary['rejects'].extend(batch['rejects'][:MAX_REJECTS_REPORTED - len(summary['rejects'])])
+    elapsed = time.perf_counter() - started
+    summary['seconds'] = round(elapsed, 4)
+    summary['rows_per_sec'] = round(summary['rows'] / elapsed, 1) if elapsed else None
+    return summary
+
+
+def ingest_file(path: str, fmt: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    '''Stream a CSV/NDJSON file into conflict_data, logging progress per batch. Returns the summary'''
+    db = SessionLocal()
+    def logged(batches):
+        for batch in batches:
+            logger.info(
+                f"Batch {batch['batch']}: {batch['inserted']} inserted, {batch['updated']} updated, "
+                f"{batch['unchanged']} unchanged, {batch['rejected']} rejected ({batch['rows_per_sec']} rows/sec)"
+            )
+            for reject in batch['rejects']:
+                logger.warning(f"Rejected line {reject['line']}: {reject['error']}")
+            yield batch
+    try:
+        return summarise(logged(ingest_records(read_records(path, fmt), db, batch_size)))
+    finally:
+        db.close()
@@ -0,0 +1,29 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from fastapi import HTTPException
+
+import base64
+import json
+
+
+def encode_cursor(*values) -> str:
+    '''Encode the sort key of the last row on a page into an opaque, URL-safe cursor string'''
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    '''
+    Decode a cursor created by `encode_cursor`.
+    Raises 400 if the cursor is malformed or does not hold `length` values.
+    '''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != length:
+        logger.warning(f'Invalid pagination cursor {cursor}')
+        raise HTTPException(status_code=400, detail='invalid cursor')
+    return values
@@ -0,0 +1,51 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Fast JSON responses for the list endpoints.
+
+Routes return `FastJSONResponse` directly, which skips FastAPI's `jsonable_encoder` pass over the
+payload and encodes straight to bytes with orjson. Only use it for payloads that are already plain
+JSON types (dicts, lists, str, int, float, None).
+
+The list endpoints return their rows as a `ConflictDataList`, turned into a response by `render`:
+building the items and encoding them is CPU-bound, so the async routes run it on the threadpool
+instead of the event loop.
+'''
+from fastapi.responses import Response
+import orjson
+
+from typing import Any, Iterable, NamedTuple, Sequence, Union
+
+# Fields of a conflict data item, in the order the list queries select them
+ITEM_FIELDS = ('id', 'country', 'admin1', 'population', 'events', 'risk_score')
+
+
+class FastJSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+def conflict_data_items(rows: Iterable[Sequence]) -> list:
+    '''API items from rows whose first columns are `ITEM_FIELDS` (column tuples or snapshot rows)'''
+    return [dict(zip(ITEM_FIELDS, row)) for row in rows]
+
+
+class ConflictDataList(NamedTuple):
+    '''A list response before its items are built: the payload's other fields, the rows and their feedback counts'''
+    payload: dict
+    rows: Sequence[Sequence]
+    feedback_counts: dict
+    headers: dict
+
+
+def render(result: Union[ConflictDataList, Response]) -> Response:
+    '''The response for a `ConflictDataList`, with `items` last. Other responses (e.g. 304) are returned as they are'''
+    if not isinstance(result, ConflictDataList):
+        return result
+    items = conflict_data_items(result.rows)
+    for item in items:
+        item['feedback_count'] = result.feedback_counts.get(item['id'], 0)
+    return FastJSONResponse({**result.payload, 'items': items}, headers=result.headers)
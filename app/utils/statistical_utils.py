@@ -1,20 +1,170 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from app.models import ConflictData
+from app.models import ConflictData, CountrySummary
 
-from sqlalchemy import func
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Connection
 from sqlalchemy.orm import Session
+import numpy as np
 
-# Add this after your compute_risk_score_average function
-def compute_cache_risk_score_avg(country: str, cache: dict, db: Session):
-    '''Background task: compute average and store in cache dict.'''
-    try:
-        result = db.query(func.avg(ConflictData.risk_score))\
-            .filter(func.lower(ConflictData.country) == country.lower())\
-            .scalar()
-        
-        cache[country] = result
-        logger.info(f'Cached risk score for {country}: {result}')
-    except Exception as e:
-        logger.error(f"Error computing cached risk score for '{country}': {e}")
\ No newline at end of file
+from datetime import datetime
+from typing import Iterable, Optional, Sequence, Union
+
+DEFAULT_PERCENTILES = (25, 75, 90)
+
+
+def refresh_country_summaries(db: Union[Session, Connection], country_keys: Optional[set] = None) -> int:
+    '''
+    Recompute country_summary rows for the given country keys (all countries if None)
+    with one grouped query over conflict_data, in the session's (or connection's) current transaction.
+    Countries with no rows left lose their summary row. Returns the number of summaries written.
+    '''
+    aggregates = select(
+        ConflictData.country_key,
+        func.min(ConflictData.country).label('country'),
+        func.count(ConflictData.id).label('region_count'),
+        func.sum(ConflictData.risk_score).label('risk_score_sum'),
+        func.avg(ConflictData.risk_score).label('risk_score_avg'),
+        func.sum(ConflictData.events).label('events_sum'),
+        func.sum(ConflictData.population).label('population_sum'),
+        func.count(ConflictData.population).label('population_region_count'),
+        func.sum(ConflictData.risk_score * ConflictData.population).label('risk_weighted_population_sum'),
+        func.sum(ConflictData.risk_score * ConflictData.events).label('risk_weighted_events_sum'),
+    ).group_by(ConflictData.country_key)
+    clear = delete(CountrySummary)
+    if country_keys is not None:
+        if not country_keys:
+            return 0
+        aggregates = aggregates.where(ConflictData.country_key.in_(country_keys))
+        clear = clear.where(CountrySummary.country_key.in_(country_keys))
+
+    now = datetime.utcnow()
+    rows = [{**row._asdict(), 'updated_at': now} for row in db.execute(aggregates)]
+    db.execute(clear)
+    if rows:
+        db.execute(insert(CountrySummary), rows)
+    logger.debug(f'Refreshed {len(rows)} country summaries for {country_keys or "all countries"}')
+    return len(rows)
+
+
+def summary_to_dict(summary: CountrySummary) -> dict:
+    '''API representation of a country summary, including derived averages'''
+    return {
+        'country': summary.country,
+        'regions': summary.region_count,
+        'average_risk_score': summary.risk_score_avg,
+        'total_events': summary.events_sum,
+        'total_population': summary.population_sum,
+        'regions_with_population': summary.population_region_count,
+        'population_weighted_risk_score': (
+            summary.risk_weighted_population_sum / summary.population_sum if summary.population_sum else None
+        ),
+        'events_weighted_risk_score': (
+            summary.risk_weighted_events_sum / summary.events_sum if summary.events_sum else None
+        ),
+    }
+
+
+def _group_percentile(sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    '''The q-th percentile of each group of `sorted_values` (sorted within groups), interpolated linearly like np.percentile'''
+    position = starts + (counts - 1) * q / 100
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def _ranks(values: np.ndarray) -> list:
+    '''Rank of each value, highest first; ties share the best rank. NaN gets None'''
+    valid = ~np.isnan(values)
+    ordered = np.sort(values[valid])
+    ranks = len(ordered) - np.searchsorted(ordered, values, side='right') + 1
+    return [int(rank) if ok else None for rank, ok in zip(ranks.tolist(), valid.tolist())]
+
+
+def _values(array: np.ndarray) -> list:
+    return [None if value != value else value for value in array.tolist()]
+
+
+def country_statistics(db: Session, country_keys: Optional[Iterable[str]] = None,
+                       percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> list:
+    '''
+    Risk score distribution and weighted metrics per country, for the given country keys (all if None),
+    ordered by country key. One query reads the rows in `country_key` index order; everything else is
+    computed for all countries at once with NumPy over the group boundaries:
+    - mean, standard deviation, min, median, max and `percentiles` of the region risk scores
+    - population-weighted risk score and events per 100k people, over the regions with a population
+    - ranks among the returned countries (1 = highest) by mean and weighted risk score and events per 100k
+    '''
+    statement = select(ConflictData.country_key, ConflictData.country, ConflictData.risk_score,
+                       ConflictData.population, ConflictData.events)\
+        .order_by(ConflictData.country_key)
+    if country_keys is not None:
+        statement = statement.where(ConflictData.country_key.in_(set(country_keys)))
+    # Through the connection, as the session's ORM result processing would double the fetch time
+    rows = db.connection().execute(statement).all()
+    if not rows:
+        return []
+    keys, names, risk_scores, populations, events = zip(*rows)
+    keys = np.array(keys, dtype=object)
+    risk_scores = np.array(risk_scores, dtype=np.float64)
+    populations = np.array(populations, dtype=np.float64)  # None becomes NaN
+    events = np.array(events, dtype=np.float64)
+
+    # Group boundaries: rows are ordered by country key
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    counts = np.diff(np.append(starts, len(keys)))
+    groups = np.repeat(np.arange(len(starts)), counts)
+    sorted_risk = risk_scores[np.lexsort((risk_scores, groups))]
+
+    mean = np.add.reduceat(risk_scores, starts) / counts
+    variance = np.add.reduceat(risk_scores ** 2, starts) / counts - mean ** 2
+    std = np.sqrt(np.clip(variance, 0, None))
+    median = _group_percentile(sorted_risk, starts, counts, 50)
+    quantiles = {q: _values(_group_percentile(sorted_risk, starts, counts, q)) for q in percentiles}
+
+    has_population = ~np.isnan(populations)
+    known_population = np.where(has_population, populations, 0)
+    population_sum = np.add.reduceat(known_population, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weighted_risk = np.where(population_sum > 0,
+                                 np.add.reduceat(risk_scores * known_population, starts) / population_sum, np.nan)
+        events_per_100k = np.where(population_sum > 0,
+                                   np.add.reduceat(np.where(has_population, events, 0), starts) / population_sum * 1e5, np.nan)
+
+    columns = {
+        'regions': counts.tolist(),
+        'regions_with_population': np.add.reduceat(has_population.astype(np.int64), starts).tolist(),
+        'total_events': np.add.reduceat(events, starts).astype(np.int64).tolist(),
+        'total_population': population_sum.astype(np.int64).tolist(),
+        'mean': mean.tolist(), 'std': std.tolist(), 'median': median.tolist(),
+        'min': sorted_risk[starts].tolist(), 'max': sorted_risk[starts + counts - 1].tolist(),
+        'population_weighted_risk_score': _values(weighted_risk),
+        'events_per_100k': _values(events_per_100k),
+    }
+    ranks = {
+        'average_risk_score': _ranks(mean),
+        'population_weighted_risk_score': _ranks(weighted_risk),
+        'events_per_100k': _ranks(events_per_100k),
+    }
+    return [
+        {
+            'country': names[start],
+            'regions': columns['regions'][i],
+            'regions_with_population': columns['regions_with_population'][i],
+            'total_events': columns['total_events'][i],
+            'total_population': columns['total_population'][i],
+            'risk_score': {
+                'mean': columns['mean'][i],
+                'std': columns['std'][i],
+                'min': columns['min'][i],
+                'median': columns['median'][i],
+                'max': columns['max'][i],
+                'percentiles': {f'p{q:g}': values[i] for q, values in quantiles.items()},
+            },
+            'population_weighted_risk_score': columns['population_weighted_risk_score'][i],
+            'events_per_100k': columns['events_per_100k'][i],
+            'ranks': {metric: values[i] for metric, values in ranks.items()},
+        }
+        for i, start in enumerate(starts.tolist())
+    ]
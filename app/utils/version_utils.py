@@ -0,0 +1,122 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Data versions for conflict_data and HTTP conditional request helpers.
+
+`data_versions` holds a counter for the whole table (scope `TABLE_SCOPE`) and one per country key.
+`bump_data_versions` runs as a write hook (see `app.data_events`), so versions change in the same
+transaction as the data. Responses get an ETag derived from the versions of the scopes they were
+built from, and a request whose If-None-Match still matches gets a 304 without the row queries.
+
+List responses also carry feedback counts, versioned by separate `feedback:<scope>` counters that
+feedback writes bump (`bump_feedback_versions`). Those change the ETags of the lists, but not the
+conflict_data versions that the snapshot, aggregate cache and search index are built from.
+'''
+from sqlalchemy import insert, literal, select, update
+from sqlalchemy.orm import Session
+
+from app.models import ConflictData, DataVersion
+
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import hashlib
+import os
+from typing import Iterable, Optional
+
+TABLE_SCOPE = ''
+FEEDBACK_SCOPE_PREFIX = 'feedback:'
+# Version of a feedback scope never written to
+NO_FEEDBACK_VERSION = (0, None)
+CACHE_MAX_AGE_SECONDS = int(os.getenv('CACHE_MAX_AGE_SECONDS', '0'))
+
+
+def _upsert_statement(dialect_name: str):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(DataVersion.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=[DataVersion.scope],
+        set_={'version': DataVersion.version + 1, 'updated_at': stmt.excluded.updated_at}
+    )
+
+
+def bump_data_versions(db: Session, country_keys: Optional[set] = None) -> None:
+    '''Increment the table version and those of the given country keys (all countries if None)'''
+    now = datetime.utcnow()
+    table = DataVersion.__table__
+    if country_keys is None:
+        db.execute(update(table)
+                   .where(table.c.scope != TABLE_SCOPE, ~table.c.scope.startswith(FEEDBACK_SCOPE_PREFIX))
+                   .values(version=table.c.version + 1, updated_at=now))
+        # Countries new to conflict_data start at version 1
+        db.execute(insert(table).from_select(
+            ['scope', 'version', 'updated_at'],
+            select(ConflictData.country_key, literal(1), literal(now))
+            .where(ConflictData.country_key.not_in(select(table.c.scope)))
+            .distinct()
+        ))
+        country_keys = set()
+    # Sorted, so concurrent writers lock rows in the same order
+    scopes = [TABLE_SCOPE, *sorted(country_keys)]
+    db.execute(_upsert_statement(db.get_bind().dialect.name),
+               [{'scope': scope, 'version': 1, 'updated_at': now} for scope in scopes])
+
+
+def feedback_scopes(scopes: Iterable[str]) -> list:
+    '''Feedback version scopes of conflict_data scopes (TABLE_SCOPE: feedback on any region)'''
+    return [FEEDBACK_SCOPE_PREFIX + scope for scope in scopes]
+
+
+def bump_feedback_versions(db: Session, country_keys: set) -> None:
+    '''Increment the feedback versions of the table and of the given country keys'''
+    now = datetime.utcnow()
+    scopes = feedback_scopes([TABLE_SCOPE, *sorted(country_keys)])
+    db.execute(_upsert_statement(db.get_bind().dialect.name),
+               [{'scope': scope, 'version': 1, 'updated_at': now} for scope in scopes])
+
+
+def load_data_versions(db: Session, scopes: Optional[Iterable[str]] = None) -> dict:
+    '''
+    {scope: (version, updated_at)} for the given scopes (all conflict_data scopes, without the
+    feedback ones, if None). Scopes never written are absent
+    '''
+    stmt = select(DataVersion.scope, DataVersion.version, DataVersion.updated_at)
+    if scopes is not None:
+        stmt = stmt.where(DataVersion.scope.in_(set(scopes)))
+    else:
+        stmt = stmt.where(~DataVersion.scope.startswith(FEEDBACK_SCOPE_PREFIX))
+    return {row.scope: (row.version, row.updated_at) for row in db.execute(stmt)}
+
+
+def _http_date(value: datetime) -> str:
+    # Stored as naive UTC on SQLite
+    value = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return format_datetime(value, usegmt=True)
+
+
+def cache_headers(versions: dict, scopes: Iterable[str]) -> dict:
+    '''
+    ETag, Last-Modified and Cache-Control headers for a response built from `scopes`, given their
+    versions. Empty if any scope has no version, e.g. a country filter naming an unknown country
+    '''
+    scopes = sorted(set(scopes))
+    if not scopes or any(scope not in versions for scope in scopes):
+        return {}
+    tag = ','.join(f'{scope}:{versions[scope][0]}' for scope in scopes)
+    return {
+        'ETag': f'"{hashlib.blake2b(tag.encode(), digest_size=8).hexdigest()}"',
+        'Last-Modified': _http_date(max(versions[scope][1] for scope in scopes if versions[scope][1] is not None)),
+        'Cache-Control': f'public, max-age={CACHE_MAX_AGE_SECONDS}, must-revalidate',
+    }
+
+
+def etag_matches(if_none_match: Optional[str], headers: dict) -> bool:
+    '''Whether an If-None-Match header matches the ETag in `headers` (weak comparison)'''
+    etag = headers.get('ETag')
+    if not if_none_match or not etag:
+        return False
+    candidates = {candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')}
+    return '*' in candidates or etag in candidates
@@ -0,0 +1,159 @@
+import logging
+logger = logging.getLogger(__name__)
+
+'''
+Worker warm-up, run by the app's lifespan before it takes traffic.
+
+Without it the first requests to a new worker pay for work done once per process: SQLAlchemy
+mapper configuration, opening pooled connections (and their SQLite PRAGMAs), compiling each
+statement into the engine's compiled cache, FastAPI building the middleware stack and each
+route's dependency resolution on first match, loading passlib's bcrypt backend and python-jose's
+signing backend, and empty aggregate caches. During a rolling restart that lands on whichever
+requests reach the new worker first. Steps:
+- `mappers`: `configure_mappers()`
+- `pool`: check out WARMUP_CONNECTIONS connections together, so the pool holds them open (both
+  engines in async mode)
+- `requests`: one in-process GET (no network) to each public read route for the first region,
+  through the whole middleware stack, so routing, validation, queries and serialisation are all
+  warm. With WARMUP_AGGREGATES this includes the all-countries `/countries/statistics`, which puts
+  it in the aggregate cache. They go through rate limiting (as client `warmup`) and are counted
+  in the metrics like any other request
+- `auth`: load the bcrypt backend and sign/verify a token
+
+Each step is timed and logged. A failing step is logged and skipped: requests then pay for it as
+they would without warm-up, but the worker still starts.
+'''
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import Session, configure_mappers
+
+from app.auth import ALGORITHM, SECRET_KEY, create_token, jwt, pwd
+from app.database import ASYNC_DB, SessionLocal, async_engine, engine
+from app.models import ConflictData
+from app.utils.pagination_utils import encode_cursor
+
+from collections import Counter
+from contextlib import AsyncExitStack, ExitStack
+from datetime import date
+import asyncio
+import os
+import time
+from typing import List
+from urllib.parse import quote, urlencode
+
+WARMUP = os.getenv('WARMUP', 'True') == 'True'
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', '4'))
+WARMUP_AGGREGATES = os.getenv('WARMUP_AGGREGATES', 'True') == 'True'
+
+
+def warm_pool(connections: int = WARMUP_CONNECTIONS) -> None:
+    '''Open `connections` pooled connections at once and return them to the pool'''
+    with ExitStack() as stack:
+        for _ in range(connections):
+            stack.enter_context(engine.connect())
+
+
+async def warm_async_pool(connections: int = WARMUP_CONNECTIONS) -> None:
+    '''`warm_pool` for the async engine'''
+    async with AsyncExitStack() as stack:
+        for _ in range(connections):
+            await stack.enter_async_context(async_engine.connect())
+
+
+def warmup_paths(app, db: Session, aggregates: bool = WARMUP_AGGREGATES) -> List[str]:
+    '''Path and query string of each request to warm up with, for the first region. Empty if there is no data'''
+    region = db.execute(
+        select(ConflictData.country, ConflictData.admin1, ConflictData.country_key, ConflictData.admin1_key)
+        .order_by(ConflictData.country_key, ConflictData.admin1_key)
+        .limit(1)
+    ).first()
+    if region is None:
+        return []
+    country, admin1, country_key, admin1_key = region
+    paths = [
+        app.url_path_for('get_conflict_data'),
+        app.url_path_for('get_conflict_data') + '?' + urlencode(
+            {'country': country, 'cursor': encode_cursor(country_key, admin1_key, 0)}),
+        app.url_path_for('get_conflict_data_per_country', country=country),
+        app.url_path_for('get_risk_score_average', country=country),
+        app.url_path_for('list_countries'),
+        app.url_path_for('get_country', country=country),
+        app.url_path_for('get_country_history', country=country),
+        app.url_path_for('get_region_history', country=country, admin1=admin1) + '?' + urlencode(
+            {'start': date.min.isoformat()}),
+        app.url_path_for('search_regions') + '?' + urlencode({'q': admin1[:3]}),
+    ]
+    if aggregates:
+        paths.append(app.url_path_for('get_country_statistics'))
+    return paths
+
+
+async def request(app, path: str) -> int:
+    '''GET `path` (with any query string) from the app in-process, discarding the body. Returns the status code'''
+    path, _, query_string = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': quote(path).encode(), 'root_path': '', 'query_string': query_string.encode(),
+        'headers': [(b'host', b'warmup')], 'client': ('warmup', 0), 'server': ('warmup', 80), 'state': {},
+    }
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+async def warm_requests(app) -> None:
+    '''Request each of `warmup_paths` once, in turn'''
+    with SessionLocal() as db:
+        paths = await run_in_threadpool(warmup_paths, app, db)
+    if not paths:
+        logger.info('No conflict data, skipping warm-up requests')
+        return
+    statuses = Counter([await request(app, path) for path in paths])
+    # None: the app never started a response
+    if any(status is None or status >= 500 for status in statuses):
+        logger.warning(f'Warm-up requests failed: {dict(statuses)}')
+
+
+def warm_auth() -> None:
+    '''Load the bcrypt backend (passlib runs a self-test on first use) and the token signing backend'''
+    pwd.handler().get_backend()
+    jwt.decode(create_token(0, expires_minutes=1), SECRET_KEY, algorithms=[ALGORITHM])
+
+
+async def warm_up(app) -> dict:
+    '''Run the warm-up steps against `app`. Returns {step: milliseconds taken, or None if it failed}'''
+    steps = [
+        ('mappers', lambda: run_in_threadpool(configure_mappers)),
+        ('pool', lambda: run_in_threadpool(warm_pool)),
+    ]
+    if ASYNC_DB:
+        steps.append(('async_pool', warm_async_pool))
+    steps += [
+        ('requests', lambda: warm_requests(app)),
+        ('auth', lambda: run_in_threadpool(warm_auth)),
+    ]
+
+    timings = {}
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            await step()
+            timings[name] = round((time.perf_counter() - step_started) * 1000, 1)
+        except Exception:
+            # Warm-up is optional: whatever fails, the worker still starts
+            logger.exception(f'Warm-up step {name} failed, requests will pay for it')
+            timings[name] = None
+    logger.info(f'Warmed up in {(time.perf_counter() - started) * 1000:.0f} ms: '
+                + ', '.join(f'{name}={ms}ms' for name, ms in timings.items()),
+                extra={f'warmup_{name}_ms': ms for name, ms in timings.items()})
+    return timings
@@ -0,0 +1,100 @@
+'''
+Sync vs async database layer throughput benchmark.
+
+Runs the app in a child process per mode (DATABASE_URL with the sync `sqlite` driver, then with
+`sqlite+aiosqlite`) and drives the read endpoints in-process over ASGI with `--concurrency` clients.
+Prints requests/sec and p50/p99 latency per mode as JSON.
+Needs a loaded database (python -m app.init_db && python -m scripts.load_test_data).
+
+Run with: python -m scripts.bench_async_vs_sync --seconds 5 --concurrency 32
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+PATHS = [
+    '/v1/conflictdata?page_size=20',
+    '/v1/conflictdata?page_size=100&country=India&country=China',
+    '/v1/conflictdata/South%20Africa',
+    '/v1/conflictdata/Kenya/riskscore',
+]
+MODES = {
+    'sync': 'sqlite:///./data.db',
+    'async': 'sqlite+aiosqlite:///./data.db',
+}
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0
+
+
+async def client_loop(client, paths, stop: float, latencies: list, errors: list):
+    while time.perf_counter() < stop:
+        started = time.perf_counter()
+        response = await client.get(next(paths))
+        latencies.append(time.perf_counter() - started)
+        if response.status_code >= 500:
+            errors.append(response.status_code)
+
+
+async def child(args) -> dict:
+    import httpx
+    from app.main import app
+
+    # Count server errors (e.g. connection pool timeouts) rather than aborting the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        for path in PATHS:
+            await client.get(path)  # warm up
+        paths = itertools.cycle(PATHS)
+        latencies, errors = [], []
+        started = time.perf_counter()
+        stop = started + args.seconds
+        await asyncio.gather(*[client_loop(client, paths, stop, latencies, errors) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.disable(logging.WARNING)
+        # The same reads repeat concurrently: measure them without rate limits or coalescing, unless set
+        os.environ.setdefault('RATE_LIMIT', 'False')
+        os.environ.setdefault('REQUEST_COALESCING', 'False')
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    results = {'concurrency': args.concurrency}
+    for mode, url in MODES.items():
+        output = subprocess.run(
+            [sys.executable, '-m', 'scripts.bench_async_vs_sync', '--child',
+             '--seconds', str(args.seconds), '--concurrency', str(args.concurrency)],
+            env={**os.environ, 'DATABASE_URL': url}, check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
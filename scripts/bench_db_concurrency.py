@@ -0,0 +1,158 @@
+'''
+Database concurrency stress benchmark: feedback writes mixed with list reads.
+
+For each engine profile (`DB_PROFILE=minimal`, i.e. SQLAlchemy/SQLite defaults, then `production`)
+a child process copies data.db to a temporary file, points DATABASE_URL at the copy and drives the
+app in-process over ASGI with `--writers` clients posting user feedback and `--readers` clients
+listing conflict data. Prints per-operation latency percentiles and error counts as JSON; SQLite
+lock errors ('database is locked') are counted separately from other failures.
+Needs a loaded database (python -m app.init_db && python -m scripts.load_test_data).
+
+Run with: python -m scripts.bench_db_concurrency --seconds 5 --readers 16 --writers 8
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+READ_PATHS = [
+    '/v1/conflictdata?page_size=20',
+    '/v1/conflictdata?page_size=100&country=India&country=China',
+]
+LOGIN = {'email': 'user1@test.com', 'password': 'password123'}
+FEEDBACK = {'feedback_text': 'Benchmark feedback on this region\'s conflict data.'}
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0
+
+
+def summarise(latencies: list, statuses: dict, elapsed: float) -> dict:
+    return {
+        'requests': len(latencies),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0.0) * 1000, 2),
+        'status_counts': statuses,
+    }
+
+
+async def client_loop(send, stop: float, latencies: list, statuses: dict):
+    while time.perf_counter() < stop:
+        started = time.perf_counter()
+        response = await send()
+        latencies.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+def count_errors(engine) -> dict:
+    '''Attach a listener counting DBAPI errors on `engine`, split into lock errors and others'''
+    from sqlalchemy import event
+
+    counts = {'lock_errors': 0, 'other_errors': 0}
+
+    @event.listens_for(engine, 'handle_error')
+    def _count(context):
+        locked = 'database is locked' in str(context.original_exception)
+        counts['lock_errors' if locked else 'other_errors'] += 1
+
+    return counts
+
+
+async def child(args) -> dict:
+    import httpx
+    from app.database import DB_PROFILE, engine, engine_options, sqlite_pragmas
+    from app.main import app
+
+    errors = count_errors(engine)
+    # Count server errors rather than aborting the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        token = (await client.post('/v1/auth/login', json=LOGIN)).json()['access_token']
+        headers = {'Authorization': f'Bearer {token}'}
+        regions = itertools.cycle(args.regions)
+        paths = itertools.cycle(READ_PATHS)
+
+        def write():
+            country, admin1 = next(regions)
+            return client.post(f'/v1/conflictdata/{admin1}/userfeedback', params={'country': country},
+                               json=FEEDBACK, headers=headers)
+
+        def read():
+            return client.get(next(paths))
+
+        for path in READ_PATHS:
+            await client.get(path)  # warm up
+        read_latencies, read_statuses, write_latencies, write_statuses = [], {}, [], {}
+        started = time.perf_counter()
+        stop = started + args.seconds
+        await asyncio.gather(
+            *[client_loop(read, stop, read_latencies, read_statuses) for _ in range(args.readers)],
+            *[client_loop(write, stop, write_latencies, write_statuses) for _ in range(args.writers)],
+        )
+        elapsed = time.perf_counter() - started
+
+    return {
+        'profile': DB_PROFILE,
+        'engine_options': engine_options(),
+        'pragmas': sqlite_pragmas(),
+        'reads': summarise(read_latencies, read_statuses, elapsed),
+        'writes': summarise(write_latencies, write_statuses, elapsed),
+        **errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--readers', type=int, default=16, help='Concurrent read clients')
+    parser.add_argument('--writers', type=int, default=8, help='Concurrent feedback-writing clients')
+    parser.add_argument('--database', default='data.db', help='SQLite file to copy for each run')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.disable(logging.WARNING)
+        # The same reads repeat concurrently: measure them without rate limits or coalescing, unless set
+        os.environ.setdefault('RATE_LIMIT', 'False')
+        os.environ.setdefault('REQUEST_COALESCING', 'False')
+        args.regions = json.loads(os.environ['BENCH_REGIONS'])
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    with sqlite3.connect(args.database) as source:
+        regions = source.execute('SELECT country, admin1 FROM conflict_data ORDER BY id LIMIT 200').fetchall()
+
+    results = {'readers': args.readers, 'writers': args.writers}
+    for profile in ('minimal', 'production'):
+        with tempfile.TemporaryDirectory() as directory:
+            # A fresh copy per run, so feedback rows and journal mode from one run don't leak into the next
+            copy = os.path.join(directory, 'bench.db')
+            with sqlite3.connect(args.database) as source, sqlite3.connect(copy) as target:
+                source.backup(target)
+                target.execute('PRAGMA journal_mode=DELETE')
+            env = {**os.environ, 'DATABASE_URL': f'sqlite:///{copy}', 'DB_PROFILE': profile,
+                   'BENCH_REGIONS': json.dumps(regions)}
+            output = subprocess.run(
+                [sys.executable, '-m', 'scripts.bench_db_concurrency', '--child', '--seconds', str(args.seconds),
+                 '--readers', str(args.readers), '--writers', str(args.writers)],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout
+        results[profile] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
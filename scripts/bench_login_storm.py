@@ -0,0 +1,110 @@
+'''
+Login storm benchmark: read-endpoint latency with and without concurrent bcrypt logins.
+
+For each hashing mode (the shared FastAPI threadpool, i.e. `PASSWORD_HASH_WORKERS=0`, and the
+dedicated bounded pool) a child process drives the app in-process over ASGI: first reads alone,
+then reads alongside a storm of logins. Prints read p50/p99 per phase and login/429 counts as JSON.
+Needs a loaded database (python -m app.init_db && python -m scripts.load_test_data).
+
+Run with: python -m scripts.bench_login_storm --seconds 5 --readers 8 --logins 64
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+READ_PATH = '/v1/conflictdata?page_size=20'
+LOGIN = {'email': 'user1@test.com', 'password': 'password123'}
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0
+
+
+async def reader(client, stop: float, latencies: list):
+    while time.perf_counter() < stop:
+        started = time.perf_counter()
+        await client.get(READ_PATH)
+        latencies.append(time.perf_counter() - started)
+
+
+async def login_loop(client, stop: float, counts: dict):
+    while time.perf_counter() < stop:
+        response = await client.post('/v1/auth/login', json=LOGIN)
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        if response.status_code == 429:
+            await asyncio.sleep(0.05)
+
+
+async def run_phase(client, seconds: float, readers: int, logins: int) -> dict:
+    stop = time.perf_counter() + seconds
+    latencies, counts = [], {}
+    await asyncio.gather(
+        *[reader(client, stop, latencies) for _ in range(readers)],
+        *[login_loop(client, stop, counts) for _ in range(logins)],
+    )
+    return {
+        'reads': len(latencies),
+        'read_p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'read_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'login_status_counts': counts,
+    }
+
+
+async def child(args) -> dict:
+    import httpx
+    from app.auth import hash_pool
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        await client.get(READ_PATH)  # warm up
+        result = {
+            'hash_workers': hash_pool.workers,
+            'reads_only': await run_phase(client, args.seconds, args.readers, 0),
+            'login_storm': await run_phase(client, args.seconds, args.readers, args.logins),
+            'hash_metrics': hash_pool.metrics(),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5, help='Duration of each phase')
+    parser.add_argument('--readers', type=int, default=8, help='Concurrent read clients')
+    parser.add_argument('--logins', type=int, default=64, help='Concurrent login clients during the storm')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.disable(logging.WARNING)
+        # The same reads repeat concurrently: measure them without rate limits or coalescing, unless set
+        os.environ.setdefault('RATE_LIMIT', 'False')
+        os.environ.setdefault('REQUEST_COALESCING', 'False')
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    results = {}
+    for mode, workers in (('shared_threadpool', '0'), ('bounded_pool', os.getenv('PASSWORD_HASH_WORKERS', ''))):
+        env = dict(os.environ)
+        env.pop('PASSWORD_HASH_WORKERS', None)
+        if workers:
+            env['PASSWORD_HASH_WORKERS'] = workers
+        output = subprocess.run(
+            [sys.executable, '-m', 'scripts.bench_login_storm', '--child', '--seconds', str(args.seconds),
+             '--readers', str(args.readers), '--logins', str(args.logins)],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+'''
+Worker cold start benchmark, with and without startup warm-up (WARMUP).
+
+Starts a fresh child process per run and mode, and measures in it:
+- `import_ms`: importing `app.main` (libraries, models, routes)
+- `startup_ms`: the lifespan startup (region index, snapshot if enabled, warm-up)
+- `first_response_ms`: from the script starting (after interpreter start-up) to the first
+  response, i.e. when a new worker could first answer a request
+- per path, the latency of its first request and the median of the next `--repeat`
+- `burst_p50_ms`/`burst_p99_ms`/`burst_max_ms`: `--burst` concurrent requests sent as soon as the
+  worker is up, as it would get on joining a loaded pool during a rolling restart, then the same
+  burst again once warm (`warm_burst_*`)
+Requests go in-process over ASGI (no server, no network). Each mode runs `--runs` times and the
+median of each figure is printed as JSON.
+Needs a loaded database (python -m app.init_db && python -m scripts.load_test_data).
+
+Run with: python -m scripts.bench_startup --runs 3 --burst 32
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+import time
+PROCESS_STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PATHS = [
+    '/v1/conflictdata?page_size=20',
+    '/v1/conflictdata?page_size=100&country=India&country=China',
+    '/v1/conflictdata/South%20Africa',
+    '/v1/conflictdata/Kenya/riskscore',
+    '/v1/countries',
+    '/v1/countries/statistics',
+    '/v1/regions/search?q=nai',
+    '/v1/history/Kenya',
+]
+MODES = {'warmup': 'True', 'no_warmup': 'False'}
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+async def timed_get(client, path: str) -> float:
+    started = time.perf_counter()
+    await client.get(path)
+    return time.perf_counter() - started
+
+
+async def burst(client, size: int) -> dict:
+    paths = itertools.cycle(PATHS)
+    latencies = await asyncio.gather(*[timed_get(client, next(paths)) for _ in range(size)])
+    return {'p50_ms': ms(percentile(latencies, 0.5)), 'p99_ms': ms(percentile(latencies, 0.99)),
+            'max_ms': ms(max(latencies))}
+
+
+async def child(args) -> dict:
+    import_started = time.perf_counter()
+    import httpx
+    from app.main import app
+    imported = time.perf_counter()
+    result = {'import_ms': ms(imported - import_started)}
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        result['startup_ms'] = ms(time.perf_counter() - imported)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+            if args.burst:
+                # The burst is the first traffic the worker sees, then the same again once warm
+                result.update({f'burst_{name}': value for name, value in (await burst(client, args.burst)).items()})
+                result.update({f'warm_burst_{name}': value for name, value in (await burst(client, args.burst)).items()})
+                return result
+            paths = {}
+            for path in PATHS:
+                first = await timed_get(client, path)
+                result.setdefault('first_response_ms', ms(time.perf_counter() - PROCESS_STARTED))
+                warm = [await timed_get(client, path) for _ in range(args.repeat)]
+                paths[path] = {'first_ms': ms(first), 'warm_p50_ms': ms(statistics.median(warm))}
+            result['paths'] = paths
+    return result
+
+
+def run_child(args, warmup: str, burst_size: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-m', 'scripts.bench_startup', '--child', '--burst', str(burst_size),
+         '--repeat', str(args.repeat)],
+        env={**os.environ, 'WARMUP': warmup}, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median_of(runs: list) -> dict:
+    '''Median of each figure over runs, keeping the nesting of per-path figures'''
+    merged = {}
+    for key, value in runs[0].items():
+        if isinstance(value, dict):
+            merged[key] = median_of([run[key] for run in runs])
+        else:
+            merged[key] = statistics.median(run[key] for run in runs)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3, help='Cold starts per mode')
+    parser.add_argument('--burst', type=int, default=32, help='Concurrent requests sent once the worker is up')
+    parser.add_argument('--repeat', type=int, default=10, help='Warm requests per path after the first')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        logging.disable(logging.WARNING)
+        # Measure every request's own cost: no rate limits or sharing of concurrent responses, unless set
+        os.environ.setdefault('RATE_LIMIT', 'False')
+        os.environ.setdefault('REQUEST_COALESCING', 'False')
+        print(json.dumps(asyncio.run(child(args))))
+        return
+
+    results = {'runs': args.runs, 'burst': args.burst}
+    for mode, warmup in MODES.items():
+        # Separate processes for the bursts, so the sequential first requests are also cold
+        results[mode] = median_of([run_child(args, warmup, 0) for _ in range(args.runs)])
+        if args.burst:
+            bursts = median_of([run_child(args, warmup, args.burst) for _ in range(args.runs)])
+            results[mode].update({key: value for key, value in bursts.items() if 'burst' in key})
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
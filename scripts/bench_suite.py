@@ -0,0 +1,390 @@
+'''
+Benchmark suite for the whole API.
+
+Seeds a synthetic dataset of `--regions` regions into a temporary SQLite database (rows are
+generated from the shape of `sample_data.csv`: the same countries, with admin1 names suffixed to
+stay unique, and population/events/score drawn from the sample) with `--history-periods` weekly
+history periods before the current one, then drives every route in
+`app/routes/` in-process over ASGI with `--concurrency` clients. Prints throughput and
+p50/p95/p99 latency per scenario as JSON, with the commit and settings, so runs can be compared
+between commits. Scenarios that write (feedback, deletes, bulk upload, registration) run last.
+
+With `--replay FILE`, replays a recorded request log instead, reporting per route. The log is JSON
+lines of {"method", "path", optionally "json", "body", "headers", "auth" ("user" or "admin") and
+"at" (seconds from start)}. Lines without `method` and `path` are skipped and counted. `--record FILE`
+writes the requests a run sends in the same format.
+
+Run with: python -m scripts.bench_suite --regions 10000 --concurrency 16 --seconds 3 --output bench.json
+Against an existing, loaded database: python -m scripts.bench_suite --database-url sqlite:///./data.db
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, Optional
+from urllib.parse import quote, unquote, urlencode
+
+USERS = {
+    'user': {'email': 'user1@test.com', 'password': 'password123'},
+    'admin': {'email': 'user2@test.com', 'password': 'password123'},
+}
+FEEDBACK_TEXT = 'Benchmark feedback on this region\'s conflict data.'
+
+
+class Scenario(NamedTuple):
+    name: str
+    # Request number -> (method, path, request kwargs)
+    make: Callable[[int], tuple]
+    auth: Optional[str] = None
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0
+
+
+def summarise(latencies: list, statuses: dict, elapsed: float) -> dict:
+    return {
+        'requests': len(latencies),
+        'server_errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+        'requests_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0.0) * 1000, 2),
+        'status_counts': statuses,
+    }
+
+
+def synthetic_rows(regions: int, seed: int = 0):
+    '''Yield `regions` conflict_data rows shaped like sample_data.csv'''
+    from app.models import normalise_key
+
+    with open('sample_data.csv') as f:
+        sample = list(csv.DictReader(f))
+    rng = random.Random(seed)
+    for i in range(regions):
+        base = sample[i % len(sample)]
+        copy = i // len(sample)
+        admin1 = base['admin1'] if copy == 0 else f'{base["admin1"]} {copy}'
+        values = rng.choice(sample)
+        yield {
+            'country': base['country'], 'admin1': admin1,
+            'country_key': normalise_key(base['country']), 'admin1_key': normalise_key(admin1),
+            'population': int(values['population']) if values['population'] else None,
+            'events': int(values['events']), 'risk_score': int(values['score']),
+        }
+
+
+def seed_database(regions: int, history_periods: int = 12, chunk: int = 10000) -> None:
+    '''Create the schema, load synthetic regions, their history and the test users. Needs DATABASE_URL set first'''
+    from sqlalchemy import insert
+
+    from app.auth import hash_password
+    from app.database import SessionLocal, engine
+    from app.migrations import run_migrations
+    from app.models import Base, ConflictData, User
+    from app.utils.history_utils import period_start, snapshot_current
+
+    started = time.perf_counter()
+    Base.metadata.create_all(bind=engine)
+    rows = synthetic_rows(regions)
+    with engine.begin() as conn:
+        while True:
+            batch = [row for _, row in zip(range(chunk), rows)]
+            if not batch:
+                break
+            conn.execute(insert(ConflictData), batch)
+    # Core inserts skip the change hooks, so fill country_summary and data_versions like an upgrade would
+    run_migrations()
+    with SessionLocal() as db:
+        db.add_all(User(email=u['email'], hashed_password=hash_password(u['password']), is_admin=role == 'admin')
+                   for role, u in USERS.items())
+        # Past periods only, so the snapshot scenario records the current one
+        this_week = period_start(datetime.utcnow().date())
+        for weeks_ago in range(history_periods, 0, -1):
+            snapshot_current(db, this_week - timedelta(weeks=weeks_ago))
+        db.commit()
+    logger.info(f'Seeded {regions} regions in {time.perf_counter() - started:.1f}s')
+
+
+def scenarios(regions: list, countries: list, user_ids: dict) -> list:
+    '''Every route, with arguments drawn from the seeded data and `user_ids` ({role: id}). Read scenarios first'''
+    rng = random.Random(1)
+    prefixes = [admin1[:n] for _, admin1 in regions[:500] for n in (1, 3, 5)]
+    run_id = int(time.time())
+
+    def region(i):
+        return regions[i % len(regions)]
+
+    def country(i):
+        return countries[i % len(countries)]
+
+    def bulk_body(i):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['country', 'admin1', 'population', 'events', 'score'])
+        writer.writerows([c, a, '', i % 1000, i % 10] for c, a in (region(i * 100 + k) for k in range(100)))
+        return buffer.getvalue()
+
+    # Offset pages that exist, up to the first 50: deep offsets are what cursor paging is for
+    pages = max(1, min(50, len(regions) // 100))
+
+    # Delete from the end of the shuffled regions, so earlier scenarios' regions are unaffected
+    deletable = list(reversed(regions))
+    return [
+        Scenario('list_offset', lambda i: ('GET', _url('/v1/conflictdata', page_size=100, offset=rng.randrange(0, pages) * 100), {})),
+        Scenario('list_cursor', lambda i: ('GET', _url('/v1/conflictdata', page_size=100, cursor=_cursor(region(i))), {})),
+        Scenario('list_countries_filter', lambda i: ('GET', _url('/v1/conflictdata', country=[country(i), country(i + 7)]), {})),
+        Scenario('per_country', lambda i: ('GET', _url('/v1/conflictdata/{}', country(i)), {})),
+        Scenario('riskscore', lambda i: ('GET', _url('/v1/conflictdata/{}/riskscore', country(i)), {})),
+        Scenario('countries', lambda i: ('GET', _url('/v1/countries', sort_by='average_risk_score', descending='true'), {})),
+        Scenario('country_summary', lambda i: ('GET', _url('/v1/countries/{}', country(i)), {})),
+        Scenario('country_statistics', lambda i: ('GET', _url('/v1/countries/statistics', country=[country(i + k) for k in (0, 7, 13)]), {})),
+        Scenario('country_statistics_all', lambda i: ('GET', '/v1/countries/statistics', {})),
+        Scenario('export_country_ndjson', lambda i: ('GET', _url('/v1/export/conflictdata', country=country(i)), {})),
+        Scenario('country_history', lambda i: ('GET', _url('/v1/history/{}', country(i)), {})),
+        Scenario('region_history', lambda i: ('GET', _url('/v1/history/{}/{}', *region(i)), {})),
+        Scenario('region_search', lambda i: ('GET', _url('/v1/regions/search', q=prefixes[i % len(prefixes)]), {})),
+        Scenario('region_feedback', lambda i: ('GET', _url('/v1/feedback/{}/{}', *region(i)), {}), 'user'),
+        Scenario('country_feedback', lambda i: ('GET', _url('/v1/feedback/{}', country(i)), {}), 'user'),
+        Scenario('auth_me', lambda i: ('GET', '/v1/auth/me', {}), 'user'),
+        Scenario('metrics', lambda i: ('GET', '/metrics', {})),
+        Scenario('slow_queries', lambda i: ('GET', '/v1/admin/slow-queries', {}), 'admin'),
+        Scenario('auth_login', lambda i: ('POST', '/v1/auth/login', {'json': USERS['user']})),
+        Scenario('write_feedback', lambda i: ('POST', _url('/v1/conflictdata/{}/userfeedback', region(i)[1], country=region(i)[0]),
+                                              {'json': {'feedback_text': FEEDBACK_TEXT}}), 'user'),
+        Scenario('write_feedback_batch', lambda i: ('POST', '/v1/conflictdata/userfeedback', {'json': [
+            {'admin1': a, 'country': c, 'feedback_text': FEEDBACK_TEXT} for c, a in (region(i * 50 + k) for k in range(50))
+        ]}), 'user'),
+        # After the feedback writes, so there is feedback to page through
+        Scenario('user_feedback', lambda i: ('GET', _url('/v1/feedback/users/{}', str(user_ids['user']), page_size=100), {}), 'user'),
+        Scenario('user_feedback_admin', lambda i: ('GET', _url('/v1/feedback/users/{}', str(user_ids['user'])), {}), 'admin'),
+        Scenario('bulk_upload_100', lambda i: ('POST', '/v1/conflictdata/bulk?format=csv', {
+            'content': bulk_body(i), 'headers': {'Content-Type': 'text/csv'}}), 'admin'),
+        Scenario('auth_register', lambda i: ('POST', '/v1/auth/register', {
+            'json': {'email': f'bench{run_id}_{i}@test.com', 'password': 'password123'}})),
+        Scenario('clear_slow_queries', lambda i: ('DELETE', '/v1/admin/slow-queries', {}), 'admin'),
+        Scenario('history_snapshot', lambda i: ('POST', '/v1/admin/history/snapshot', {}), 'admin'),
+        Scenario('delete_row', lambda i: ('DELETE', _url('/v1/conflictdata', country=deletable[i % len(deletable)][0],
+                                                         admin1=deletable[i % len(deletable)][1]), {}), 'admin'),
+    ]
+
+
+def _url(template: str, *segments: str, **params) -> str:
+    '''`template` with the quoted path `segments` filled in, plus a query string from `params`'''
+    path = template.format(*(quote(segment, safe='') for segment in segments))
+    return f'{path}?{urlencode(params, doseq=True)}' if params else path
+
+
+def _cursor(region: tuple) -> str:
+    from app.models import normalise_key
+    from app.utils.pagination_utils import encode_cursor
+    return encode_cursor(normalise_key(region[0]), normalise_key(region[1]), 0)
+
+
+def _auth_headers(kwargs: dict, auth: Optional[str], tokens: dict) -> dict:
+    if auth:
+        kwargs = {**kwargs, 'headers': {**kwargs.get('headers', {}), 'Authorization': f'Bearer {tokens[auth]}'}}
+    return kwargs
+
+
+async def run_scenario(client, scenario: Scenario, tokens: dict, args, recorder: Optional[list]) -> dict:
+    latencies, statuses = [], {}
+    counter = iter(range(10 ** 12))
+    started = time.perf_counter()
+    stop = started + args.seconds
+
+    async def worker():
+        while time.perf_counter() < stop:
+            i = next(counter)
+            if args.requests and i >= args.requests:
+                return
+            method, path, kwargs = scenario.make(i)
+            if recorder is not None:
+                recorder.append({'method': method, 'path': path, 'auth': scenario.auth,
+                                 'at': round(time.perf_counter() - started, 4), **_recorded(kwargs)})
+            sent = time.perf_counter()
+            response = await client.request(method, path, **_auth_headers(kwargs, scenario.auth, tokens))
+            latencies.append(time.perf_counter() - sent)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    return summarise(latencies, statuses, time.perf_counter() - started)
+
+
+def _recorded(kwargs: dict) -> dict:
+    return {key: kwargs[key] for key in ('json', 'headers') if key in kwargs} | (
+        {'body': kwargs['content']} if 'content' in kwargs else {})
+
+
+def load_replay(path: str) -> tuple:
+    '''(replayable entries, number of lines skipped) from a JSON lines request log'''
+    entries, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                entry = None
+            if isinstance(entry, dict) and isinstance(entry.get('method'), str) and isinstance(entry.get('path'), str):
+                entries.append(entry)
+            elif line.strip():
+                skipped += 1
+    return entries, skipped
+
+
+def route_templates(app) -> list:
+    '''(method, template, regex) for each API operation, literal paths before parameterised ones'''
+    templates = [
+        (method.upper(), path, re.compile('^' + re.sub(r'\\\{[^/]+?\\\}', '[^/]+', re.escape(path)) + '$'))
+        for path, operations in app.openapi()['paths'].items() for method in operations
+    ]
+    return sorted(templates, key=lambda template: template[1].count('{'))
+
+
+def route_name(templates: list, method: str, path: str) -> str:
+    '''The route template a request path matches, e.g. `GET /v1/conflictdata/{country}`'''
+    path = unquote(path.split('?')[0])
+    for template_method, template, regex in templates:
+        if template_method == method.upper() and regex.match(path):
+            return f'{template_method} {template}'
+    return f'{method.upper()} (unmatched)'
+
+
+async def replay(client, app, entries: list, tokens: dict, args) -> dict:
+    '''Send logged requests in order with `--concurrency` in flight, keeping their timing if `--replay-timing`'''
+    templates = route_templates(app)
+    by_route = {}
+    queue = asyncio.Queue()
+    for entry in entries:
+        queue.put_nowait(entry)
+    started = time.perf_counter()
+
+    async def worker():
+        while not queue.empty():
+            entry = queue.get_nowait()
+            if args.replay_timing and 'at' in entry:
+                await asyncio.sleep(max(0.0, started + entry['at'] / args.replay_speed - time.perf_counter()))
+            kwargs = {key: entry[key] for key in ('json', 'headers') if key in entry}
+            if 'body' in entry:
+                kwargs['content'] = entry['body']
+            sent = time.perf_counter()
+            response = await client.request(entry['method'], entry['path'], **_auth_headers(kwargs, entry.get('auth'), tokens))
+            latencies, statuses = by_route.setdefault(route_name(templates, entry['method'], entry['path']), ([], {}))
+            latencies.append(time.perf_counter() - sent)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - started
+    return {route: summarise(latencies, statuses, elapsed) for route, (latencies, statuses) in sorted(by_route.items())}
+
+
+async def run(args) -> dict:
+    import httpx
+    from sqlalchemy import select
+
+    from app.database import SessionLocal
+    from app.main import app
+    from app.models import ConflictData, User
+
+    with SessionLocal() as db:
+        regions = [tuple(r) for r in db.execute(select(ConflictData.country, ConflictData.admin1))]
+        roles = {user['email']: role for role, user in USERS.items()}
+        user_ids = {roles[email]: user_id for email, user_id in db.execute(
+            select(User.email, User.id).where(User.email.in_(roles)))}
+    random.Random(0).shuffle(regions)
+    countries = sorted({country for country, _ in regions})
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    results = {}
+    # ASGITransport doesn't send lifespan events, so run startup (index builds) here
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+            tokens = {role: (await client.post('/v1/auth/login', json=user)).json()['access_token']
+                      for role, user in USERS.items()}
+            if args.replay:
+                entries, skipped = load_replay(args.replay)
+                results['replay'] = {'file': args.replay, 'requests': len(entries), 'skipped_lines': skipped}
+                results['routes'] = await replay(client, app, entries, tokens, args)
+                return results
+            recorder = [] if args.record else None
+            results['scenarios'] = {}
+            for scenario in scenarios(regions, countries, user_ids):
+                if args.scenarios and not any(s in scenario.name for s in args.scenarios):
+                    continue
+                logger.info(f'Running {scenario.name}')
+                results['scenarios'][scenario.name] = await run_scenario(client, scenario, tokens, args, recorder)
+            if recorder is not None:
+                with open(args.record, 'w') as f:
+                    f.writelines(json.dumps(entry) + '\n' for entry in recorder)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--regions', type=int, default=10000, help='Synthetic regions to seed')
+    parser.add_argument('--history-periods', type=int, default=12, help='Weekly history periods to seed')
+    parser.add_argument('--database-url', help='Use this loaded database instead of seeding a temporary one')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--seconds', type=float, default=3, help='Duration of each scenario')
+    parser.add_argument('--requests', type=int, default=0, help='Stop each scenario after this many requests')
+    parser.add_argument('--scenarios', nargs='*', help='Only run scenarios whose name contains one of these')
+    parser.add_argument('--replay', help='Replay this JSON lines request log instead of the scenarios')
+    parser.add_argument('--replay-timing', action='store_true', help='Keep the logged `at` offsets')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='Speed-up factor for --replay-timing')
+    parser.add_argument('--record', help='Write the requests sent by the scenarios to this file, in replay format')
+    parser.add_argument('--output', help='Also write the JSON results to this file')
+    args = parser.parse_args()
+
+    from app.logging_config import configure_logging
+    configure_logging()
+    with tempfile.TemporaryDirectory() as directory:
+        # The app reads DATABASE_URL at import, so set it before anything from app is imported
+        # Measure the routes, not the rate limiter, unless RATE_LIMIT is set explicitly
+        os.environ.setdefault('RATE_LIMIT', 'False')
+        if args.database_url:
+            os.environ['DATABASE_URL'] = args.database_url
+        else:
+            os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(directory, "bench.db")}'
+            seed_database(args.regions, args.history_periods)
+        # Keep request logging out of the measurements
+        logging.getLogger().setLevel(logging.WARNING)
+        results = asyncio.run(run(args))
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    output = {
+        'commit': commit,
+        'python': platform.python_version(),
+        'regions': None if args.database_url else args.regions,
+        'history_periods': None if args.database_url else args.history_periods,
+        'database_url': os.environ['DATABASE_URL'] if args.database_url else 'temporary sqlite',
+        'concurrency': args.concurrency,
+        'seconds_per_scenario': args.seconds,
+        'rate_limit': os.environ['RATE_LIMIT'] == 'True',
+        'request_coalescing': os.getenv('REQUEST_COALESCING', 'True') == 'True',
+        **results,
+    }
+    print(json.dumps(output, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+'''
+Query plan regression check for the conflict data endpoints.
+
+Calls each endpoint against an in-memory SQLite copy of the schema (seeded from `sample_data.csv`),
+captures every statement it runs against `conflict_data` and checks its `EXPLAIN QUERY PLAN` for
+full table scans or temporary sort b-trees. Exits non-zero if any statement misses an index.
+
+Run with: python -m scripts.check_query_plans
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+from app.logging_config import configure_logging
+configure_logging()
+
+from fastapi import Response
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models import Base, ConflictData
+from app.routes import conflict_data as routes
+from app.search import load_countries
+from app.snapshot import ConflictSnapshot
+from app.utils.export_utils import iter_export_partitions
+from app.utils.feedback_utils import country_feedback, feedback_counts, region_feedback, user_feedback
+from app.utils.history_utils import country_series, region_series
+from app.utils.pagination_utils import encode_cursor
+from app.utils.statistical_utils import country_statistics
+
+import argparse
+import csv
+from datetime import date, datetime
+import re
+import sys
+from types import SimpleNamespace
+
+# A plan line is bad if it scans conflict_data (or its history, or feedback) without an index, or sorts in a temp b-tree
+BAD_PLAN = re.compile(r'^SCAN (conflict_data|conflict_data_history|user_feedback)$|USE TEMP B-TREE')
+
+
+def seed(db) -> None:
+    with open('sample_data.csv') as f:
+        for row in csv.DictReader(f):
+            db.add(ConflictData(
+                country=row['country'],
+                admin1=row['admin1'],
+                population=int(row['population']) if row['population'] else None,
+                events=int(row['events']),
+                risk_score=int(row['score'])
+            ))
+    db.commit()
+
+
+def endpoint_calls(db) -> dict:
+    '''Each endpoint with representative arguments. Feedback/delete are called last as they write'''
+    user = SimpleNamespace(id=1, email='plan-check@test.com', is_admin=True)
+    return {
+        'get_conflict_data': lambda: routes.get_conflict_data(
+            offset=0, country=None, page_size=20, cursor=None, include_total=None, if_none_match=None, db=db),
+        'get_conflict_data (country filter)': lambda: routes.get_conflict_data(
+            offset=0, country=['south africa', 'Kenya'], page_size=20, cursor=None, include_total=None,
+            if_none_match=None, db=db),
+        'get_conflict_data (cursor)': lambda: routes.get_conflict_data(
+            offset=0, country=None, page_size=20, cursor=encode_cursor('kenya', 'nairobi', 0), include_total=None,
+            if_none_match=None, db=db),
+        'get_conflict_data (country filter, cursor)': lambda: routes.get_conflict_data(
+            offset=0, country=['south africa', 'Kenya'], page_size=20, cursor=encode_cursor('kenya', 'nairobi', 0),
+            include_total=None, if_none_match=None, db=db),
+        'get_conflict_data_per_country': lambda: routes.get_conflict_data_per_country(
+            country='SOUTH AFRICA', if_none_match=None, db=db),
+        'get_risk_score_average': lambda: routes.get_risk_score_average(
+            country='South Africa', if_none_match=None, db=db),
+        'ConflictSnapshot.load': lambda: ConflictSnapshot.load(db),
+        'load_countries': lambda: load_countries(db),
+        'load_countries (country filter)': lambda: load_countries(db, ['south africa', 'kenya']),
+        'iter_export_partitions': lambda: list(iter_export_partitions(db)),
+        'country_statistics': lambda: country_statistics(db),
+        'country_statistics (country filter)': lambda: country_statistics(db, ['south africa', 'kenya']),
+        'iter_export_partitions (country filter)': lambda: list(iter_export_partitions(db, ['south africa', 'kenya'])),
+        'feedback_counts': lambda: feedback_counts(db, [1, 2, 3]),
+        'region_feedback': lambda: region_feedback(db, 1),
+        'region_feedback (cursor)': lambda: region_feedback(db, 1, [datetime(2024, 1, 1), 1]),
+        'country_feedback': lambda: country_feedback(db, 'kenya'),
+        'country_feedback (cursor)': lambda: country_feedback(db, 'kenya', ['nairobi', datetime(2024, 1, 1), 1]),
+        'user_feedback': lambda: user_feedback(db, 1),
+        'user_feedback (cursor)': lambda: user_feedback(db, 1, [datetime(2024, 1, 1), 1]),
+        'country_series': lambda: country_series(db, 'kenya', date(2024, 1, 1), date(2024, 12, 30)),
+        'region_series': lambda: region_series(db, 'kenya', 'nairobi', date(2024, 1, 1), date(2024, 12, 30)),
+        'write_feedback': lambda: routes.write_feedback(
+            payload=routes.FeedbackRequest(feedback_text='Query plan regression check'),
+            admin1='eastern cape', country=None, db=db, credentials=None, user=user, response=Response()),
+        'write_feedback (country filter)': lambda: routes.write_feedback(
+            payload=routes.FeedbackRequest(feedback_text='Query plan regression check'),
+            admin1='Eastern Cape', country='South Africa', db=db, credentials=None, user=user, response=Response()),
+        'write_feedback_batch': lambda: routes.write_feedback_batch(
+            payload=[routes.FeedbackBatchItem(admin1=admin1, country=country, feedback_text='Query plan regression check')
+                     for admin1, country in (('Eastern Cape', None), ('Nairobi', 'Kenya'), ('Nowhere', None))],
+            db=db, credentials=None, user=user, response=Response()),
+        'delete_conflict_data_row': lambda: routes.delete_conflict_data_row(
+            admin1='Eastern Cape', country='South Africa', db=db, credentials=None, user=user),
+    }
+
+
+def check_query_plans() -> list:
+    '''Return a list of (endpoint, statement, plan) for every statement that misses an index'''
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    seed(db)
+
+    captured = []
+    @event.listens_for(engine, 'before_cursor_execute')
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if 'conflict_data' in statement and not statement.startswith('EXPLAIN'):
+            captured.append((statement, parameters))
+
+    failures = []
+    raw = engine.raw_connection()
+    try:
+        for name, call in endpoint_calls(db).items():
+            captured.clear()
+            call()
+            for statement, parameters in list(captured):
+                plan = [r[3] for r in raw.cursor().execute(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+                if plan:
+                    logger.info(f'{name}: {" | ".join(plan)}')
+                if any(BAD_PLAN.search(line) for line in plan):
+                    failures.append((name, statement, plan))
+    finally:
+        raw.close()
+        db.close()
+    return failures
+
+
+if __name__ == '__main__':
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    failures = check_query_plans()
+    for name, statement, plan in failures:
+        logger.error(f'{name} does not use an index:\n{statement}\n{plan}')
+    if failures:
+        sys.exit(1)
+    logger.info('All conflict data queries use an index')
@@ -0,0 +1,34 @@
+'''
+Stream a CSV or NDJSON file of conflict data into the database with upsert semantics.
+Rows are matched on (country, admin1) case-insensitively; existing rows keep their id and feedback.
+
+Run with: python -m scripts.ingest_conflict_data sample_data.csv --batch-size 5000
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+from app.logging_config import configure_logging
+configure_logging()
+
+from app.utils.ingest_utils import DEFAULT_BATCH_SIZE, ingest_file
+
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='CSV (with header row) or NDJSON file')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default=None, help='Defaults to the file extension')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per transaction')
+    args = parser.parse_args()
+
+    summary = ingest_file(args.path, fmt=args.format, batch_size=args.batch_size)
+    logger.info(
+        f"Ingested {summary['rows']} rows in {summary['batches']} batches: {summary['inserted']} inserted, "
+        f"{summary['updated']} updated, {summary['unchanged']} unchanged, {summary['rejected']} rejected. "
+        f"{summary['seconds']}s ({summary['rows_per_sec']} rows/sec)"
+    )
+
+
+if __name__ == '__main__':
+    main()
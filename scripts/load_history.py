@@ -0,0 +1,48 @@
+'''
+Append periods to conflict_data_history.
+
+Record the current conflict data as this week's period (e.g. weekly from cron), or as the period of a given day:
+    python -m scripts.load_history --snapshot [--period 2024-06-03]
+Load past periods from a CSV/NDJSON file with conflict_data columns plus `period` (ISO date):
+    python -m scripts.load_history path/to/history.csv --batch-size 10000
+Regions already recorded for a period are skipped, so reruns are safe.
+'''
+import logging
+logger = logging.getLogger(__name__)
+
+from app.logging_config import configure_logging
+configure_logging()
+
+from app.database import SessionLocal
+from app.utils.history_utils import HISTORY_BATCH_SIZE, ingest_history_file, period_start, snapshot_current
+
+import argparse
+from datetime import date
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', nargs='?', help='CSV (with header row) or NDJSON file of past periods')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default=None, help='Defaults to the file extension')
+    parser.add_argument('--batch-size', type=int, default=HISTORY_BATCH_SIZE, help='Rows per transaction')
+    parser.add_argument('--snapshot', action='store_true', help='Record the current conflict data instead of a file')
+    parser.add_argument('--period', type=date.fromisoformat, help='With --snapshot: a day of the period to record')
+    args = parser.parse_args()
+    if args.snapshot == bool(args.path):
+        parser.error('pass either a file or --snapshot')
+
+    if args.snapshot:
+        with SessionLocal() as db:
+            snapshot_current(db, period_start(args.period) if args.period else None)
+            db.commit()
+        return
+    summary = ingest_history_file(args.path, fmt=args.format, batch_size=args.batch_size)
+    logger.info(
+        f"Loaded {summary['rows']} rows in {summary['batches']} batches: {summary['inserted']} added, "
+        f"{summary['unchanged']} already recorded, {summary['rejected']} rejected. "
+        f"{summary['seconds']}s ({summary['rows_per_sec']} rows/sec)"
+    )
+
+
+if __name__ == '__main__':
+    main()
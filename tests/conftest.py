@@ -0,0 +1,88 @@
+'''
+Shared fixtures. The app reads its settings when imported, so they are set here first: a
+temporary SQLite database, no warm-up, access log or rate limits, and cheap bcrypt hashes.
+
+Run with: python -m pytest
+'''
+import os
+import tempfile
+
+_directory = tempfile.mkdtemp(prefix='conflict-api-tests-')
+os.environ.update({
+    'DATABASE_URL': f'sqlite:///{os.path.join(_directory, "test.db")}',
+    'WARMUP': 'False',
+    'ACCESS_LOG': 'False',
+    'RATE_LIMIT': 'False',
+    'BCRYPT_ROUNDS': '4',
+})
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.auth import hash_password
+from app.database import SessionLocal
+from app.init_db import init_db
+from app.models import ConflictData, User, normalise_key
+
+# (country, admin1, population, events, risk_score). `Central` is in two countries, for ambiguous lookups
+REGIONS = [
+    ('Kenya', 'Nairobi', 4400000, 120, 7),
+    ('Kenya', 'Mombasa', 1200000, 40, 4),
+    ('Kenya', 'Central', 5000000, 10, 2),
+    ('Ghana', 'Central', 2900000, 5, 1),
+    ('Ghana', 'Ashanti', None, 30, 3),
+    ('Côte d\'Ivoire', 'Abidjan', 5600000, 60, 5),
+    ('South Africa', 'Eastern Cape', 6600000, 80, 6),
+]
+USERS = {
+    'user': {'email': 'user1@test.com', 'password': 'password123'},
+    'admin': {'email': 'user2@test.com', 'password': 'password123'},
+}
+# Countries tests may write rows for; the `scratch_rows` fixture deletes them again
+SCRATCH_COUNTRIES = ('Testland', 'Ömland')
+
+
+@pytest.fixture(scope='session')
+def database():
+    '''The schema, REGIONS and USERS, once per test run'''
+    init_db()
+    with SessionLocal() as db:
+        db.add_all(ConflictData(country=c, admin1=a, population=p, events=e, risk_score=r) for c, a, p, e, r in REGIONS)
+        db.add_all(User(email=u['email'], hashed_password=hash_password(u['password']), is_admin=role == 'admin')
+                   for role, u in USERS.items())
+        db.commit()
+
+
+@pytest.fixture(scope='session')
+def client(database):
+    '''In-process client, with the app's startup (index builds) run'''
+    from app.main import app
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope='session')
+def auth_headers(client):
+    '''{role: Authorization header} for a user and an admin'''
+    headers = {}
+    for role, user in USERS.items():
+        token = client.post('/v1/auth/login', json=user).json()['access_token']
+        headers[role] = {'Authorization': f'Bearer {token}'}
+    return headers
+
+
+@pytest.fixture
+def db(database):
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def scratch_rows(database):
+    '''Deletes any SCRATCH_COUNTRIES rows after the test, through the ORM so summaries and versions follow'''
+    yield SCRATCH_COUNTRIES
+    with SessionLocal() as session:
+        keys = [normalise_key(country) for country in SCRATCH_COUNTRIES]
+        for row in session.query(ConflictData).filter(ConflictData.country_key.in_(keys)):
+            session.delete(row)
+        session.commit()
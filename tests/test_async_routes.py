@@ -0,0 +1,61 @@
+'''The async conflict data routes give the same responses as the sync ones'''
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.database import EVENT_LOOP_SESSION, engine, get_async_db
+from app.routes import conflict_data_async
+
+
+@pytest.fixture(scope='module')
+def async_client(client):
+    async_engine = create_async_engine(engine.url.set(drivername='sqlite+aiosqlite'), poolclass=NullPool)
+    sessions = async_sessionmaker(async_engine, autoflush=False)
+
+    async def get_db():
+        async with sessions() as db:
+            db.sync_session.info[EVENT_LOOP_SESSION] = True
+            yield db
+
+    app = FastAPI()
+    app.include_router(conflict_data_async.router, prefix='/v1')
+    app.dependency_overrides[get_async_db] = get_db
+    with TestClient(app) as async_client:
+        yield async_client
+
+
+@pytest.mark.parametrize('url, params', [
+    ('/v1/conflictdata', {'page_size': 3, 'offset': 2}),
+    ('/v1/conflictdata', {'country': ['kenya', 'Ghana'], 'page_size': 2, 'include_total': False}),
+    ('/v1/conflictdata/Kenya', {}),
+    ('/v1/conflictdata/kenya/riskscore', {}),
+    ('/v1/conflictdata/Atlantis', {}),
+])
+def test_same_responses(client, async_client, url, params):
+    expected = client.get(url, params=params)
+    response = async_client.get(url, params=params)
+    assert response.status_code == expected.status_code
+    assert response.json() == expected.json()
+    assert response.headers.get('ETag') == expected.headers.get('ETag')
+    if 'ETag' in response.headers:
+        assert async_client.get(url, params=params, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_cursor_pages(client, async_client):
+    first = async_client.get('/v1/conflictdata', params={'page_size': 4}).json()
+    second = async_client.get('/v1/conflictdata', params={'page_size': 4, 'cursor': first['next_cursor']}).json()
+    assert second == client.get('/v1/conflictdata', params={'page_size': 4, 'cursor': first['next_cursor']}).json()
+
+
+def test_feedback(async_client, auth_headers):
+    response = async_client.post('/v1/conflictdata/Nairobi/userfeedback',
+                                 json={'feedback_text': 'Written through the async route'}, headers=auth_headers['user'])
+    assert response.status_code == 201
+    response = async_client.post('/v1/conflictdata/userfeedback', headers=auth_headers['user'], json=[
+        {'admin1': 'Mombasa', 'feedback_text': 'Batch written through the async route'},
+        {'admin1': 'Atlantis', 'feedback_text': 'Batch written through the async route'},
+    ])
+    assert response.status_code == 201
+    assert [item['status'] for item in response.json()['results']] == ['created', 'not_found']
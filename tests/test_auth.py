@@ -0,0 +1,111 @@
+'''Token claims, the principal cache and revocation'''
+import itertools
+
+import pytest
+from sqlalchemy import event
+
+from app.auth import create_token
+from app.database import engine
+from app.models import User
+
+ADMIN_URL = '/v1/admin/slow-queries'
+_emails = (f'auth{i}@test.com' for i in itertools.count())
+
+
+@pytest.fixture
+def new_user(client, db):
+    '''A freshly registered user, as (User row, login headers)'''
+    credentials = {'email': next(_emails), 'password': 'password123'}
+    assert client.post('/v1/auth/register', json=credentials).status_code == 200
+    user = db.query(User).filter(User.email == credentials['email']).one()
+    return user, credentials
+
+
+def login(client, credentials: dict) -> dict:
+    token = client.post('/v1/auth/login', json=credentials).json()['access_token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def users_queries():
+    '''Number of statements reading the users table while the test runs'''
+    count = [0]
+
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM users' in statement:
+            count[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_query)
+    yield count
+    event.remove(engine, 'before_cursor_execute', count_query)
+
+
+def test_admin_check_reads_no_users(client, auth_headers, users_queries):
+    client.get(ADMIN_URL, headers=auth_headers['admin'])  # principal cached
+    users_queries[0] = 0
+    for _ in range(3):
+        assert client.get(ADMIN_URL, headers=auth_headers['admin']).status_code == 200
+    assert users_queries[0] == 0
+
+
+def test_non_admin_is_403(client, auth_headers):
+    assert client.get(ADMIN_URL, headers=auth_headers['user']).status_code == 403
+
+
+def test_token_without_admin_claim_is_403(client, db):
+    admin = db.query(User).filter(User.email == 'user2@test.com').one()
+    token = create_token(admin.id, is_admin=False, token_version=admin.token_version)
+    assert client.get(ADMIN_URL, headers={'Authorization': f'Bearer {token}'}).status_code == 403
+
+
+def test_promotion_revokes_old_tokens(client, db, new_user):
+    user, credentials = new_user
+    old = login(client, credentials)
+    assert client.get(ADMIN_URL, headers=old).status_code == 403
+
+    user.is_admin = True
+    db.commit()
+    assert client.get('/v1/auth/me', headers=old).status_code == 401
+    assert client.get(ADMIN_URL, headers=login(client, credentials)).status_code == 200
+
+
+def test_demotion_revokes_admin_tokens(client, db, new_user):
+    user, credentials = new_user
+    user.is_admin = True
+    db.commit()
+    headers = login(client, credentials)
+    assert client.get(ADMIN_URL, headers=headers).status_code == 200
+
+    user.is_admin = False
+    db.commit()
+    response = client.get(ADMIN_URL, headers=headers)
+    assert response.status_code == 401 and response.json()['detail'] == 'token revoked'
+    assert client.get(ADMIN_URL, headers=login(client, credentials)).status_code == 403
+
+
+def test_deleted_user_is_rejected(client, db, new_user):
+    user, credentials = new_user
+    headers = login(client, credentials)
+    assert client.get('/v1/auth/me', headers=headers).status_code == 200
+
+    db.delete(user)
+    db.commit()
+    assert client.get('/v1/auth/me', headers=headers).status_code == 401
+
+
+@pytest.mark.parametrize('header', [None, 'Token abc', 'Bearer not-a-jwt'])
+def test_bad_authorisation_header_is_401(client, header):
+    assert client.get('/v1/auth/me', headers={'Authorization': header} if header else {}).status_code == 401
+
+
+def test_new_user_replaces_a_cached_missing_one(client, db, new_user):
+    # A request for a deleted user caches it as missing, then SQLite gives its id to the next user
+    user, _ = new_user
+    user_id = user.id
+    db.delete(user)
+    db.commit()
+    assert client.get('/v1/auth/me', headers={'Authorization': f'Bearer {create_token(user_id)}'}).status_code == 401
+
+    db.add(User(id=user_id, email=next(_emails), hashed_password='-'))
+    db.commit()
+    assert client.get('/v1/auth/me', headers={'Authorization': f'Bearer {create_token(user_id)}'}).status_code == 200
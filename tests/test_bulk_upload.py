@@ -0,0 +1,35 @@
+'''Admin bulk upload endpoint'''
+URL = '/v1/conflictdata/bulk'
+
+
+def test_admins_only(client, auth_headers):
+    assert client.post(URL, content=b'').status_code in (401, 403)
+    assert client.post(URL, content=b'', headers=auth_headers['user']).status_code == 403
+
+
+def test_csv_upload(client, auth_headers, scratch_rows):
+    body = 'country,admin1,population,events,score\n' + ''.join(
+        f'Testland,Region {i},{1000 * i},{i},{i % 10}\n' for i in range(5)) + 'Testland,,1,1,1\n'
+    response = client.post(URL, params={'batch_size': 2}, content=body.encode(),
+                           headers={**auth_headers['admin'], 'Content-Type': 'text/csv'})
+    assert response.status_code == 200
+    result = response.json()
+    assert [batch['rows'] for batch in result['batches']] == [2, 2, 2]
+    assert {key: result['summary'][key] for key in ('rows', 'inserted', 'rejected')} == {'rows': 6, 'inserted': 5, 'rejected': 1}
+    assert result['summary']['rejects'] == [{'line': 7, 'error': 'missing admin1'}]
+    assert client.get('/v1/countries/Testland').json()['regions'] == 5
+
+
+def test_ndjson_upload_from_content_type(client, auth_headers, scratch_rows):
+    body = b'{"country": "\xc3\x96mland", "admin1": "Ost", "events": 2, "risk_score": 3}\n{"country": "Testland"}\n'
+    response = client.post(URL, content=body, headers={**auth_headers['admin'], 'Content-Type': 'application/x-ndjson'})
+    assert response.status_code == 200
+    summary = response.json()['summary']
+    assert (summary['inserted'], summary['rejected']) == (1, 1)
+    assert client.get('/v1/countries/ömland').json()['total_events'] == 2
+
+
+def test_invalid_utf8(client, auth_headers, scratch_rows):
+    response = client.post(URL, content=b'country,admin1,events,score\nTestland,\xff,1,1\n', headers=auth_headers['admin'])
+    assert response.status_code == 400
+    assert response.json()['detail']['message'] == 'request body is not valid UTF-8'
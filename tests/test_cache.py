@@ -0,0 +1,82 @@
+'''Aggregate cache backends and invalidation on conflict data changes'''
+import pytest
+
+from app.cache import MISSING, DatabaseCache, MemoryCache, aggregate_cache
+from app.models import ConflictData
+
+
+@pytest.fixture(params=[MemoryCache, DatabaseCache])
+def cache(request, database):
+    cache = request.param(max_size=3)
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+def test_get_and_set(cache):
+    assert cache.get('average', 'Kenya') is MISSING
+    cache.set('average', 'Kenya', None)
+    cache.set('average', 1, {'events': [1, 2]})
+    # String keys are normalised, and None is a value like any other
+    assert cache.get('average', 'KENYA') is None
+    assert cache.get('average', '1') == {'events': [1, 2]}
+    assert cache.get('other', 'kenya') is MISSING
+
+
+def test_expiry(cache):
+    cache.set('average', 'kenya', 4, ttl=-1)
+    assert cache.get('average', 'kenya') is MISSING
+
+
+def test_invalidation(cache):
+    for namespace in ('average', 'statistics'):
+        cache.set(namespace, 'kenya', 1)
+    cache.set('average', 'ghana', 2)
+    cache.evict_keys('Kenya')
+    assert [cache.get(ns, 'kenya') for ns in ('average', 'statistics')] == [MISSING, MISSING]
+    assert cache.get('average', 'ghana') == 2
+
+    cache.set('statistics', 'kenya', 1)
+    cache.invalidate('average', 'ghana')
+    assert cache.get('average', 'ghana') is MISSING
+    assert cache.get('statistics', 'kenya') == 1
+    cache.invalidate('statistics')
+    assert cache.get('statistics', 'kenya') is MISSING
+
+
+def test_size_bound(cache):
+    for i in range(4):
+        cache.set('average', i, i)
+    assert [cache.get('average', i) for i in range(4)] == [MISSING, 1, 2, 3]
+
+
+def test_lru_keeps_recently_read_entries():
+    cache = MemoryCache(max_size=2)
+    cache.set('average', 'a', 1)
+    cache.set('average', 'b', 2)
+    cache.get('average', 'a')
+    cache.set('average', 'c', 3)
+    assert [cache.get('average', key) for key in 'abc'] == [1, MISSING, 3]
+
+
+def test_committed_changes_evict_their_countries(db):
+    aggregate_cache.set('test', 'kenya', 1)
+    aggregate_cache.set('test', 'ghana', 2)
+    row = db.query(ConflictData).filter(ConflictData.country_key == 'kenya', ConflictData.admin1_key == 'mombasa').one()
+    try:
+        row.events += 1
+        db.flush()
+        assert aggregate_cache.get('test', 'kenya') == 1  # not before commit
+        db.commit()
+        assert aggregate_cache.get('test', 'kenya') is MISSING
+        assert aggregate_cache.get('test', 'ghana') == 2
+
+        aggregate_cache.set('test', 'kenya', 1)
+        row.events += 1
+        db.flush()
+        db.rollback()
+        assert aggregate_cache.get('test', 'kenya') == 1
+    finally:
+        row.events -= 1
+        db.commit()
+        aggregate_cache.invalidate('test')
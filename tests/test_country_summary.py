@@ -0,0 +1,66 @@
+'''Precomputed country summaries and the endpoints reading them'''
+from app.models import ConflictData, CountrySummary
+from app.utils.statistical_utils import refresh_country_summaries
+from conftest import REGIONS
+
+
+def test_country(client):
+    assert client.get('/v1/countries/GHANA').json() == {
+        'country': 'Ghana',
+        'regions': 2,
+        'average_risk_score': 2,
+        'total_events': 35,
+        'total_population': 2900000,
+        'regions_with_population': 1,
+        'population_weighted_risk_score': 1,
+        'events_weighted_risk_score': (1 * 5 + 3 * 30) / 35,
+    }
+    assert client.get('/v1/conflictdata/ghana/riskscore').json() == {'country': 'ghana', 'average_risk_score': 2}
+    assert client.get('/v1/countries/Atlantis').status_code == 404
+
+
+def test_list_countries(client):
+    items = client.get('/v1/countries', params={'sort_by': 'total_events', 'descending': True}).json()['items']
+    totals = {}
+    for country, _, _, events, _ in REGIONS:
+        totals[country] = totals.get(country, 0) + events
+    assert [(item['country'], item['total_events']) for item in items] == sorted(totals.items(), key=lambda t: -t[1])
+    assert client.get('/v1/countries', params={'sort_by': 'id'}).status_code == 422
+
+
+def test_summaries_follow_writes(db, scratch_rows):
+    db.add_all([ConflictData(country='Testland', admin1='North', population=1000, events=10, risk_score=2),
+                ConflictData(country='Testland', admin1='South', population=None, events=30, risk_score=6)])
+    db.commit()
+    summary = db.get(CountrySummary, 'testland')
+    assert (summary.region_count, summary.risk_score_avg, summary.population_sum, summary.events_sum) == (2, 4, 1000, 40)
+
+    south = db.query(ConflictData).filter(ConflictData.admin1 == 'South').one()
+    south.risk_score = 8
+    db.flush()
+    db.rollback()
+    db.expire_all()
+    assert db.get(CountrySummary, 'testland').risk_score_avg == 4
+
+    db.delete(db.query(ConflictData).filter(ConflictData.admin1 == 'North').one())
+    db.commit()
+    db.expire_all()
+    assert db.get(CountrySummary, 'testland').region_count == 1
+
+    db.delete(db.query(ConflictData).filter(ConflictData.country_key == 'testland').one())
+    db.commit()
+    # A country's summary goes with its last row
+    assert db.get(CountrySummary, 'testland') is None
+
+
+def test_full_refresh_matches(db):
+    before = {s.country_key: (s.region_count, s.risk_score_sum, s.events_sum, s.population_sum)
+              for s in db.query(CountrySummary)}
+    assert refresh_country_summaries(db) == len(before)
+    db.flush()
+    db.expire_all()
+    after = {s.country_key: (s.region_count, s.risk_score_sum, s.events_sum, s.population_sum)
+             for s in db.query(CountrySummary)}
+    db.rollback()
+    assert after == before
+    assert refresh_country_summaries(db, set()) == 0
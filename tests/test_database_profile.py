@@ -0,0 +1,36 @@
+'''Connection pool and SQLite settings profiles'''
+from sqlalchemy import text
+
+from app.database import engine, engine_options, sqlite_pragmas
+
+
+def test_production_profile(monkeypatch):
+    monkeypatch.setattr('app.database.DB_PROFILE', 'production')
+    monkeypatch.setenv('DB_POOL_SIZE', '5')
+    assert engine_options() == {'pool_pre_ping': True, 'pool_size': 5, 'max_overflow': 20,
+                                'pool_timeout': 30, 'pool_recycle': 1800}
+    assert sqlite_pragmas() == ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL', 'PRAGMA busy_timeout=5000',
+                                f'PRAGMA mmap_size={256 * 1024 * 1024}', f'PRAGMA cache_size={-64 * 1024}']
+
+
+def test_minimal_profile(monkeypatch):
+    monkeypatch.setattr('app.database.DB_PROFILE', 'minimal')
+    assert engine_options() == {}
+    assert sqlite_pragmas() == []
+    # Single settings can still be turned on
+    monkeypatch.setenv('SQLITE_BUSY_TIMEOUT_MS', '100')
+    assert sqlite_pragmas() == ['PRAGMA busy_timeout=100']
+
+
+def test_in_memory_sqlite_takes_no_pool_sizes_or_wal(monkeypatch):
+    monkeypatch.setattr('app.database.DB_PROFILE', 'production')
+    monkeypatch.setattr('app.database.IS_MEMORY_SQLITE', True)
+    assert engine_options() == {'pool_pre_ping': True}
+    assert 'PRAGMA journal_mode=WAL' not in sqlite_pragmas()
+
+
+def test_connections_get_the_pragmas(database):
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+        assert connection.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
@@ -0,0 +1,60 @@
+'''ETags and conditional requests'''
+from datetime import datetime
+
+import pytest
+
+from app.models import ConflictData
+from app.utils.version_utils import TABLE_SCOPE, cache_headers, etag_matches
+
+VERSIONS = {TABLE_SCOPE: (4, datetime(2024, 6, 3)), 'kenya': (2, datetime(2024, 6, 1)), 'ghana': (1, None)}
+
+
+@pytest.mark.parametrize('if_none_match, matches', [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", "abc"', True),
+    ('*', True),
+    ('"xyz"', False),
+    ('abc', False),
+    (None, False),
+    ('', False),
+])
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, {'ETag': '"abc"'}) is matches
+
+
+def test_no_etag_never_matches():
+    assert not etag_matches('*', {})
+
+
+def test_cache_headers_follow_versions():
+    headers = cache_headers(VERSIONS, ['kenya', 'ghana'])
+    assert headers == cache_headers(VERSIONS, ['ghana', 'kenya', 'kenya'])
+    assert headers['Last-Modified'] == 'Sat, 01 Jun 2024 00:00:00 GMT'
+    assert cache_headers({**VERSIONS, 'ghana': (2, None)}, ['kenya', 'ghana'])['ETag'] != headers['ETag']
+    # A scope without a version (e.g. an unknown country) gets no validators
+    assert cache_headers(VERSIONS, ['kenya', 'atlantis']) == {}
+
+
+def test_304_until_the_country_changes(client, db):
+    url = '/v1/conflictdata/Kenya'
+    etag = client.get(url).headers['ETag']
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.content == b''
+
+    # Another country's data leaves it alone
+    ghana = db.query(ConflictData).filter(ConflictData.country == 'Ghana', ConflictData.admin1 == 'Ashanti').one()
+    ghana.events += 1
+    db.commit()
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    nairobi = db.query(ConflictData).filter(ConflictData.country == 'Kenya', ConflictData.admin1 == 'Nairobi').one()
+    try:
+        nairobi.events += 1
+        db.commit()
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200 and response.headers['ETag'] != etag
+    finally:
+        ghana.events -= 1
+        nairobi.events -= 1
+        db.commit()
@@ -0,0 +1,49 @@
+'''Streaming conflict data export'''
+import csv
+import io
+import json
+
+from app.utils.export_utils import csv_chunks, iter_export_partitions, ndjson_chunks
+
+URL = '/v1/export/conflictdata'
+
+
+def test_partitions(db):
+    partitions = list(iter_export_partitions(db, chunk_rows=3))
+    assert [len(rows) for rows in partitions] == [3, 3, 1]
+    assert [len(rows) for rows in iter_export_partitions(db, ['kenya', 'ghana'], chunk_rows=3)] == [3, 2]
+
+
+def test_chunk_encoders():
+    partitions = [[(1, 'Kenya', 'Nairobi', None, 120, 7)], [(2, 'Kenya', 'Mombasa, coast', 1200000, 40, 4)]]
+    assert list(csv_chunks(partitions)) == [
+        b'id,country,admin1,population,events,risk_score\n1,Kenya,Nairobi,,120,7\n',
+        b'2,Kenya,"Mombasa, coast",1200000,40,4\n',
+    ]
+    assert list(csv_chunks([])) == [b'id,country,admin1,population,events,risk_score\n']
+    assert [json.loads(line) for chunk in ndjson_chunks(partitions) for line in chunk.splitlines()] == [
+        {'id': 1, 'country': 'Kenya', 'admin1': 'Nairobi', 'population': None, 'events': 120, 'risk_score': 7},
+        {'id': 2, 'country': 'Kenya', 'admin1': 'Mombasa, coast', 'population': 1200000, 'events': 40, 'risk_score': 4},
+    ]
+
+
+def test_export_matches_the_list(client):
+    items = client.get('/v1/conflictdata', params={'page_size': 100}).json()['items']
+    for item in items:
+        del item['feedback_count']
+
+    response = client.get(URL)
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    assert response.headers['content-disposition'] == 'attachment; filename="conflict_data.ndjson"'
+    assert [json.loads(line) for line in response.text.splitlines()] == items
+
+    response = client.get(URL, params={'format': 'csv', 'country': 'Kenya'})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row['id']) for row in rows] == [item['id'] for item in items if item['country'] == 'Kenya']
+
+
+def test_export_etag(client):
+    etag = client.get(URL, params={'country': 'Ghana'}).headers['ETag']
+    response = client.get(URL, params={'country': 'ghana'}, headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.content == b''
+    assert client.get(URL, params={'format': 'xml'}).status_code == 422
@@ -0,0 +1,71 @@
+'''POST /v1/conflictdata/userfeedback'''
+import re
+
+import pytest
+from sqlalchemy import event
+
+from app.database import engine
+from app.models import ConflictData, UserFeedback
+
+URL = '/v1/conflictdata/userfeedback'
+
+
+@pytest.fixture
+def feedback_inserts():
+    '''Number of INSERT statements run against user_feedback while the test runs'''
+    count = [0]
+
+    def count_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO user_feedback'):
+            count[0] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_insert)
+    yield count
+    event.remove(engine, 'before_cursor_execute', count_insert)
+
+
+def test_results_per_item(client, auth_headers, db):
+    response = client.post(URL, headers=auth_headers['user'], json=[
+        {'admin1': 'nairobi', 'country': 'KENYA', 'feedback_text': 'First feedback note'},
+        {'admin1': 'Atlantis', 'feedback_text': 'Feedback for no region'},
+        {'admin1': 'Central', 'feedback_text': 'Feedback for two regions'},
+        {'admin1': 'Central', 'country': 'Ghana', 'feedback_text': 'Second feedback note'},
+    ])
+    assert response.status_code == 201
+    body = response.json()
+    assert body['summary'] == {'created': 2, 'not_found': 1, 'ambiguous': 1}
+    results = body['results']
+    assert [r['status'] for r in results] == ['created', 'not_found', 'ambiguous', 'created']
+    assert {(m['country'], m['admin1']) for m in results[2]['matches']} == {('Kenya', 'Central'), ('Ghana', 'Central')}
+
+    # Each id is the feedback written for its own item
+    for result, region, text in ((results[0], ('Kenya', 'Nairobi'), 'First feedback note'), (results[3], ('Ghana', 'Central'), 'Second feedback note')):
+        feedback = db.get(UserFeedback, result['feedback_id'])
+        conflict_data = db.get(ConflictData, feedback.conflict_data_id)
+        assert (conflict_data.country, conflict_data.admin1, feedback.feedback_text) == (*region, text)
+
+
+def test_nothing_written_is_200(client, auth_headers):
+    response = client.post(URL, headers=auth_headers['user'], json=[{'admin1': 'Atlantis', 'feedback_text': 'Feedback for no region'}])
+    assert response.status_code == 200
+    assert response.json()['summary'] == {'created': 0, 'not_found': 1, 'ambiguous': 0}
+
+
+def test_ids_follow_item_order(client, auth_headers, db):
+    regions = ['Nairobi', 'Mombasa', 'Abidjan', 'Eastern Cape', 'Ashanti'] * 20
+    response = client.post(URL, headers=auth_headers['user'],
+                           json=[{'admin1': admin1, 'feedback_text': f'Feedback note {i}'} for i, admin1 in enumerate(regions)])
+    for i, result in enumerate(response.json()['results']):
+        assert db.get(UserFeedback, result['feedback_id']).feedback_text == f'Feedback note {i}'
+
+
+def test_statements_do_not_grow_with_batch(client, auth_headers, feedback_inserts):
+    statements = {}
+    for size in (2, 50):
+        feedback_inserts[0] = 0
+        response = client.post(URL, headers=auth_headers['user'],
+                               json=[{'admin1': 'Nairobi', 'feedback_text': f'Feedback note {i}'} for i in range(size)])
+        assert response.status_code == 201
+        assert feedback_inserts[0] == 1
+        statements[size] = int(re.search(r'(\d+) statements', response.headers['Server-Timing']).group(1))
+    assert statements[2] == statements[50]
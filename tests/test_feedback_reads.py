@@ -0,0 +1,82 @@
+'''Keyset-paginated feedback reads and per-region feedback counts'''
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete
+
+from app.auth import create_token, hash_password
+from app.models import ConflictData, User, UserFeedback
+
+START = datetime(2024, 6, 3, 12)
+
+
+@pytest.fixture
+def feedback(db, scratch_rows):
+    '''A user with feedback on two Testland regions: {'user', 'headers', 'regions', 'notes' (in the order added)}'''
+    user = User(email='feedback-reader@test.com', hashed_password=hash_password('password123'))
+    north = ConflictData(country='Testland', admin1='North', events=1, risk_score=1)
+    south = ConflictData(country='Testland', admin1='South', events=1, risk_score=1)
+    db.add_all([user, north, south])
+    db.flush()
+    # Two notes share a created_at, so their order comes from the id
+    notes = [UserFeedback(user_id=user.id, conflict_data_id=region.id, feedback_text=f'Note {i} on {region.admin1}',
+                          created_at=START + timedelta(minutes=minutes))
+             for i, (region, minutes) in enumerate([(south, 0), (north, 5), (north, 1), (north, 1), (south, 3)])]
+    db.add_all(notes)
+    db.commit()
+    yield {'user': user, 'headers': {'Authorization': f'Bearer {create_token(user.id)}'},
+           'regions': {'North': north.id, 'South': south.id}, 'notes': notes}
+    db.execute(delete(UserFeedback).where(UserFeedback.user_id == user.id))
+    db.execute(delete(User).where(User.id == user.id))
+    db.commit()
+
+
+def read_all(client, url, headers, page_size=2):
+    ids, cursor = [], None
+    while True:
+        page = client.get(url, params={'page_size': page_size, **({'cursor': cursor} if cursor else {})}, headers=headers)
+        assert page.status_code == 200
+        ids += [item['id'] for item in page.json()['items']]
+        cursor = page.json()['next_cursor']
+        if cursor is None:
+            return ids
+
+
+def test_pages(client, feedback):
+    n = [note.id for note in feedback['notes']]
+    headers = feedback['headers']
+    # Oldest first, then by id; a country region by region
+    assert read_all(client, '/v1/feedback/testland/NORTH', headers) == [n[2], n[3], n[1]]
+    assert read_all(client, '/v1/feedback/Testland', headers) == [n[2], n[3], n[1], n[0], n[4]]
+    assert read_all(client, f'/v1/feedback/users/{feedback["user"].id}', headers, page_size=3) == [n[0], n[2], n[3], n[4], n[1]]
+
+    item = client.get('/v1/feedback/Testland', params={'page_size': 1}, headers=headers).json()['items'][0]
+    assert {key: item[key] for key in ('user_id', 'conflict_data_id', 'country', 'admin1', 'feedback_text')} == {
+        'user_id': feedback['user'].id, 'conflict_data_id': feedback['regions']['North'], 'country': 'Testland',
+        'admin1': 'North', 'feedback_text': 'Note 2 on North'}
+
+
+def test_access_and_errors(client, auth_headers, feedback):
+    url = f'/v1/feedback/users/{feedback["user"].id}'
+    assert client.get(url, headers=auth_headers['user']).status_code == 403
+    assert client.get(url, headers=auth_headers['admin']).status_code == 200
+    assert client.get('/v1/feedback/users/999999', headers=auth_headers['admin']).status_code == 404
+    assert client.get('/v1/feedback/Testland').status_code in (401, 403)
+    assert client.get('/v1/feedback/Atlantis', headers=feedback['headers']).status_code == 404
+    assert client.get('/v1/feedback/Testland/West', headers=feedback['headers']).status_code == 404
+    for cursor in ('not-a-cursor', 'WyJhIiwgMV0'):
+        assert client.get('/v1/feedback/Testland', params={'cursor': cursor}, headers=feedback['headers']).status_code == 400
+
+
+def test_counts_and_list_etags(client, feedback):
+    url = '/v1/conflictdata/Testland'
+    response = client.get(url)
+    assert {item['admin1']: item['feedback_count'] for item in response.json()['items']} == {'North': 3, 'South': 2}
+
+    # New feedback changes the ETag of lists holding the region
+    etag = response.headers['ETag']
+    assert client.post('/v1/conflictdata/South/userfeedback', params={'country': 'Testland'},
+                       json={'feedback_text': 'One more note on South'}, headers=feedback['headers']).status_code == 201
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert {item['admin1']: item['feedback_count'] for item in response.json()['items']} == {'North': 3, 'South': 3}
@@ -0,0 +1,64 @@
+'''Bounded executor for password hashing'''
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app import auth
+from app.utils.hashing_utils import BoundedExecutor, LatencyStats, PoolSaturated
+
+
+def test_latency_percentiles():
+    stats = LatencyStats(window=4)
+    assert stats.percentile(0.5) == 0.0
+    for seconds in (5, 1, 2, 3, 4):
+        stats.observe(seconds)
+    # Totals count every sample, percentiles only the most recent `window`
+    assert stats.snapshot() == {'count': 5, 'mean_seconds': 3.0, 'p50_seconds': 3, 'p99_seconds': 4, 'max_seconds': 5}
+
+
+def test_rejects_past_the_queue():
+    pool = BoundedExecutor(workers=1, max_queue=1, name='test')
+    release = threading.Event()
+
+    async def main():
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(lambda: 'queued'))
+        await asyncio.sleep(0)  # both take their slots
+        with pytest.raises(PoolSaturated):
+            await pool.run(lambda: 'rejected')
+        release.set()
+        results = await asyncio.gather(running, queued)
+        # Slots are given back, so later calls run again
+        return results + [await pool.run(lambda: 'after')]
+
+    try:
+        assert asyncio.run(main()) == [True, 'queued', 'after']
+    finally:
+        pool.shutdown()
+    assert pool.metrics()['rejected'] == 1
+    assert pool.metrics()['run']['count'] == 3
+
+
+def test_no_workers_uses_the_shared_threadpool():
+    pool = BoundedExecutor(workers=0, max_queue=0)
+    assert asyncio.run(pool.run(sum, [1, 2])) == 3
+    assert pool.metrics()['workers'] == 0
+
+
+def test_saturated_hashing_is_a_429(monkeypatch):
+    class Saturated:
+        async def run(self, fn, *args):
+            raise PoolSaturated('password-hash')
+
+    monkeypatch.setattr(auth, 'hash_pool', Saturated())
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(auth.verify_password_async('password123', auth.hash_password('password123')))
+    assert (e.value.status_code, e.value.headers) == (429, {'Retry-After': '1'})
+
+
+def test_hashes_verify():
+    hashed = asyncio.run(auth.hash_password_async('password123'))
+    assert asyncio.run(auth.verify_password_async('password123', hashed))
+    assert not asyncio.run(auth.verify_password_async('password124', hashed))
@@ -0,0 +1,101 @@
+'''History loading (periods from files and snapshots) and the time series read from it'''
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.models import ConflictDataHistory
+from app.utils.history_utils import (ingest_history_file, ingest_history_records, parse_history_record, period_start,
+                                     snapshot_current)
+from app.utils.ingest_utils import summarise
+
+RECORD = {'country': 'Kenya', 'admin1': 'Nairobi', 'population': '4400000', 'events': '100', 'score': '6'}
+
+
+@pytest.mark.parametrize('period, expected', [
+    ('2024-06-03', date(2024, 6, 3)),  # a Monday, kept
+    ('2024-06-05', date(2024, 6, 3)),  # mid-week
+    ('2024-06-09T23:00:00', date(2024, 6, 3)),  # Sunday, with a time
+])
+def test_period_is_stored_as_its_start(period, expected):
+    assert parse_history_record({**RECORD, 'period': period})['period'] == expected
+
+
+@pytest.mark.parametrize('period', [None, '', '2024-13-01', 'last week'])
+def test_invalid_period_is_rejected(period):
+    with pytest.raises(ValueError, match='invalid period'):
+        parse_history_record({**RECORD, 'period': period})
+
+
+def test_file_and_snapshot_share_a_period(client, db, tmp_path):
+    path = tmp_path / 'history.csv'
+    path.write_text('country,admin1,population,events,score,period\n'
+                    'Kenya,Nairobi,4400000,100,6,2024-06-05\n'
+                    'Kenya,Mombasa,1200000,30,3,2024-06-07\n')
+    assert ingest_history_file(str(path))['inserted'] == 2
+
+    # The snapshot of the same week adds every other region, and skips the two already loaded
+    added = snapshot_current(db, period_start(date(2024, 6, 6)))
+    db.commit()
+    assert added == 5
+
+    rows = db.execute(
+        select(ConflictDataHistory.admin1, ConflictDataHistory.period, ConflictDataHistory.events)
+        .where(ConflictDataHistory.country_key == 'kenya')
+        .order_by(ConflictDataHistory.admin1)
+    ).all()
+    assert [tuple(r) for r in rows] == [
+        ('Central', date(2024, 6, 3), 10), ('Mombasa', date(2024, 6, 3), 30), ('Nairobi', date(2024, 6, 3), 100),
+    ]
+
+    response = client.get('/v1/history/Kenya/Nairobi', params={'start': '2024-06-01', 'end': '2024-06-30'})
+    assert [item['period'] for item in response.json()['items']] == ['2024-06-03']
+
+
+@pytest.fixture
+def testland_history(db):
+    '''Four weeks of Testland history: North's events grow by 10 a week, South is recorded from the second week'''
+    records = [(i, {'country': 'Testland', 'admin1': 'North', 'population': 1000, 'events': 10 * (week + 1),
+                    'score': 2, 'period': f'2024-05-{6 + 7 * week:02d}'}) for i, week in enumerate(range(4))]
+    records += [(10 + week, {'country': 'Testland', 'admin1': 'South', 'population': None, 'events': 5,
+                             'score': 6, 'period': f'2024-05-{6 + 7 * week:02d}'}) for week in range(1, 4)]
+    summary = summarise(ingest_history_records(records, db))
+    assert summary['inserted'] == 7
+    # Loading a period again adds nothing
+    assert summarise(ingest_history_records(records[:1], db))['unchanged'] == 1
+    yield
+    db.execute(delete(ConflictDataHistory).where(ConflictDataHistory.country_key == 'testland'))
+    db.commit()
+
+
+def test_region_series(client, testland_history):
+    response = client.get('/v1/history/TESTLAND/north').json()
+    assert (response['country'], response['admin1'], response['rows_returned']) == ('Testland', 'North', 4)
+    first, second = response['items'][:2]
+    assert (first['previous_period'], first['events_change']) == (None, None)
+    assert (second['previous_period'], second['events'], second['events_change'], second['events_change_pct']) == \
+        ('2024-05-06', 20, 10, 100)
+    assert second['population_change_pct'] == 0
+
+
+def test_country_series(client, testland_history):
+    items = client.get('/v1/history/Testland').json()['items']
+    assert [(item['period'], item['regions'], item['events'], item['risk_score_avg']) for item in items] == [
+        ('2024-05-06', 1, 10, 2), ('2024-05-13', 2, 25, 4), ('2024-05-20', 2, 35, 4), ('2024-05-27', 2, 45, 4)]
+    assert items[1]['regions_change'] == 1 and items[1]['population_change'] == 0
+
+
+def test_ranges_keep_their_baseline(client, testland_history):
+    url = '/v1/history/Testland/North'
+    # The period before `start` is read for the first item's changes, but not returned
+    items = client.get(url, params={'start': '2024-05-10', 'end': '2024-05-21'}).json()['items']
+    assert [(item['period'], item['previous_period'], item['events_change']) for item in items] == [
+        ('2024-05-13', '2024-05-06', 10), ('2024-05-20', '2024-05-13', 10)]
+    # `limit` keeps the latest periods
+    items = client.get(url, params={'limit': 2}).json()['items']
+    assert [(item['period'], item['previous_period']) for item in items] == [
+        ('2024-05-20', '2024-05-13'), ('2024-05-27', '2024-05-20')]
+
+    assert client.get(url, params={'start': '2024-06-01', 'end': '2024-05-01'}).status_code == 400
+    assert client.get(url, params={'start': '2025-01-01'}).status_code == 404
+    assert client.get('/v1/history/Atlantis').status_code == 404
@@ -0,0 +1,87 @@
+'''Bulk ingestion: record parsing, streaming readers and upserts'''
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app.models import ConflictData
+from app.utils.ingest_utils import aiter_lines, aiter_records, ingest_records, parse_record, read_records, summarise
+
+
+def test_parse_record():
+    values = parse_record({'country': 'Ömland', 'admin1': 'North', 'population': '', 'events': '3', 'score': '4'})
+    assert values == {'country': 'Ömland', 'admin1': 'North', 'population': None, 'events': 3, 'risk_score': 4,
+                      'country_key': 'ömland', 'admin1_key': 'north'}
+    # `risk_score` is used when present, `score` otherwise
+    assert parse_record({'country': 'A', 'admin1': 'B', 'events': 1, 'risk_score': 2, 'score': 9})['risk_score'] == 2
+
+
+@pytest.mark.parametrize('raw, error', [
+    ('not json', 'not an object'),
+    ({'admin1': 'B', 'events': 1, 'score': 1}, 'missing country'),
+    ({'country': ' ', 'admin1': 'B', 'events': 1, 'score': 1}, 'missing country'),
+    ({'country': 'A', 'admin1': 'B' * 101, 'events': 1, 'score': 1}, 'admin1 longer than 100'),
+    ({'country': 'A', 'admin1': 'B', 'score': 1}, 'missing events'),
+    ({'country': 'A', 'admin1': 'B', 'events': 'many', 'score': 1}, 'invalid events'),
+    ({'country': 'A', 'admin1': 'B', 'events': 1, 'population': '1e6', 'score': 1}, 'invalid population'),
+])
+def test_parse_record_rejects(raw, error):
+    with pytest.raises(ValueError, match=error):
+        parse_record(raw)
+
+
+def test_read_records(tmp_path):
+    csv_path = tmp_path / 'rows.csv'
+    csv_path.write_text('country,admin1,events,score\nTestland,North,1,2\n"Testland","South, coast",3,4\n', encoding='utf-8')
+    assert list(read_records(str(csv_path))) == [
+        (2, {'country': 'Testland', 'admin1': 'North', 'events': '1', 'score': '2'}),
+        (3, {'country': 'Testland', 'admin1': 'South, coast', 'events': '3', 'score': '4'}),
+    ]
+    ndjson_path = tmp_path / 'rows.ndjson'
+    ndjson_path.write_text('{"country": "Testland"}\n\n{broken\n', encoding='utf-8')
+    assert list(read_records(str(ndjson_path))) == [(1, {'country': 'Testland'}), (3, '{broken\n')]
+
+
+def test_async_readers_match_the_file_readers():
+    body = '﻿country,admin1,events,score\nTestland,"North\nshore",1,2\nÖmland,Ost,3,4\n'.encode('utf-8')
+
+    async def records(chunk_size):
+        async def chunks():
+            for i in range(0, len(body), chunk_size):
+                yield body[i:i + chunk_size]
+        return [record async for record in aiter_records(aiter_lines(chunks()), 'csv')]
+
+    # Chunks split inside lines and inside multi-byte characters give the same records
+    expected = [(2, {'country': 'Testland', 'admin1': 'North\nshore', 'events': '1', 'score': '2'}),
+                (4, {'country': 'Ömland', 'admin1': 'Ost', 'events': '3', 'score': '4'})]
+    for chunk_size in (1, 7, len(body)):
+        assert asyncio.run(records(chunk_size)) == expected
+
+
+def test_upserts_keep_ids(db, scratch_rows):
+    rows = [
+        (1, {'country': 'Testland', 'admin1': 'North', 'events': 1, 'score': 2}),
+        (2, {'country': 'Testland', 'admin1': 'South', 'events': 3, 'score': 4}),
+        (3, {'country': 'Testland', 'events': 3, 'score': 4}),
+    ]
+    batches = list(ingest_records(rows, db, batch_size=2))
+    assert [batch['rows'] for batch in batches] == [2, 1]
+    summary = summarise(batches)
+    assert (summary['inserted'], summary['updated'], summary['unchanged'], summary['rejected']) == (2, 0, 0, 1)
+    assert summary['rejects'] == [{'line': 3, 'error': 'missing admin1'}]
+    ids = dict(db.execute(select(ConflictData.admin1, ConflictData.id).where(ConflictData.country == 'Testland')).all())
+
+    # Keys match case-insensitively, and the names take the new spelling.
+    # The last of a key's duplicates within a batch wins
+    rows = [
+        (1, {'country': 'TESTLAND', 'admin1': 'north', 'events': 1, 'score': 2}),
+        (2, {'country': 'Testland', 'admin1': 'South', 'events': 5, 'score': 4}),
+        (3, {'country': 'Testland', 'admin1': 'South', 'events': 6, 'score': 4}),
+    ]
+    summary = summarise(ingest_records(rows, db))
+    assert (summary['inserted'], summary['updated'], summary['unchanged']) == (0, 2, 1)
+    db.expire_all()
+    assert db.get(ConflictData, ids['South']).events == 6
+    north = db.get(ConflictData, ids['North'])
+    assert (north.country, north.admin1) == ('TESTLAND', 'north')
+    assert db.query(ConflictData).filter(ConflictData.country_key == 'testland').count() == 2
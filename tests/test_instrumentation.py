@@ -0,0 +1,62 @@
+'''Request timing, SQL counting and the /metrics endpoint'''
+import logging
+import re
+
+from app.instrumentation import Counter, Histogram, check_row_counting, route_label
+from app.routes import conflict_data
+
+
+def test_histogram_and_counter_text():
+    histogram = Histogram('latency_seconds', 'Latency', (0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(('GET', '/a'), value)
+    assert histogram.render(('method', 'route'))[2:] == [
+        'latency_seconds_bucket{method="GET",route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{method="GET",route="/a",le="1.0"} 2',
+        'latency_seconds_bucket{method="GET",route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{method="GET",route="/a"} 5.55',
+        'latency_seconds_count{method="GET",route="/a"} 3',
+    ]
+    counter = Counter('requests_total', 'Requests')
+    counter.inc(('say "hi"\n',), 2)
+    assert counter.render(('path',))[2:] == ['requests_total{path="say \\"hi\\"\\n"} 2']
+
+
+def test_row_counting_supports_the_installed_sqlalchemy():
+    check_row_counting()
+
+
+def test_route_label():
+    # Routes of included routers hold their path without the `/v1` prefix
+    route = next(r for r in conflict_data.router.routes if r.name == 'get_conflict_data_per_country')
+    scope = {'route': route, 'path': '/v1/conflictdata/Kenya', 'path_params': {'country': 'Kenya'}}
+    assert route_label(scope) == '/v1/conflictdata/{country}'
+    assert route_label({'path': '/nowhere'}) == 'unmatched'
+
+
+def test_server_timing(client):
+    timing = client.get('/v1/conflictdata', params={'country': 'Kenya', 'include_total': False}).headers['Server-Timing']
+    statements, rows = map(int, re.search(r'desc="(\d+) statements, (\d+) rows"', timing).groups())
+    assert statements >= 1
+    assert rows >= 3  # Kenya's regions, at least
+
+
+def test_access_log(client, caplog, monkeypatch):
+    monkeypatch.setattr('app.instrumentation.ACCESS_LOG', True)
+    with caplog.at_level(logging.INFO, logger='app.access'):
+        client.get('/v1/countries/Kenya')
+        monkeypatch.setattr('app.instrumentation.SQL_STATEMENT_WARN_THRESHOLD', 0)
+        client.get('/v1/countries/Kenya')
+    first, second = [r for r in caplog.records if r.name == 'app.access']
+    assert (first.levelno, second.levelno) == (logging.INFO, logging.WARNING)
+    assert (first.route, first.status) == ('/v1/countries/{country}', 200)
+    assert first.sql_statements >= 1
+
+
+def test_metrics(client):
+    client.get('/v1/countries/Ghana')
+    text = client.get('/metrics').text
+    assert re.search(r'^http_requests_total\{method="GET",route="/v1/countries/\{country\}",status="200"\} \d+',
+                     text, re.MULTILINE)
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/v1/countries/{country}",le="+Inf"}' in text
+    assert 'password_hash_pool_rejected_total' in text
@@ -0,0 +1,56 @@
+'''app.migrations on databases created before the lookup keys'''
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app.migrations import add_conflict_data_lookup_keys
+
+OLD_SCHEMA = '''
+CREATE TABLE conflict_data (
+    id INTEGER PRIMARY KEY, country VARCHAR(100) NOT NULL, admin1 VARCHAR(100) NOT NULL, population INTEGER,
+    events INTEGER NOT NULL, risk_score INTEGER NOT NULL, created_at DATETIME, updated_at DATETIME
+)
+'''
+
+
+@pytest.fixture
+def old_database(tmp_path):
+    '''Engine on a conflict_data table without country_key/admin1_key'''
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as conn:
+        conn.execute(text(OLD_SCHEMA))
+    yield engine
+    engine.dispose()
+
+
+def insert_regions(engine, *regions):
+    with engine.begin() as conn:
+        conn.execute(text('INSERT INTO conflict_data (country, admin1, events, risk_score) VALUES (:country, :admin1, 1, 1)'),
+                     [{'country': country, 'admin1': admin1} for country, admin1 in regions])
+
+
+def test_adds_not_null_keys_and_indexes(old_database):
+    insert_regions(old_database, ('Côte d\'Ivoire', 'Abidjan'), ('ÖSTERREICH', 'Wien'))
+    with old_database.begin() as conn:
+        add_conflict_data_lookup_keys(conn)
+        # Running again is a no-op
+        add_conflict_data_lookup_keys(conn)
+
+    inspector = inspect(old_database)
+    columns = {c['name']: c for c in inspector.get_columns('conflict_data')}
+    assert not columns['country_key']['nullable'] and not columns['admin1_key']['nullable']
+    assert 'idx_country_key_admin1_key' in {i['name'] for i in inspector.get_indexes('conflict_data')}
+    with old_database.connect() as conn:
+        keys = conn.execute(text('SELECT country_key, admin1_key FROM conflict_data ORDER BY id')).all()
+    assert [tuple(k) for k in keys] == [('côte d\'ivoire', 'abidjan'), ('österreich', 'wien')]
+
+
+def test_fails_on_regions_differing_only_by_case_or_unicode_form(old_database):
+    # The last is the first with a decomposed (NFD) accent
+    insert_regions(old_database, ('Kenya', 'Nairobi'), ('KENYA', 'nairobi'), ('Kenya', 'Mombasa'),
+                   ('Côte d\'Ivoire', 'Abidjan'), ('Co\u0302te d\'Ivoire', 'ABIDJAN'))
+    with pytest.raises(RuntimeError, match=r'4 conflict_data rows .*id 1: Kenya / Nairobi; id 2: KENYA / nairobi; id 4: '):
+        with old_database.begin() as conn:
+            add_conflict_data_lookup_keys(conn)
+
+    # Rolled back: the database is as it was, so it can be fixed and migrated again
+    assert 'country_key' not in {c['name'] for c in inspect(old_database).get_columns('conflict_data')}
@@ -0,0 +1,54 @@
+'''Keyset (cursor) pagination of GET /v1/conflictdata'''
+import pytest
+from fastapi import HTTPException
+
+from app.utils.pagination_utils import decode_cursor, encode_cursor
+
+from conftest import REGIONS
+
+
+@pytest.mark.parametrize('values', [('kenya', 'nairobi', 3), ('côte d\'ivoire', 'abidjan', 12), ('a', 'b', 0)])
+def test_cursor_round_trip(values):
+    cursor = encode_cursor(*values)
+    assert '=' not in cursor and '/' not in cursor and '+' not in cursor
+    assert decode_cursor(cursor, 3) == list(values)
+
+
+@pytest.mark.parametrize('cursor', ['', 'not a cursor', encode_cursor('kenya', 'nairobi'), encode_cursor(1, 2, 3)[:-2] + '!!'])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, 3)
+    assert error.value.status_code == 400
+
+
+def test_cursor_pages_cover_every_row_once(client):
+    seen, cursor = [], None
+    while True:
+        params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+        body = client.get('/v1/conflictdata', params=params).json()
+        assert len(body['items']) <= 2
+        if cursor:
+            # No count unless asked for
+            assert body['rows_returned'] is None and body['total_pages'] is None
+        seen.extend((item['country'], item['admin1']) for item in body['items'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == len(REGIONS)
+    assert seen == sorted(seen, key=lambda region: (region[0].casefold(), region[1].casefold()))
+
+
+def test_cursor_pages_match_offset_pages(client):
+    by_offset = client.get('/v1/conflictdata', params={'page_size': 3, 'offset': 3}).json()
+    first = client.get('/v1/conflictdata', params={'page_size': 3}).json()
+    by_cursor = client.get('/v1/conflictdata', params={'page_size': 3, 'cursor': first['next_cursor']}).json()
+    assert by_cursor['items'] == by_offset['items']
+
+
+@pytest.mark.parametrize('params', [
+    {'cursor': 'garbage'},
+    {'cursor': encode_cursor(1, 2, 3)},  # not (country_key, admin1_key, id)
+    {'cursor': encode_cursor('kenya', 'nairobi', 1), 'offset': 20},
+])
+def test_bad_cursor_requests_are_400(client, params):
+    assert client.get('/v1/conflictdata', params=params).status_code == 400
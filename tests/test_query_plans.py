@@ -0,0 +1,7 @@
+'''Every conflict data query of the endpoints uses an index (see scripts.check_query_plans)'''
+from scripts.check_query_plans import check_query_plans
+
+
+def test_every_query_uses_an_index():
+    failures = check_query_plans()
+    assert not failures, '\n'.join(f'{name} does not use an index: {statement} {plan}' for name, statement, plan in failures)
@@ -0,0 +1,89 @@
+'''Token buckets, limit parsing and charging coalesced copies'''
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import rate_limit
+from app.rate_limit import (DatabaseRateLimitBackend, MemoryRateLimitBackend, RateLimiter, charge_copy,
+                            parse_limit, parse_route_limits)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, 'time', SimpleNamespace(monotonic=clock, time=clock))
+    return clock
+
+
+def test_parse_limits():
+    assert parse_limit('2/10') == (2.0, 10.0)
+    assert parse_limit('5') == (5.0, 5.0)
+    assert parse_limit(' off ') is None
+    assert parse_route_limits('get_conflict_data=2/10, get_risk_score_average=off') == {
+        'get_conflict_data': (2.0, 10.0), 'get_risk_score_average': None}
+    for value in ('0/10', '2/0.5', 'fast'):
+        with pytest.raises(ValueError):
+            parse_limit(value)
+
+
+@pytest.mark.parametrize('backend', [MemoryRateLimitBackend, DatabaseRateLimitBackend])
+def test_bucket_refill(backend, clock, database):
+    bucket = backend()
+    bucket.clear()
+    try:
+        # A full bucket of 3, then empty
+        assert [bucket.take('k', 2, 3)[0] for _ in range(4)] == [True, True, True, False]
+        assert bucket.take('k', 2, 3) == (False, pytest.approx(0.5))
+        # Half a second at 2/s refills one token, and no more than the burst however long idle
+        clock.now += 0.5
+        assert bucket.take('k', 2, 3) == (True, 0.0)
+        assert not bucket.take('k', 2, 3)[0]
+        clock.now += 3600
+        assert [bucket.take('k', 2, 3)[0] for _ in range(4)] == [True, True, True, False]
+        # Buckets are per key
+        assert bucket.take('other', 2, 3)[0]
+    finally:
+        bucket.clear()
+
+
+def test_memory_backend_drops_least_recently_used(clock):
+    bucket = MemoryRateLimitBackend(max_keys=2)
+    bucket.take('a', 1, 1)
+    bucket.take('b', 1, 1)
+    bucket.take('a', 1, 1)
+    bucket.take('c', 1, 1)
+    # `a` was used more recently than `b`, so kept and still empty; `b` was dropped, so starts full again
+    assert not bucket.take('a', 1, 1)[0]
+    assert bucket.take('b', 1, 1)[0]
+
+
+def request_scope(client_host):
+    return {'type': 'http', 'method': 'GET', 'path': '/v1/conflictdata/Kenya', 'query_string': b'',
+            'headers': [], 'client': (client_host, 50000)}
+
+
+def test_charge_copy(clock, monkeypatch):
+    limiter = RateLimiter(MemoryRateLimitBackend(), None, {'get_country_data': (1, 2)}, enabled=True)
+    monkeypatch.setattr(rate_limit, 'rate_limiter', limiter)
+
+    async def charge(client_host, route_name='get_country_data'):
+        return await charge_copy(request_scope(client_host), route_name)
+
+    # Copies take tokens from their own client's bucket for the leader's route
+    assert asyncio.run(charge('10.0.0.1')) is None
+    assert asyncio.run(charge('10.0.0.1')) is None
+    rejected = asyncio.run(charge('10.0.0.1'))
+    assert rejected.status_code == 429
+    assert rejected.headers['Retry-After'] == '1'
+    assert asyncio.run(charge('10.0.0.2')) is None
+    # Routes without a limit are never charged
+    assert asyncio.run(charge('10.0.0.1', 'get_regions')) is None
@@ -0,0 +1,54 @@
+'''Region search index'''
+import pytest
+
+from app.models import ConflictData
+from app.search import RegionIndexStore, search_key, word_starts
+
+URL = '/v1/regions/search'
+
+
+def test_keys():
+    assert search_key('São Tomé') == 'sao tome'
+    assert search_key('Côte d\'Ivoire') == 'cote d\'ivoire'
+    assert word_starts('eastern cape province') == ['cape province', 'province']
+
+
+def matches(client, q, **params):
+    return [(item['admin1'], item['match']) for item in client.get(URL, params={'q': q, **params}).json()['items']]
+
+
+@pytest.mark.parametrize('q, expected', [
+    ('NAI', [('Nairobi', 'admin1_prefix')]),
+    ('cape', [('Eastern Cape', 'admin1_word_prefix')]),
+    ('cent', [('Central', 'admin1_prefix'), ('Central', 'admin1_prefix')]),
+    ('cote', [('Abidjan', 'country_prefix')]),
+    ('africa', [('Eastern Cape', 'country_prefix')]),
+    ('nairbi', [('Nairobi', 'fuzzy')]),
+])
+def test_tiers(client, q, expected):
+    assert matches(client, q) == expected
+
+
+def test_tier_order_and_limits(client):
+    # No admin1 starts with `ke`, so Kenya's regions come by country prefix, in admin1 order
+    assert matches(client, 'ke') == [('Central', 'country_prefix'), ('Mombasa', 'country_prefix'),
+                                     ('Nairobi', 'country_prefix')]
+    assert len(matches(client, 'ke', limit=2)) == 2
+    assert matches(client, 'nairbi', fuzzy=False) == []
+    assert client.get(URL, params={'q': ''}).status_code == 422
+
+
+def test_rebuilds_only_changed_countries(db, scratch_rows):
+    store = RegionIndexStore(max_age=60)
+    first = store.current(db)
+    assert first.search('testl') == []
+
+    db.add(ConflictData(country='Testland', admin1='Lakeside', events=1, risk_score=1))
+    db.commit()
+    store.invalidate()
+    second = store.current(db)
+    assert [item['admin1'] for item in second.search('testl')] == ['Lakeside']
+    assert second.countries['kenya'] is first.countries['kenya']
+    # Unchanged versions keep the same index
+    store.invalidate()
+    assert store.current(db) is second
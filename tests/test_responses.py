@@ -0,0 +1,33 @@
+'''List responses built from column tuples and encoded with orjson'''
+import orjson
+from fastapi.responses import Response
+
+from app.utils.response_utils import ConflictDataList, FastJSONResponse, conflict_data_items, render
+from conftest import REGIONS
+
+
+def test_items_from_rows():
+    rows = [(1, 'Kenya', 'Nairobi', None, 120, 7, 'kenya', 'nairobi')]
+    assert conflict_data_items(rows) == [
+        {'id': 1, 'country': 'Kenya', 'admin1': 'Nairobi', 'population': None, 'events': 120, 'risk_score': 7}]
+
+
+def test_render():
+    result = ConflictDataList({'rows_returned': 2}, [(1, 'Kenya', 'Nairobi', 4400000, 120, 7), (2, 'Kenya', 'Mombasa', None, 40, 4)],
+                              {2: 3}, {'ETag': '"abc"'})
+    response = render(result)
+    assert isinstance(response, FastJSONResponse)
+    assert response.headers['ETag'] == '"abc"'
+    body = orjson.loads(response.body)
+    assert list(body) == ['rows_returned', 'items']
+    assert [(item['id'], item['feedback_count']) for item in body['items']] == [(1, 0), (2, 3)]
+
+    not_modified = Response(status_code=304)
+    assert render(not_modified) is not_modified
+
+
+def test_list_items_match_the_table(client):
+    items = client.get('/v1/conflictdata', params={'page_size': 100}).json()['items']
+    assert all(list(item) == ['id', 'country', 'admin1', 'population', 'events', 'risk_score', 'feedback_count']
+               for item in items)
+    assert sorted((i['country'], i['admin1'], i['population'], i['events'], i['risk_score']) for i in items) == sorted(REGIONS)
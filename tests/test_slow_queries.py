@@ -0,0 +1,44 @@
+'''Slow query captures'''
+import pytest
+from sqlalchemy import create_engine, text
+
+from app import slow_queries
+from app.slow_queries import _parameter_sets, _parameters, slow_query_log, watch_slow_queries
+
+
+@pytest.fixture
+def capture_everything(monkeypatch):
+    '''An in-memory engine whose every statement is captured, and an empty buffer'''
+    monkeypatch.setattr(slow_queries, 'SLOW_QUERY_THRESHOLD_MS', 0)
+    slow_query_log.clear()
+    engine = create_engine('sqlite://')
+    watch_slow_queries(engine)
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT, hashed_password TEXT)'))
+    yield engine
+    slow_query_log.clear()
+
+
+def test_parameter_values_are_redacted(capture_everything):
+    with capture_everything.begin() as conn:
+        conn.execute(text('INSERT INTO users (email, hashed_password) VALUES (:email, :hash)'),
+                     {'email': 'user1@test.com', 'hash': '$2b$12$secret'})
+    capture = slow_query_log.entries()[0]
+    assert capture['statement'].startswith('INSERT INTO users')
+    assert capture['parameters'] == ['<str>', '<str>']
+
+
+def test_values_only_when_enabled():
+    assert _parameters({'id': 7, 'text': 'x' * 300, 'none': None}) == {'id': '<int>', 'text': '<str>', 'none': None}
+    assert _parameters({'id': 7, 'text': 'x' * 300}, values=True) == {'id': 7, 'text': 'x' * 200 + '...'}
+
+
+@pytest.mark.parametrize('parameters, executemany, expected', [
+    ((1, 'a'), False, ((1, 'a'), None)),
+    ([(1, 'a'), (2, 'b')], True, ((1, 'a'), 2)),
+    ([{'id': 1}, {'id': 2}], True, ({'id': 1}, 2)),
+    # A batched "insertmanyvalues" INSERT: executemany, but the flat parameters of one statement
+    ((1, 'a', 2, 'b'), True, ((1, 'a', 2, 'b'), None)),
+])
+def test_parameter_sets(parameters, executemany, expected):
+    assert _parameter_sets(parameters, executemany) == expected
@@ -0,0 +1,89 @@
+'''In-memory snapshot of conflict_data'''
+import pytest
+
+from app.models import ConflictData
+from app.snapshot import ConflictSnapshot, SnapshotStore, snapshot_store
+
+# (id, country, admin1, country_key, admin1_key, population, events, risk_score), in sort order
+ROWS = [
+    (3, 'Ghana', 'Ashanti', 'ghana', 'ashanti', None, 30, 3),
+    (4, 'Ghana', 'Central', 'ghana', 'central', 2900000, 5, 1),
+    (7, 'Kenya', 'Central', 'kenya', 'central', 5000000, 10, 2),
+    (1, 'Kenya', 'Mombasa', 'kenya', 'mombasa', 1200000, 40, 4),
+    (2, 'Kenya', 'Nairobi', 'kenya', 'nairobi', 4400000, 120, 6),
+    (5, 'Togo', 'Plateaux', 'togo', 'plateaux', 100, 1, 1),
+]
+
+
+@pytest.fixture
+def snapshot():
+    return ConflictSnapshot(ROWS)
+
+
+def ids(rows):
+    return [row.id for row in rows]
+
+
+def test_rows_and_aggregates(snapshot):
+    assert len(snapshot) == 6
+    assert snapshot.row(0)._asdict() == {'id': 3, 'country': 'Ghana', 'admin1': 'Ashanti', 'population': None,
+                                         'events': 30, 'risk_score': 3, 'country_key': 'ghana', 'admin1_key': 'ashanti'}
+    assert snapshot.country_ranges == {'ghana': (0, 2), 'kenya': (2, 5), 'togo': (5, 6)}
+    assert (snapshot.risk_score_avg('kenya'), snapshot.risk_score_avg('atlantis')) == (4, None)
+    assert snapshot.count(['togo', 'ghana', 'atlantis']) == 3
+
+
+@pytest.mark.parametrize('country_keys, after, offset, limit, expected', [
+    (None, None, 0, None, [3, 4, 7, 1, 2, 5]),
+    (None, None, 1, 3, [4, 7, 1]),
+    (['togo', 'ghana'], None, 1, 2, [4, 5]),  # offsets carry across countries
+    (['kenya'], None, 5, 2, []),
+    (None, ('ghana', 'central', 4), 0, 2, [7, 1]),
+    (['ghana', 'togo'], ('kenya', 'central', 7), 0, None, [5]),
+    (['kenya'], ('kenya', 'mombasa', 0), 0, None, [1, 2]),  # a key between rows
+])
+def test_page(snapshot, country_keys, after, offset, limit, expected):
+    assert ids(snapshot.page(country_keys, after, offset, limit)) == expected
+
+
+def test_store(db):
+    store = SnapshotStore(enabled=False)
+    assert store.current(db) is None
+
+    store = SnapshotStore(enabled=True, max_age=60)
+    first = store.current(db)
+    assert len(first) == db.query(ConflictData).count()
+    assert store.current(db) is first
+    store.invalidate()
+    second = store.current(db)
+    assert second is not first and second.generation == 1
+
+    # Past max_age the table version is checked, and is unchanged here
+    store.max_age = 0
+    assert store.current(db) is second
+    second.versions = {}
+    assert store.current(db) is not second
+
+
+@pytest.mark.parametrize('url, params', [
+    ('/v1/conflictdata', {'page_size': 3, 'offset': 2}),
+    ('/v1/conflictdata', {'country': ['Kenya', 'ghana'], 'page_size': 4}),
+    ('/v1/conflictdata/Kenya', {}),
+    ('/v1/conflictdata/kenya/riskscore', {}),
+    ('/v1/conflictdata/Atlantis', {}),
+])
+def test_same_responses_as_the_table(client, monkeypatch, url, params):
+    expected = client.get(url, params=params)
+    monkeypatch.setattr(snapshot_store, 'enabled', True)
+    response = client.get(url, params=params)
+    assert snapshot_store._snapshot is not None
+    assert response.status_code == expected.status_code
+    assert response.json() == expected.json()
+    assert response.headers.get('ETag') == expected.headers.get('ETag')
+    # Cursor pages continue from the same place
+    cursor = response.json().get('next_cursor')
+    if cursor:
+        params = {**params, 'cursor': cursor}
+        from_snapshot = client.get(url, params=params).json()
+        monkeypatch.setattr(snapshot_store, 'enabled', False)
+        assert from_snapshot == client.get(url, params=params).json()
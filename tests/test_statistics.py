@@ -0,0 +1,69 @@
+'''Grouped country statistics, checked against a per-country computation with the standard library'''
+import math
+import statistics
+
+import numpy as np
+import pytest
+
+from app.utils.statistical_utils import country_statistics
+from conftest import REGIONS
+
+
+def expected(country):
+    rows = [row for row in REGIONS if row[0] == country]
+    risk_scores = [r for _, _, _, _, r in rows]
+    populated = [(p, e, r) for _, _, p, e, r in rows if p is not None]
+    population = sum(p for p, _, _ in populated)
+    return {
+        'regions': len(rows),
+        'regions_with_population': len(populated),
+        'total_events': sum(e for _, _, _, e, _ in rows),
+        'total_population': population,
+        'mean': statistics.fmean(risk_scores),
+        'std': statistics.pstdev(risk_scores),
+        'median': statistics.median(risk_scores),
+        'p25': float(np.percentile(risk_scores, 25)),
+        'p90': float(np.percentile(risk_scores, 90)),
+        'population_weighted_risk_score': sum(p * r for p, _, r in populated) / population,
+        'events_per_100k': sum(e for _, e, _ in populated) / population * 1e5,
+    }
+
+
+def test_matches_per_country_computation(client, db):
+    items = country_statistics(db, percentiles=(25, 90))
+    assert [item['country'] for item in items] == sorted({row[0] for row in REGIONS}, key=str.lower)
+    for item in items:
+        want = expected(item['country'])
+        for field in ('regions', 'regions_with_population', 'total_events', 'total_population'):
+            assert item[field] == want[field], (item['country'], field)
+        for field in ('mean', 'std', 'median'):
+            assert item['risk_score'][field] == pytest.approx(want[field]), (item['country'], field)
+        for q in ('p25', 'p90'):
+            assert item['risk_score']['percentiles'][q] == pytest.approx(want[q]), (item['country'], q)
+        for field in ('population_weighted_risk_score', 'events_per_100k'):
+            assert item[field] == pytest.approx(want[field]), (item['country'], field)
+
+
+def test_ranks_and_missing_population(client, db):
+    items = {item['country']: item for item in country_statistics(db, ['kenya', 'ghana'])}
+    assert items['Kenya']['ranks']['average_risk_score'] == 1
+    assert items['Ghana']['ranks']['average_risk_score'] == 2
+    # Ashanti has no population, so Ghana's weighted figures come from Central alone
+    assert items['Ghana']['regions_with_population'] == 1
+    assert items['Ghana']['population_weighted_risk_score'] == 1
+    assert not math.isnan(items['Ghana']['events_per_100k'])
+
+
+def test_statistics_endpoint(client):
+    url = '/v1/countries/statistics'
+    response = client.get(url, params={'country': ['Kenya', 'ghana', 'Atlantis']})
+    assert response.status_code == 200
+    assert [item['country'] for item in response.json()['items']] == ['Ghana', 'Kenya']
+    assert response.json()['not_found'] == ['Atlantis']
+
+    response = client.get(url, params={'country': ['Kenya', 'Ghana']})
+    etag = response.headers['ETag']
+    assert client.get(url, params={'country': ['Ghana', 'kenya']}, headers={'If-None-Match': etag}).status_code == 304
+
+    assert client.get(url, params={'country': 'Atlantis'}).status_code == 404
+    assert client.get(url, params={'percentile': 101}).status_code == 400
@@ -0,0 +1,26 @@
+'''Startup warm-up never stops the worker from starting'''
+import asyncio
+import logging
+
+from app import warmup
+
+
+def test_failing_step_is_skipped(client, monkeypatch, caplog):
+    def broken():
+        raise KeyError('no backend')
+
+    monkeypatch.setattr(warmup, 'warm_auth', broken)
+    timings = asyncio.run(warmup.warm_up(client.app))
+    assert timings['auth'] is None
+    assert timings['requests'] is not None
+    assert 'Warm-up step auth failed' in caplog.text
+
+
+def test_requests_without_a_response_are_reported(client, monkeypatch, caplog):
+    async def no_response(app, path):
+        return None
+
+    monkeypatch.setattr(warmup, 'request', no_response)
+    with caplog.at_level(logging.WARNING, logger='app.warmup'):
+        asyncio.run(warmup.warm_requests(client.app))
+    assert 'Warm-up requests failed: {None:' in caplog.text